@@ -9,10 +9,10 @@
 const orcidRegex = new RegExp(/^\d{4}-\d{4}-\d{4}-\d{3}[0-9X]$/);
 
 /**
- * Returns all credits associated with the specified ORCID ID,
- * from the Google Sheets document.
+ * Returns the column names of the Google Sheets document, and the rows (each of which is an
+ * array of cell values) of all credits associated with the specified ORCID ID.
  */
-function getCreditsByOrcidId(orcidId) {
+function getCreditRowsByOrcidId(orcidId) {
   const spreadsheet = SpreadsheetApp.openById(CONFIG.SPREADSHEET_ID);
   const sheet = spreadsheet.getSheetByName(CONFIG.SHEET_NAME);
 
@@ -25,20 +25,100 @@ function getCreditsByOrcidId(orcidId) {
   const orcidIdColumnIndex = columnNames.indexOf("column.ORCID_ID");
 
   // Find the rows that have the specified ORCID ID in that column.
-  const credits = values.filter((row) => row[orcidIdColumnIndex] === orcidId);
+  const rows = values.filter((row) => row[orcidIdColumnIndex] === orcidId);
 
-  // Convert the array of values into an array of objects, so the values are labeled.
-  // Example: [{ "col_A": "val_A1", "col_B": "val_B1" }, { "col_A": "val_A7", "col_B": "val_B7" }]
-  const labeledCredits = credits.map((cellValues) => {
+  return { columnNames, rows };
+}
+
+/**
+ * Converts the specified rows (arrays of cell values) into objects, so the values are labeled.
+ * Example: [{ "col_A": "val_A1", "col_B": "val_B1" }, { "col_A": "val_A7", "col_B": "val_B7" }]
+ */
+function labelRows(columnNames, rows) {
+  return rows.map((cellValues) => {
     let labeledRow = {};
     for (let i = 0; i < columnNames.length; i++) {
       labeledRow[columnNames[i]] = cellValues[i];
     }
     return labeledRow;
   });
+}
+
+/**
+ * Returns the properties of a response payload representing the specified rows (arrays of cell
+ * values), in the specified format:
+ * - "objects" (the default): `{ credits: [{ "col_A": "val_A1", "col_B": "val_B1" }, ...] }`
+ * - "columnar": `{ columns: ["col_A", "col_B"], rows: [["val_A1", "val_B1"], ...] }`; which
+ *   lists the column names only once. If `requestedColumns` (a comma-delimited list of column
+ *   names) is specified, only those columns are included.
+ */
+function encodeRows(columnNames, rows, format, requestedColumns) {
+  if (format !== "columnar") {
+    return { credits: labelRows(columnNames, rows) };
+  }
+  let columnIndexes = columnNames.map((_, i) => i);
+  if (requestedColumns) {
+    columnIndexes = requestedColumns
+      .split(",")
+      .map((name) => columnNames.indexOf(name))
+      .filter((i) => i >= 0);
+  }
+  return {
+    columns: columnIndexes.map((i) => columnNames[i]),
+    rows: rows.map((row) => columnIndexes.map((i) => row[i])),
+  };
+}
+
+/**
+ * Returns a string that identifies the current version of the specified sheet values.
+ * The string changes whenever any of the values changes.
+ */
+function computeVersion(values) {
+  const digest = Utilities.computeDigest(
+    Utilities.DigestAlgorithm.SHA_256,
+    JSON.stringify(values),
+  );
+  return Utilities.base64EncodeWebSafe(digest);
+}
+
+/**
+ * Returns all credits in the Google Sheets document (regardless of ORCID ID), along with
+ * the current version of the sheet. If the specified version is the current version, the
+ * credits are omitted (since the caller already has them).
+ *
+ * If a limit is specified, returns (at most) that many credits, starting at the specified
+ * offset (i.e. a "page" of credits); along with the offset of the next page (or `null`, if
+ * this is the last page) and the total number of credits.
+ *
+ * The credits are represented in the specified format (see `encodeRows`).
+ */
+function exportCredits(
+  sinceVersion,
+  offset = 0,
+  limit = null,
+  format = "objects",
+  requestedColumns = "",
+) {
+  const spreadsheet = SpreadsheetApp.openById(CONFIG.SPREADSHEET_ID);
+  const sheet = spreadsheet.getSheetByName(CONFIG.SHEET_NAME);
+
+  // Get all the values on the sheet.
+  const values = sheet.getDataRange().getValues();
+  const version = computeVersion(values);
+  const total = values.length - 1; // excludes the header row
+  const columnNames = values[0];
+  if (version === sinceVersion) {
+    const credits = encodeRows(columnNames, [], format, requestedColumns);
+    return { version, unchanged: true, ...credits, total, next_offset: null };
+  }
 
-  // Return the array of objects.
-  return labeledCredits;
+  // Encode the rows (other than the header row) of the page.
+  const end = limit === null ? total : Math.min(total, offset + limit);
+  const rows = values.slice(1 + offset, 1 + end);
+  const credits = encodeRows(columnNames, rows, format, requestedColumns);
+
+  const nextOffset = end < total ? end : null;
+  return { version, unchanged: false, ...credits, total, next_offset: nextOffset };
 }
 
 function test_markCreditAsClaimed() {
@@ -104,8 +184,13 @@ function test_compareOptionalDates() {
  * updates its "claimed at" timestamp (to indicate it's been claimed) and stores the
  * specified affiliation "put-code" on that row.
  *
- * Returns all credits associated with the specified ORCID ID, which will reflect
- * any updates made by this function.
+ * If a row having that combination has already been claimed with the specified "put-code"
+ * (e.g. because the app is retrying a claim whose response it did not receive), no row is
+ * updated; so that retrying a claim does not claim a second credit.
+ *
+ * Returns the column names and the rows of all credits associated with the specified
+ * ORCID ID (see `getCreditRowsByOrcidId`), which will reflect any updates made by this
+ * function.
  */
 function markCreditAsClaimed(
   creditType,
@@ -134,28 +219,39 @@ function markCreditAsClaimed(
   const startDateColumnIndex = columnNames.indexOf("column.START_DATE");
   const endDateColumnIndex = columnNames.indexOf("column.END_DATE");
   const claimedAtColumnIndex = columnNames.indexOf("column.CLAIMED_AT");
+  const affiliationPutCodeColumnIndex = columnNames.indexOf(
+    "column.AFFILIATION_PUT_CODE",
+  );
 
   // Determine the 1-based column _numbers_ of (a) the column indicating when the
   // credit was claimed, and (b) the column indicating the affiliation's "put-code".
   // Note: Google Sheets column numbers are 1-based.
   const claimedAtColumnNumber = claimedAtColumnIndex + 1;
-  const affiliationPutCodeColumnNumber =
-    columnNames.indexOf("column.AFFILIATION_PUT_CODE") + 1;
+  const affiliationPutCodeColumnNumber = affiliationPutCodeColumnIndex + 1;
 
   // Find the 1-based row _number_ of the first row having the specified combination
-  // of {credit type, ORCID ID, start date, end date} that has not been claimed yet.
+  // of {credit type, ORCID ID, start date, end date} that has not been claimed yet;
+  // unless a row having that combination has already been claimed with this "put-code".
   let creditRowNumber = null;
   for (let rowIndex = 0; rowIndex < values.length; rowIndex++) {
     const row = values[rowIndex];
     if (
-      row[claimedAtColumnIndex] === "" && // unclaimed
       row[orcidIdColumnIndex] === orcidId &&
       row[creditTypeColumnIndex] === creditType &&
       compareOptionalDates(row[startDateColumnIndex], startDate) &&
       compareOptionalDates(row[endDateColumnIndex], endDate)
     ) {
-      creditRowNumber = rowIndex + 1; // Note: Google Sheets row numbers are 1-based.
-      break;
+      if (
+        row[claimedAtColumnIndex] !== "" &&
+        String(row[affiliationPutCodeColumnIndex]) ===
+          String(affiliationPutCode)
+      ) {
+        creditRowNumber = null; // already claimed with this "put-code"
+        break;
+      }
+      if (row[claimedAtColumnIndex] === "" && creditRowNumber === null) {
+        creditRowNumber = rowIndex + 1; // Note: Google Sheets row numbers are 1-based.
+      }
     }
   }
 
@@ -181,7 +277,92 @@ function markCreditAsClaimed(
 
   // Return all credits associated with this ORCID ID.
   // Note: This will reflect any updates made by this function.
-  return getCreditsByOrcidId(orcidId);
+  return getCreditRowsByOrcidId(orcidId);
+}
+
+/**
+ * Marks multiple unclaimed credits of the specified ORCID ID as having been claimed,
+ * reading the Google Sheets document only once.
+ *
+ * Each claim is an object having the properties `credit_type`, `start_date`, `end_date`,
+ * and `affiliation_put_code`. For each claim, the first row describing an unclaimed credit
+ * having the specified combination of {credit type, ORCID ID, start date, end date} (and
+ * not already claimed by an earlier claim in the list) is updated the same way the
+ * `markCreditAsClaimed` function updates a row; unless, as there, a row having that
+ * combination has already been claimed with the claim's "put-code".
+ *
+ * Returns the column names and the rows of all credits associated with the specified
+ * ORCID ID (see `getCreditRowsByOrcidId`), which will reflect any updates made by this
+ * function.
+ */
+function markCreditsAsClaimed(orcidId, claims) {
+  const spreadsheet = SpreadsheetApp.openById(CONFIG.SPREADSHEET_ID);
+  const sheet = spreadsheet.getSheetByName(CONFIG.SHEET_NAME);
+
+  // Get all the values on the sheet.
+  const dataRange = sheet.getDataRange();
+  const values = dataRange.getValues();
+
+  // Determine the 0-based indexes of columns relevant to this operation.
+  const columnNames = values[0];
+  const creditTypeColumnIndex = columnNames.indexOf("column.CREDIT_TYPE");
+  const orcidIdColumnIndex = columnNames.indexOf("column.ORCID_ID");
+  const startDateColumnIndex = columnNames.indexOf("column.START_DATE");
+  const endDateColumnIndex = columnNames.indexOf("column.END_DATE");
+  const claimedAtColumnIndex = columnNames.indexOf("column.CLAIMED_AT");
+  const affiliationPutCodeColumnIndex = columnNames.indexOf(
+    "column.AFFILIATION_PUT_CODE",
+  );
+
+  // Generate a timestamp representing the current date and time (now).
+  const claimedAt = new Date();
+
+  claims.forEach((claim) => {
+    const startDate = claim.start_date === "" ? "" : new Date(claim.start_date);
+    const endDate = claim.end_date === "" ? "" : new Date(claim.end_date);
+    const isMatchingRow = (row) =>
+      row[orcidIdColumnIndex] === orcidId &&
+      row[creditTypeColumnIndex] === claim.credit_type &&
+      compareOptionalDates(row[startDateColumnIndex], startDate) &&
+      compareOptionalDates(row[endDateColumnIndex], endDate);
+
+    // If this claim has already been recorded (e.g. the app is retrying it), skip it.
+    const isAlreadyRecorded = values.some(
+      (row) =>
+        isMatchingRow(row) &&
+        row[claimedAtColumnIndex] !== "" &&
+        String(row[affiliationPutCodeColumnIndex]) ===
+          String(claim.affiliation_put_code),
+    );
+    if (isAlreadyRecorded) {
+      return;
+    }
+
+    for (let rowIndex = 0; rowIndex < values.length; rowIndex++) {
+      const row = values[rowIndex];
+      if (
+        row[claimedAtColumnIndex] === "" && // unclaimed
+        isMatchingRow(row)
+      ) {
+        // Note: Google Sheets row and column numbers are 1-based.
+        dataRange
+          .getCell(rowIndex + 1, claimedAtColumnIndex + 1)
+          .setValue(claimedAt);
+        dataRange
+          .getCell(rowIndex + 1, affiliationPutCodeColumnIndex + 1)
+          .setValue(claim.affiliation_put_code);
+
+        // Update our in-memory copy of the row too, so a later claim in the list doesn't match it.
+        row[claimedAtColumnIndex] = claimedAt;
+        row[affiliationPutCodeColumnIndex] = claim.affiliation_put_code;
+        break;
+      }
+    }
+  });
+
+  // Return all credits associated with this ORCID ID.
+  // Note: This will reflect any updates made by this function.
+  return getCreditRowsByOrcidId(orcidId);
 }
 
 /**
@@ -256,6 +437,56 @@ function validateOptionalTimestamp(optionalTimestamp) {
   }
 }
 
+/**
+ * Sends an error HTTP response if the specified list of claims (of the "claim_batch" action) is
+ * not an array, or if any of its claims is invalid (see the validation of the single-claim
+ * query parameters in `doPost`). Otherwise, returns `null`.
+ */
+function validateClaims(claims) {
+  if (!Array.isArray(claims)) {
+    return ContentService.createTextOutput(
+      JSON.stringify({ error: "Bad request. Invalid claims." }),
+    ).setMimeType(ContentService.MimeType.JSON);
+  }
+  for (const claim of claims) {
+    if (typeof claim !== "object" || claim === null) {
+      return ContentService.createTextOutput(
+        JSON.stringify({ error: "Bad request. Invalid claims." }),
+      ).setMimeType(ContentService.MimeType.JSON);
+    }
+
+    // Note: Each validator returns either the (valid) value or an error HTTP response.
+    const errorResponse = [
+      validateCreditType(claim.credit_type),
+      validateOptionalTimestamp(claim.start_date),
+      validateOptionalTimestamp(claim.end_date),
+      validateCreditType(claim.affiliation_put_code),
+    ].find((result) => typeof result !== "string");
+    if (errorResponse !== undefined) {
+      return errorResponse;
+    }
+  }
+  return null;
+}
+
+/**
+ * Logs the trace context (if any) the app sent along with the request, so the
+ * request's entry in the execution log can be matched up with the app's trace
+ * of it (i.e. the span whose ID is the second-to-last part of the value).
+ *
+ * Reference: https://www.w3.org/TR/trace-context/#traceparent-header
+ */
+function logTraceContext(queryParams) {
+  if (queryParams["traceparent"]) {
+    console.log(
+      JSON.stringify({
+        traceparent: queryParams["traceparent"],
+        action: queryParams["action"] || null,
+      }),
+    );
+  }
+}
+
 /**
  * Handle incoming POST requests.
  *
@@ -264,8 +495,29 @@ function validateOptionalTimestamp(optionalTimestamp) {
 function doPost(event) {
   // Extract and validate the query parameters.
   const queryParams = event.parameter;
+  logTraceContext(queryParams);
   const _ = validateSharedSecret(queryParams["shared_secret"]);
   const orcidId = validateOrcidId(queryParams["orcid_id"]);
+
+  // If the "claim_batch" action was requested, mark all the claims listed in the
+  // (JSON) request body as claimed, at once.
+  if (queryParams["action"] === "claim_batch") {
+    const { claims } = JSON.parse(event.postData.contents);
+
+    // Validate every claim before marking any of them as claimed, so that an invalid claim
+    // is rejected along with the rest of the batch, rather than after some of it was recorded.
+    const claimsErrorResponse = validateClaims(claims);
+    if (claimsErrorResponse !== null) {
+      return claimsErrorResponse;
+    }
+
+    const { columnNames, rows } = markCreditsAsClaimed(orcidId, claims);
+    const credits = encodeRows(columnNames, rows, queryParams["format"]);
+    return ContentService.createTextOutput(
+      JSON.stringify({ orcid_id: orcidId, ...credits }),
+    ).setMimeType(ContentService.MimeType.JSON);
+  }
+
   const creditType = validateCreditType(queryParams["credit_type"]);
   const startDate = validateOptionalTimestamp(queryParams["start_date"]);
   const endDate = validateOptionalTimestamp(queryParams["end_date"]);
@@ -276,16 +528,17 @@ function doPost(event) {
   // Update the specified credit, if it exists, and then get all credits
   // associated with that ORCID ID (done in that order, so that the credits
   // reflect the update to the specified one).
-  const credits = markCreditAsClaimed(
+  const { columnNames, rows } = markCreditAsClaimed(
     creditType,
     orcidId,
     startDate,
     endDate,
     affiliationPutCode,
   );
+  const credits = encodeRows(columnNames, rows, queryParams["format"]);
 
   return ContentService.createTextOutput(
-    JSON.stringify({ orcid_id: orcidId, credits }),
+    JSON.stringify({ orcid_id: orcidId, ...credits }),
   ).setMimeType(ContentService.MimeType.JSON);
 }
 
@@ -297,13 +550,36 @@ function doPost(event) {
 function doGet(event) {
   // Extract and validate the query parameters.
   const queryParams = event.parameter;
-  const _ = validateSharedSecret(queryParams["shared_secret"]);
+  logTraceContext(queryParams);
+  const sharedSecret = validateSharedSecret(queryParams["shared_secret"]);
+
+  // If the "export" action was requested, export all credits (regardless of ORCID ID).
+  // Note: Since this exposes every row of the sheet, we make sure the shared secret is valid.
+  if (queryParams["action"] === "export") {
+    if (typeof sharedSecret !== "string") {
+      return sharedSecret; // the error response
+    }
+    const offset = parseInt(queryParams["offset"] || "0", 10);
+    const limit = queryParams["limit"] ? parseInt(queryParams["limit"], 10) : null;
+    const snapshot = exportCredits(
+      queryParams["since_version"] || "",
+      offset,
+      limit,
+      queryParams["format"],
+      queryParams["columns"],
+    );
+    return ContentService.createTextOutput(
+      JSON.stringify(snapshot),
+    ).setMimeType(ContentService.MimeType.JSON);
+  }
+
   const orcidId = validateOrcidId(queryParams["orcid_id"]);
 
-  // Get all credits associated with the specified ORCID ID.
-  const credits = getCreditsByOrcidId(orcidId);
+  // Get all credits associated with the specified ORCID ID, in the requested format.
+  const { columnNames, rows } = getCreditRowsByOrcidId(orcidId);
+  const credits = encodeRows(columnNames, rows, queryParams["format"]);
 
   return ContentService.createTextOutput(
-    JSON.stringify({ orcid_id: orcidId, credits }),
+    JSON.stringify({ orcid_id: orcidId, ...credits }),
   ).setMimeType(ContentService.MimeType.JSON);
 }
@@ -0,0 +1,420 @@
+r"""
+An offline load-testing and benchmark suite for the app.
+
+It runs the app in-process, against local stand-ins for the NMDC ORCID Creditor Proxy and for ORCID (see
+`mock_services.py`); drives its endpoints at several concurrency levels; and reports the throughput and latency
+percentiles of each (scenario, concurrency level) combination as JSON, so results can be compared between commits.
+
+It also measures the size of the proxy's payloads, and how long the app takes to parse them, in each of the proxy's
+wire formats (see `wire_format.py`), for an export of the whole (synthetic) sheet; and how long the app takes to
+match a batch of requested credits to that many credits (see `credit_model.py`).
+
+Usage:
+    $ poetry run python -m nmdc_orcid_creditor.benchmark --concurrency 1 8 32 --output results.json
+    $ poetry run python -m nmdc_orcid_creditor.benchmark --baseline results.json  # fails if performance regressed
+"""
+
+import argparse
+import asyncio
+import gzip
+import itertools
+import json
+import math
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Callable, Optional
+from unittest import mock
+
+import httpx
+
+from nmdc_orcid_creditor import main
+from nmdc_orcid_creditor.config import Config, cfg
+from nmdc_orcid_creditor.credit_model import Credit, make_affiliation_date, make_claim_key
+from nmdc_orcid_creditor.credit_stats import SEED_COLUMNS
+from nmdc_orcid_creditor.mock_services import HostRoutingTransport, MockOrcid, MockProxy
+from nmdc_orcid_creditor.wire_format import decode_credits, encode_credits
+
+APP_HOST = "app.benchmark.test"
+PROXY_HOST = "proxy.benchmark.test"
+
+SCENARIOS = ("login", "get_api_credits", "post_api_credits_claim")
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    r"""
+    Returns the specified percentile (e.g. 0.95 for the 95th percentile) of the specified sorted values,
+    using the nearest-rank method; or `0.0` if there are no values.
+
+    >>> percentile([1.0, 2.0, 3.0, 4.0], 0.5)
+    2.0
+    >>> percentile([1.0, 2.0, 3.0, 4.0], 0.99)
+    4.0
+    >>> percentile([], 0.5)
+    0.0
+    """
+
+    if len(sorted_values) == 0:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(scenario: str, concurrency: int, latencies: list[float], num_errors: int, duration: float) -> dict:
+    r"""
+    Returns the throughput and latency percentiles (in milliseconds) of a benchmark run.
+
+    >>> summary = summarize("login", 2, [0.01, 0.02, 0.03, 0.04], num_errors=1, duration=0.05)
+    >>> summary["throughput_rps"], summary["latency_ms"]["p50"], summary["error_rate"]
+    (80.0, 20.0, 0.25)
+    """
+
+    sorted_latencies = sorted(latencies)
+    num_requests = len(latencies)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": num_requests,
+        "errors": num_errors,
+        "error_rate": round(num_errors / num_requests, 4) if num_requests else 0.0,
+        "duration_seconds": round(duration, 4),
+        "throughput_rps": round(num_requests / duration, 2) if duration > 0 else 0.0,
+        "latency_ms": {
+            name: round(percentile(sorted_latencies, fraction) * 1000, 3)
+            for name, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))
+        },
+    }
+
+
+def compare_results(results: list[dict], baseline_results: list[dict], max_regression: float) -> list[str]:
+    r"""
+    Compares the results of a benchmark to those of a baseline benchmark (e.g. of a previous commit), and returns a
+    description of each (scenario, concurrency level) combination whose p95 latency or throughput is worse than the
+    baseline's by more than a factor of `max_regression`.
+
+    >>> baseline = [{"scenario": "login", "concurrency": 1, "throughput_rps": 100.0, "latency_ms": {"p95": 10.0}}]
+    >>> compare_results([{**baseline[0], "latency_ms": {"p95": 11.0}}], baseline, max_regression=1.2)
+    []
+    >>> compare_results([{**baseline[0], "latency_ms": {"p95": 13.0}}], baseline, max_regression=1.2)
+    ['login @ concurrency 1: p95 latency 13.0 ms vs. 10.0 ms']
+    """
+
+    baseline_by_key = {(r["scenario"], r["concurrency"]): r for r in baseline_results}
+    regressions = []
+    for result in results:
+        baseline = baseline_by_key.get((result["scenario"], result["concurrency"]))
+        if baseline is None:
+            continue
+        label = f"{result['scenario']} @ concurrency {result['concurrency']}"
+        p95, baseline_p95 = result["latency_ms"]["p95"], baseline["latency_ms"]["p95"]
+        if p95 > baseline_p95 * max_regression:
+            regressions.append(f"{label}: p95 latency {p95} ms vs. {baseline_p95} ms")
+        throughput, baseline_throughput = result["throughput_rps"], baseline["throughput_rps"]
+        if throughput * max_regression < baseline_throughput:
+            regressions.append(f"{label}: throughput {throughput} req/s vs. {baseline_throughput} req/s")
+    return regressions
+
+
+def measure_wire_formats(credits: list[dict], num_repeats: int = 5) -> list[dict]:
+    r"""
+    Returns, for each of the proxy's wire formats (including the columnar format limited to the columns the app needs
+    when seeding its credit statistics), the size of a payload containing the specified credits (both as is and
+    gzipped); how long the app takes to parse it (as JSON); and how long the app takes to parse it and decode the
+    credits (into dictionaries). Each duration is the shortest of `num_repeats` attempts.
+    """
+
+    def measure_seconds(fn: Callable[[], object]) -> float:
+        durations = []
+        for _ in range(num_repeats):
+            started_at = time.perf_counter()
+            fn()
+            durations.append(time.perf_counter() - started_at)
+        return min(durations)
+
+    variants = (("objects", None), ("columnar", None), ("columnar", SEED_COLUMNS))
+    results = []
+    for wire_format, columns in variants:
+        # Note: Like the proxy (via `JSON.stringify`), we don't put whitespace between the tokens.
+        payload = json.dumps(encode_credits(credits, wire_format, columns), separators=(",", ":")).encode("utf-8")
+        results.append(
+            {
+                "wire_format": wire_format,
+                "columns": "all" if columns is None else len(columns),
+                "rows": len(credits),
+                "payload_bytes": len(payload),
+                "gzipped_payload_bytes": len(gzip.compress(payload, mtime=0)),
+                "parse_ms": round(measure_seconds(lambda: json.loads(payload)) * 1000, 3),
+                "decode_ms": round(measure_seconds(lambda: decode_credits(json.loads(payload))) * 1000, 3),
+            }
+        )
+    return results
+
+
+def measure_claim_matching(credits: list[dict], num_claims: int = 50, num_repeats: int = 5) -> list[dict]:
+    r"""
+    Returns how long it takes to match a batch of `num_claims` requested credits to the specified credits, and to build
+    the credit-specific fields of the affiliations describing the matched credits; both the way the app does it
+    (see `Credit`) and the way it used to (i.e. scanning the plain dictionaries for each requested credit, and parsing
+    the matched credits' dates, via `strftime`, every time). Each duration is the shortest of `num_repeats` attempts.
+
+    Note: The "cold" measurement is of `Credit`s that have just been read from the proxy, and the "warm" one is of
+          `Credit`s that have been claimed before (e.g. ones served from the cache after a failed claim).
+    """
+
+    def measure_seconds(fn: Callable[[], object], setup: Callable[[], object] = lambda: None) -> float:
+        durations = []
+        for _ in range(num_repeats):
+            state = setup()
+            started_at = time.perf_counter()
+            fn(state)
+            durations.append(time.perf_counter() - started_at)
+        return min(durations)
+
+    unclaimed_credits = [credit for credit in credits if credit.get("column.CLAIMED_AT") == ""]
+    requested_claim_keys = [make_claim_key(credit) for credit in unclaimed_credits[-num_claims:]]
+
+    def parse_date_via_strftime(date_str: str) -> tuple[str, str, str]:
+        date = datetime.fromisoformat(date_str)
+        return date.strftime("%Y"), date.strftime("%m"), date.strftime("%d")
+
+    def match_dicts(rows: list[dict]) -> list[dict]:
+        unclaimed_rows = [row for row in rows if row.get("column.CLAIMED_AT") == ""]
+        details = []
+        for claim_key in requested_claim_keys:
+            row = next(r for r in unclaimed_rows if make_claim_key(r) == claim_key)
+            unclaimed_rows.remove(row)
+            start_date_parts = parse_date_via_strftime(row["column.START_DATE"])
+            end_date_parts = parse_date_via_strftime(row["column.END_DATE"])
+            details.append(
+                {
+                    "role-title": row["column.CREDIT_TYPE"],
+                    "start-date": make_affiliation_date(start_date_parts),
+                    "end-date": make_affiliation_date(end_date_parts),
+                    "url": {"value": row["column.DETAILS_URL"].strip()},
+                }
+            )
+        return details
+
+    def match_credits(ingested_credits: list[Credit]) -> list[dict]:
+        unclaimed_credits_by_claim_key = {}
+        for credit in ingested_credits:
+            if credit.get("column.CLAIMED_AT") == "":
+                unclaimed_credits_by_claim_key.setdefault(credit.claim_key, []).append(credit)
+        return [unclaimed_credits_by_claim_key[key].pop(0).affiliation_details for key in requested_claim_keys]
+
+    warm_credits = [Credit(credit) for credit in credits]
+    results = [
+        ("dicts", measure_seconds(match_dicts, setup=lambda: credits)),
+        ("credits_cold", measure_seconds(match_credits, setup=lambda: [Credit(credit) for credit in credits])),
+        ("credits_warm", measure_seconds(match_credits, setup=lambda: warm_credits)),
+    ]
+    return [
+        {
+            "representation": name,
+            "rows": len(credits),
+            "claims": len(requested_claim_keys),
+            "match_ms": round(seconds * 1000, 3),
+        }
+        for name, seconds in results
+    ]
+
+
+@asynccontextmanager
+async def running_app(mock_proxy: MockProxy, mock_orcid: MockOrcid) -> AsyncIterator[Callable[[], httpx.AsyncClient]]:
+    r"""
+    Starts the app (running its lifespan logic), configured to send its upstream requests to the specified stand-ins;
+    and yields a function that creates a client (with a cookie jar of its own) of the app.
+
+    Note: The app's configuration is restored when the context exits.
+    """
+
+    upstream_transport = HostRoutingTransport({PROXY_HOST: mock_proxy.app, "orcid.org": mock_orcid.app})
+
+    def create_upstream_http_client(config: Config) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=upstream_transport, timeout=config.HTTP_CLIENT_READ_TIMEOUT_SECONDS)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        overrides = {
+            "NMDC_ORCID_CREDITOR_PROXY_URL": f"https://{PROXY_HOST}/exec",
+            "SERVER_SESSION_SECRET_KEY": cfg.SERVER_SESSION_SECRET_KEY or "benchmark",
+            "CLAIM_OUTBOX_PATH": str(Path(work_dir) / "claim_outbox.sqlite3"),
+            "CREDIT_STORE_SQLITE_PATH": str(Path(work_dir) / "credits.sqlite3"),
+            "SESSION_STORE_SQLITE_PATH": str(Path(work_dir) / "sessions.sqlite3"),
+            # Keep the app's per-request log output from skewing (and drowning out) the results.
+            "LOG_LEVEL": "WARNING",
+        }
+        with (
+            mock.patch.multiple(cfg, **overrides),
+            mock.patch.object(main, "create_http_client", create_upstream_http_client),
+            mock.patch.dict(main.oauth.orcid.client_kwargs, transport=upstream_transport),
+        ):
+            async with main.app.router.lifespan_context(main.app):
+                app_transport = HostRoutingTransport({APP_HOST: main.app, **upstream_transport.apps_by_host})
+                yield lambda: httpx.AsyncClient(
+                    transport=app_transport, base_url=f"http://{APP_HOST}", follow_redirects=True
+                )
+
+
+async def log_in(client: httpx.AsyncClient) -> httpx.Response:
+    r"""Goes through the app's login flow (which involves the ORCID stand-in), ending up on the "Credits" page"""
+
+    response = await client.get("/redirect-to-orcid-login-page")
+    if response.url.path != "/credits":
+        raise RuntimeError(f"Failed to log in (ended up at {response.url})")
+    return response
+
+
+async def run_level(
+    scenario: str,
+    concurrency: int,
+    num_requests: int,
+    create_client: Callable[[], httpx.AsyncClient],
+) -> dict:
+    r"""
+    Sends `num_requests` requests for the specified scenario to the app, from `concurrency` concurrent workers
+    (each one being a different, signed-in user); and returns a summary of the latencies.
+    """
+
+    latencies: list[float] = []
+    num_errors = 0
+    barrier = asyncio.Barrier(concurrency + 1)
+
+    async def work(num_worker_requests: int) -> None:
+        nonlocal num_errors
+        async with create_client() as client:
+            # Prepare (i.e. sign in and get the credits to claim) before the clock starts.
+            credits_to_claim = []
+            if scenario != "login":
+                await log_in(client)
+            if scenario == "post_api_credits_claim":
+                credits = (await client.get("/api/credits")).json()["credits"]
+                credits_to_claim = [c for c in credits if c["column.CLAIMED_AT"] == ""] or credits
+            await barrier.wait()
+
+            for request_index in range(num_worker_requests):
+                started_at = time.perf_counter()
+                try:
+                    if scenario == "login":
+                        client.cookies.clear()
+                        response = await log_in(client)
+                    elif scenario == "get_api_credits":
+                        response = await client.get("/api/credits")
+                    else:
+                        credit = credits_to_claim[request_index % len(credits_to_claim)]
+                        payload = {
+                            "credit_type": credit["column.CREDIT_TYPE"],
+                            "start_date": credit["column.START_DATE"],
+                            "end_date": credit["column.END_DATE"],
+                        }
+                        response = await client.post("/api/credits/claim", json=payload)
+                    failed = response.is_error
+                except (httpx.HTTPError, RuntimeError):
+                    failed = True
+                latencies.append(time.perf_counter() - started_at)
+                num_errors += failed
+
+    workers = [
+        asyncio.create_task(work(num_requests // concurrency + (1 if index < num_requests % concurrency else 0)))
+        for index in range(concurrency)
+    ]
+    await barrier.wait()
+    started_at = time.perf_counter()
+    await asyncio.gather(*workers)
+    return summarize(scenario, concurrency, latencies, num_errors, time.perf_counter() - started_at)
+
+
+async def run_benchmark(
+    scenarios: tuple[str, ...] = SCENARIOS,
+    concurrency_levels: tuple[int, ...] = (1, 4, 16),
+    num_requests: int = 100,
+    num_rows: int = 20000,
+    num_users: int = 100,
+    proxy_latency_seconds: float = 0.05,
+    proxy_error_rate: float = 0.0,
+    orcid_latency_seconds: float = 0.02,
+    orcid_error_rate: float = 0.0,
+) -> dict:
+    r"""
+    Runs each scenario at each concurrency level, and returns the parameters and results of the benchmark.
+
+    Note: Each worker signs in as a different user, in turn; so, as long as the total number of workers is less than
+          `num_users`, no two workers claim the same user's credits.
+    """
+
+    parameters = dict(
+        scenarios=list(scenarios),
+        concurrency_levels=list(concurrency_levels),
+        num_requests=num_requests,
+        num_rows=num_rows,
+        num_users=num_users,
+        proxy_latency_seconds=proxy_latency_seconds,
+        proxy_error_rate=proxy_error_rate,
+        orcid_latency_seconds=orcid_latency_seconds,
+        orcid_error_rate=orcid_error_rate,
+    )
+    mock_proxy = MockProxy(num_rows, num_users, proxy_latency_seconds, proxy_error_rate)
+    mock_orcid = MockOrcid(num_users, orcid_latency_seconds, orcid_error_rate)
+    results = []
+    async with running_app(mock_proxy, mock_orcid) as create_client:
+        for scenario in scenarios:
+            for concurrency in concurrency_levels:
+                results.append(await run_level(scenario, concurrency, num_requests, create_client))
+    credits = list(itertools.chain.from_iterable(mock_proxy.credits_by_orcid_id.values()))
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "parameters": parameters,
+        "results": results,
+        "wire_formats": measure_wire_formats(credits),
+        "claim_matching": measure_claim_matching(credits),
+    }
+
+
+def main_cli(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the app offline, against mock upstream services.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16], help="concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="requests per (scenario, concurrency level)")
+    parser.add_argument("--rows", type=int, default=20000, help="rows in the mock proxy's sheet")
+    parser.add_argument("--users", type=int, default=100, help="distinct ORCID IDs in the mock proxy's sheet")
+    parser.add_argument("--proxy-latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--proxy-error-rate", type=float, default=0.0)
+    parser.add_argument("--orcid-latency", type=float, default=0.02, help="seconds")
+    parser.add_argument("--orcid-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="file to write the JSON results to (default: standard output)")
+    parser.add_argument("--baseline", help="JSON results of a previous run, to compare these results to")
+    parser.add_argument("--max-regression", type=float, default=1.25, help="tolerated slowdown factor")
+    args = parser.parse_args(argv)
+
+    benchmark = asyncio.run(
+        run_benchmark(
+            scenarios=tuple(args.scenarios),
+            concurrency_levels=tuple(args.concurrency),
+            num_requests=args.requests,
+            num_rows=args.rows,
+            num_users=args.users,
+            proxy_latency_seconds=args.proxy_latency,
+            proxy_error_rate=args.proxy_error_rate,
+            orcid_latency_seconds=args.orcid_latency,
+            orcid_error_rate=args.orcid_error_rate,
+        )
+    )
+    output = json.dumps(benchmark, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        baseline_results = json.loads(Path(args.baseline).read_text())["results"]
+        regressions = compare_results(benchmark["results"], baseline_results, args.max_regression)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,358 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional, Sequence
+
+from nmdc_orcid_creditor.credit_model import Credit, make_claim_key
+from nmdc_orcid_creditor.credit_store import CreditStore, CreditStoreError
+from nmdc_orcid_creditor.metrics import CLAIM_OUTBOX_ENTRIES
+
+logger = logging.getLogger("uvicorn")
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS claim_outbox (
+    id                   INTEGER PRIMARY KEY,
+    orcid_id             TEXT NOT NULL,
+    credit_type          TEXT NOT NULL,
+    start_date           TEXT NOT NULL,
+    end_date             TEXT NOT NULL,
+    affiliation_put_code TEXT NOT NULL,
+    created_at           TEXT NOT NULL,
+    attempts             INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at      REAL NOT NULL DEFAULT 0,  -- Unix timestamp
+    last_error           TEXT,
+    parked_at            TEXT  -- when we gave up on recording the claim (NULL while we are still trying)
+);
+"""
+
+
+class ClaimOutbox:
+    r"""
+    A durable, SQLite-backed queue of claims that have yet to be recorded in a credit store.
+
+    An entry is committed to disk before `add` returns, so that it survives the app crashing or restarting.
+
+    An entry whose claim we have given up on recording is parked: it stays in the outbox (so an operator can look
+    into it), but is no longer attempted.
+
+    >>> outbox = ClaimOutbox(":memory:")
+    >>> claim = dict(credit_type="Ambassador 2023", start_date="", end_date="", affiliation_put_code="12345")
+    >>> [entry["id"] for entry in outbox.add("0000-0000-0000-0001", [claim, claim])]
+    [1, 2]
+    >>> outbox.reschedule(1, attempts=1, next_attempt_at=60.0, last_error="Timed out")
+    >>> [(entry["attempts"], entry["next_attempt_at"]) for entry in outbox.list_entries()]
+    [(1, 60.0), (0, 0.0)]
+    >>> outbox.park(1, attempts=2, last_error="Timed out")
+    >>> outbox.remove([2])
+    >>> [(entry["id"], entry["parked_at"] is not None) for entry in outbox.list_entries()]
+    [(1, True)]
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("PRAGMA synchronous = FULL")
+            self._connection.executescript(SQLITE_SCHEMA)
+
+            # Add the columns that outboxes created by earlier versions of the app lack.
+            column_names = [row["name"] for row in self._connection.execute("PRAGMA table_info(claim_outbox)")]
+            if "parked_at" not in column_names:
+                self._connection.execute("ALTER TABLE claim_outbox ADD COLUMN parked_at TEXT")
+
+    def add(self, orcid_id: str, claims: list[dict]) -> list[dict]:
+        r"""Adds entries for the specified claims (in a single transaction) and returns them"""
+
+        created_at = datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+        entries = []
+        with self._lock, self._connection:
+            for claim in claims:
+                entry = dict(orcid_id=orcid_id, created_at=created_at, attempts=0, next_attempt_at=0.0, **claim)
+                cursor = self._connection.execute(
+                    """
+                    INSERT INTO claim_outbox (
+                        orcid_id, credit_type, start_date, end_date, affiliation_put_code, created_at
+                    ) VALUES (
+                        :orcid_id, :credit_type, :start_date, :end_date, :affiliation_put_code, :created_at
+                    )
+                    """,
+                    entry,
+                )
+                entries.append(dict(id=cursor.lastrowid, last_error=None, parked_at=None, **entry))
+        return entries
+
+    def list_entries(self) -> list[dict]:
+        r"""Returns all entries (including parked ones), oldest first"""
+
+        with self._lock:
+            rows = self._connection.execute("SELECT * FROM claim_outbox ORDER BY id").fetchall()
+        return [dict(row) for row in rows]
+
+    def reschedule(self, entry_id: int, attempts: int, next_attempt_at: float, last_error: str) -> None:
+        r"""Records a failed attempt to drain the specified entry, and when to attempt it next"""
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE claim_outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, next_attempt_at, last_error, entry_id),
+            )
+
+    def park(self, entry_id: int, attempts: int, last_error: str) -> None:
+        r"""Records the last failed attempt to drain the specified entry, and that it will not be attempted again"""
+
+        parked_at = datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE claim_outbox SET attempts = ?, last_error = ?, parked_at = ? WHERE id = ?",
+                (attempts, last_error, parked_at, entry_id),
+            )
+
+    def remove(self, entry_ids: list[int]) -> None:
+        r"""Removes the specified entries (i.e. once their claims have been recorded), in a single transaction"""
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "DELETE FROM claim_outbox WHERE id = ?", [(entry_id,) for entry_id in entry_ids]
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def mark_pending_claims(credits: list[dict], entries: list[dict]) -> list[int]:
+    r"""
+    Marks, for each of the specified outbox entries, the first matching unclaimed credit among the specified ones as
+    having been claimed (in place). Returns the IDs of the entries for which a matching credit was found.
+
+    >>> credits = [{"column.ORCID_ID": "0000-0000-0000-0001", "column.CREDIT_TYPE": "Ambassador 2023",
+    ...             "column.CLAIMED_AT": ""}]
+    >>> entry = dict(id=1, orcid_id="0000-0000-0000-0001", credit_type="Ambassador 2023", start_date="",
+    ...              end_date="", affiliation_put_code="123", created_at="2024-06-01T12:00:00.000Z")
+    >>> mark_pending_claims(credits, [entry]), credits[0]["column.CLAIMED_AT"]
+    ([1], '2024-06-01T12:00:00.000Z')
+    """
+
+    marked_entry_ids = []
+    for entry in entries:
+        claim_key = (entry["orcid_id"], entry["credit_type"], entry["start_date"], entry["end_date"])
+        for credit in credits:
+            if make_claim_key(credit) == claim_key and credit.get("column.CLAIMED_AT") == "":
+                credit["column.CLAIMED_AT"] = entry["created_at"]
+                credit["column.AFFILIATION_PUT_CODE"] = entry["affiliation_put_code"]
+                marked_entry_ids.append(entry["id"])
+                break
+    return marked_entry_ids
+
+
+class OutboxCreditStore(CreditStore):
+    r"""
+    A credit store that records claims in another credit store in the background, via a durable outbox.
+
+    `mark_claimed` returns as soon as the claim has been committed to the outbox. A background worker then records
+    the claim in the other store (along with any other due claims of the same ORCID ID, in a single batch), retrying
+    with exponential backoff until it succeeds or `max_attempts` attempts have failed, at which point it parks the
+    claim. Until the claim is recorded, the credits this store returns show it as having been made (even if it has
+    been parked, since its affiliation exists); so the user cannot claim the same credit again meanwhile.
+
+    Note: A claim may get recorded even though the attempt to record it appears to have failed (e.g. if the response
+          timed out), so retrying it relies on the other store treating a claim it has already recorded (i.e. of a
+          credit already having the claim's affiliation put-code) as having succeeded.
+
+    When the store starts, the worker resumes draining any entries left over from before the app last stopped.
+    """
+
+    defers_claim_recording = True
+
+    def __init__(
+        self,
+        store: CreditStore,
+        outbox: ClaimOutbox,
+        retry_base_delay_seconds: float,
+        retry_max_delay_seconds: float,
+        max_attempts: int = 20,
+    ):
+        self.store = store
+        self.outbox = outbox
+        self.retry_base_delay_seconds = retry_base_delay_seconds
+        self.retry_max_delay_seconds = retry_max_delay_seconds
+        self.max_attempts = max_attempts
+        self._pending: dict[int, dict] = {}  # entry ID -> entry
+        self._parked: dict[int, dict] = {}  # entry ID -> entry
+        self._wake_up = asyncio.Event()
+        self._worker_task: Optional[asyncio.Task] = None
+
+    @property
+    def num_pending(self) -> int:
+        r"""The number of claims that have yet to be recorded in the other store"""
+
+        return len(self._pending)
+
+    @property
+    def num_parked(self) -> int:
+        r"""The number of claims that have been given up on (after too many failed attempts to record them)"""
+
+        return len(self._parked)
+
+    def _update_metrics(self) -> None:
+        CLAIM_OUTBOX_ENTRIES.labels("pending").set(len(self._pending))
+        CLAIM_OUTBOX_ENTRIES.labels("parked").set(len(self._parked))
+
+    def _with_pending_claims(self, orcid_id: str, credits: list[dict]) -> list[dict]:
+        r"""
+        Returns a copy of the specified credits, in which the credits having pending (or parked) claims are marked
+        claimed
+        """
+
+        entries = [entry for entry in self._unrecorded_entries() if entry["orcid_id"] == orcid_id]
+        if len(entries) == 0:
+            return credits
+        credits = [Credit.of(credit).copy() for credit in credits]
+        mark_pending_claims(credits, entries)
+        return credits
+
+    def _unrecorded_entries(self) -> list[dict]:
+        return [*self._pending.values(), *self._parked.values()]
+
+    async def list_credits(self, orcid_id: str) -> list[dict]:
+        return self._with_pending_claims(orcid_id, await self.store.list_credits(orcid_id))
+
+    async def iter_credit_pages(
+        self, page_size: int, columns: Optional[Sequence[str]] = None
+    ) -> AsyncIterator[list[dict]]:
+        marked_entry_ids = set()  # so that each pending claim is reflected in only one page
+        async for credits in self.store.iter_credit_pages(page_size, columns):
+            entries = [entry for entry in self._unrecorded_entries() if entry["id"] not in marked_entry_ids]
+            if len(entries) > 0:
+                credits = [Credit.of(credit).copy() for credit in credits]
+                marked_entry_ids.update(mark_pending_claims(credits, entries))
+            yield credits
+
+    async def mark_claimed(
+        self,
+        orcid_id: str,
+        credit_type: str,
+        start_date: str,
+        end_date: str,
+        affiliation_put_code: str,
+    ) -> list[dict]:
+        claim = dict(
+            credit_type=credit_type,
+            start_date=start_date,
+            end_date=end_date,
+            affiliation_put_code=affiliation_put_code,
+        )
+        return await self.mark_claimed_batch(orcid_id, [claim])
+
+    async def mark_claimed_batch(self, orcid_id: str, claims: list[dict]) -> list[dict]:
+        try:
+            entries = await asyncio.to_thread(self.outbox.add, orcid_id, claims)
+        except sqlite3.Error as error:
+            raise CreditStoreError(f"Failed to add claims to outbox: {error!r}") from error
+        for entry in entries:
+            self._pending[entry["id"]] = entry
+        self._update_metrics()
+        self._wake_up.set()
+        return await self.list_credits(orcid_id)
+
+    async def drain(self) -> Optional[float]:
+        r"""
+        Attempts to record the due entries' claims in the other store, in one batch per ORCID ID. Returns the number
+        of seconds until the next entry will be due, or `None` if there are no entries left to attempt.
+        """
+
+        now = time.time()
+        due_entries_by_orcid_id: dict[str, list[dict]] = {}
+        for entry in sorted(self._pending.values(), key=lambda e: e["id"]):
+            if entry["next_attempt_at"] <= now:
+                due_entries_by_orcid_id.setdefault(entry["orcid_id"], []).append(entry)
+
+        for orcid_id, entries in due_entries_by_orcid_id.items():
+            claims = [
+                dict(
+                    credit_type=entry["credit_type"],
+                    start_date=entry["start_date"],
+                    end_date=entry["end_date"],
+                    affiliation_put_code=entry["affiliation_put_code"],
+                )
+                for entry in entries
+            ]
+            try:
+                await self.store.mark_claimed_batch(orcid_id, claims)
+            except CreditStoreError as error:
+                for entry in entries:
+                    await self._record_failed_attempt(entry, error)
+            else:
+                await asyncio.to_thread(self.outbox.remove, [entry["id"] for entry in entries])
+                for entry in entries:
+                    del self._pending[entry["id"]]
+            self._update_metrics()
+
+        if len(self._pending) == 0:
+            return None
+        return max(0.0, min(entry["next_attempt_at"] for entry in self._pending.values()) - time.time())
+
+    async def _record_failed_attempt(self, entry: dict, error: CreditStoreError) -> None:
+        r"""Reschedules the specified entry, or parks it if it has been attempted the maximum number of times"""
+
+        entry["attempts"] += 1
+        entry["last_error"] = repr(error)
+        if entry["attempts"] >= self.max_attempts:
+            logger.error(
+                "Failed to record claim %d times; giving up on it (outbox entry %d): %s",
+                entry["attempts"],
+                entry["id"],
+                error,
+                extra={"orcid_id": entry["orcid_id"], "affiliation_put_code": entry["affiliation_put_code"]},
+            )
+            await asyncio.to_thread(self.outbox.park, entry["id"], entry["attempts"], entry["last_error"])
+            self._parked[entry["id"]] = self._pending.pop(entry["id"])
+            return
+
+        delay = min(self.retry_base_delay_seconds * 2 ** (entry["attempts"] - 1), self.retry_max_delay_seconds)
+        entry["next_attempt_at"] = time.time() + delay
+        logger.warning("Failed to record claim (attempt %d); retrying in %ss: %s", entry["attempts"], delay, error)
+        await asyncio.to_thread(
+            self.outbox.reschedule, entry["id"], entry["attempts"], entry["next_attempt_at"], entry["last_error"]
+        )
+
+    async def _drain_continuously(self) -> None:
+        while True:
+            self._wake_up.clear()
+            try:
+                seconds_until_next_due = await self.drain()
+            except sqlite3.Error as error:
+                logger.exception(error)
+                seconds_until_next_due = self.retry_max_delay_seconds
+            try:
+                await asyncio.wait_for(self._wake_up.wait(), timeout=seconds_until_next_due)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        await self.store.start()
+
+        # Resume draining any entries left over from before the app last stopped.
+        for entry in await asyncio.to_thread(self.outbox.list_entries):
+            if entry["parked_at"] is None:
+                self._pending[entry["id"]] = entry
+            else:
+                self._parked[entry["id"]] = entry
+        if len(self._pending) > 0:
+            logger.info("Replaying %d claim(s) from the outbox", len(self._pending))
+        if len(self._parked) > 0:
+            logger.warning("The outbox contains %d parked claim(s), which will not be replayed", len(self._parked))
+        self._update_metrics()
+        self._worker_task = asyncio.create_task(self._drain_continuously())
+
+    async def aclose(self) -> None:
+        if self._worker_task is not None:
+            self._worker_task.cancel()
+            await asyncio.gather(self._worker_task, return_exceptions=True)
+        self.outbox.close()
+        await self.store.aclose()
@@ -0,0 +1,249 @@
+r"""
+Progress reports of claims the app makes in the background, which clients can follow as Server-Sent Events.
+
+When a client asks the app to claim credits in the background, the app responds right away (with the URL of the
+claim's progress report), and reports each stage of the claim as it finishes (e.g. "affiliation_created"), ending
+with a "done" event (whose data is what the claim endpoint would have responded with) or a "failed" event. Each
+event is kept until the report expires; so a client that subscribes late, or reconnects (sending the ID of the last
+event it received, via the `Last-Event-ID` header), receives the events it missed.
+
+Reference: https://html.spec.whatwg.org/multipage/server-sent-events.html
+"""
+
+import asyncio
+import json
+import logging
+import secrets
+from contextlib import contextmanager
+from typing import AsyncIterator, Awaitable, Callable, Hashable, Iterator, Optional
+
+from nmdc_orcid_creditor.credits_cache import TTLCache
+from nmdc_orcid_creditor.metrics import CLAIM_PROGRESS_SUBSCRIBERS
+
+logger = logging.getLogger("uvicorn")
+
+# Names of the events that end a progress report.
+FINAL_EVENTS = ("done", "failed")
+
+# A comment line, which clients ignore; sent periodically while there are no events, so that intermediaries (e.g.
+# reverse proxies) don't consider the connection idle, and so that we find out if the client has disconnected.
+KEEPALIVE_MESSAGE = b": keepalive\n\n"
+
+
+def format_server_sent_event(event_id: int, event: str, data: dict) -> bytes:
+    r"""
+    Returns the specified event, formatted as a Server-Sent Event (whose data is JSON).
+
+    >>> format_server_sent_event(2, "affiliation_created", {"affiliation_put_code": "123"})
+    b'id: 2\nevent: affiliation_created\ndata: {"affiliation_put_code":"123"}\n\n'
+    """
+
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+class ClaimProgress:
+    r"""
+    The events reported so far about a claim (or a batch of claims) the app is making for the specified ORCID ID.
+
+    >>> async def main():
+    ...     progress = ClaimProgress("0000-0000-0000-0001")
+    ...     progress.report("credit_validated", {"credit_type": "Ambassador 2023"})
+    ...     progress.report("done", {"orcid_id": "0000-0000-0000-0001"})
+    ...     return [message async for message in progress.subscribe(last_event_id=1)]
+    >>> asyncio.run(main())
+    [b'id: 2\nevent: done\ndata: {"orcid_id":"0000-0000-0000-0001"}\n\n']
+    """
+
+    def __init__(self, orcid_id: str):
+        self.orcid_id = orcid_id
+        self.events: list[tuple[str, dict]] = []
+        self.num_subscribers = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def is_finished(self) -> bool:
+        return len(self.events) > 0 and self.events[-1][0] in FINAL_EVENTS
+
+    def report(self, event: str, data: dict) -> None:
+        r"""Reports the specified event to the current subscribers (and to any future ones)"""
+
+        if self.is_finished:
+            return
+        self.events.append((event, data))
+
+        # Wake up the subscribers waiting for this event; and give later ones a new `asyncio.Event` to wait for.
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self, last_event_id: int = 0, keepalive_seconds: float = 15.0) -> AsyncIterator[bytes]:
+        r"""
+        Yields each event (formatted as a Server-Sent Event) after the one having the specified ID, as it is
+        reported; until the report is finished.
+
+        Note: If the client disconnects, the server cancels the task iterating over this; in which case, we stop
+              waiting for events and forget the subscriber.
+        """
+
+        self.num_subscribers += 1
+        CLAIM_PROGRESS_SUBSCRIBERS.labels().inc()
+        try:
+            next_index = max(last_event_id, 0)
+            while True:
+                while next_index < len(self.events):
+                    event, data = self.events[next_index]
+                    next_index += 1
+                    yield format_server_sent_event(next_index, event, data)
+                if self.is_finished:
+                    return
+                # Note: We use `asyncio.timeout` rather than `asyncio.wait_for`, since the latter can swallow the
+                #       cancellation that tells us the client has disconnected (if it arrives as the wait times out).
+                try:
+                    async with asyncio.timeout(keepalive_seconds):
+                        await self._changed.wait()
+                except TimeoutError:
+                    yield KEEPALIVE_MESSAGE
+        finally:
+            self.num_subscribers -= 1
+            CLAIM_PROGRESS_SUBSCRIBERS.labels().dec()
+
+
+class SharedClaimProgress(ClaimProgress):
+    r"""
+    The progress report of a claim that several requests are sharing (i.e. the one that started it, and any duplicates
+    of it that arrived while it was in progress); which relays each event reported to it to the progress report of
+    each of those requests—including the events reported before that request started following it.
+
+    >>> shared_progress, progress = SharedClaimProgress("0000-0000-0000-0001"), ClaimProgress("0000-0000-0000-0001")
+    >>> shared_progress.report("credit_validated", {"credit_type": "Ambassador 2023"})
+    >>> shared_progress.follow(progress)
+    >>> shared_progress.report("affiliation_created", {"affiliation_put_code": "123"})
+    >>> [event for event, data in progress.events]
+    ['credit_validated', 'affiliation_created']
+    """
+
+    def __init__(self, orcid_id: str):
+        super().__init__(orcid_id)
+        self.followers: list[ClaimProgress] = []
+        self.num_callers = 0
+
+    def follow(self, progress: ClaimProgress) -> None:
+        for event, data in self.events:
+            progress.report(event, data)
+        self.followers.append(progress)
+
+    def unfollow(self, progress: ClaimProgress) -> None:
+        self.followers.remove(progress)
+
+    def report(self, event: str, data: dict) -> None:
+        super().report(event, data)
+        for follower in self.followers:
+            follower.report(event, data)
+
+
+class ClaimProgressTracker:
+    r"""
+    Runs claims in the background, keeping each one's progress report (for `ttl_seconds`) under a random ID; so that
+    the client that asked for the claim—and only that client—can subscribe to it.
+
+    Note: When the app shuts down, it waits for the claims in progress to finish (each of which is bounded by the
+          deadline of the request that started it), rather than abandoning them partway through.
+
+    >>> async def main():
+    ...     tracker = ClaimProgressTracker(ttl_seconds=60, max_entries=10)
+    ...     async def claim(progress):
+    ...         progress.report("done", {"credits": []})
+    ...     progress_id = tracker.start("0000-0000-0000-0001", claim)
+    ...     await tracker.aclose()
+    ...     return tracker.get("0000-0000-0000-0002", progress_id), tracker.get("0000-0000-0000-0001", progress_id)
+    >>> other_users_progress, progress = asyncio.run(main())
+    >>> other_users_progress is None, progress.events
+    (True, [('done', {'credits': []})])
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self._progress = TTLCache(ttl_seconds=ttl_seconds, max_entries=max_entries)
+        self._tasks: set[asyncio.Task] = set()
+        self._shared_progress: dict[Hashable, SharedClaimProgress] = {}
+
+    def start(self, orcid_id: str, claim: Callable[[ClaimProgress], Awaitable[None]]) -> str:
+        r"""
+        Starts running the specified claim (which reports its progress to the `ClaimProgress` it is passed, ending
+        with a "done" or "failed" event) in the background; and returns the ID of its progress report.
+        """
+
+        progress_id = secrets.token_urlsafe(16)
+        progress = ClaimProgress(orcid_id)
+        self._progress.set(progress_id, progress)
+        task = asyncio.ensure_future(self._run(progress, claim))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return progress_id
+
+    @staticmethod
+    async def _run(progress: ClaimProgress, claim: Callable[[ClaimProgress], Awaitable[None]]) -> None:
+        try:
+            await claim(progress)
+        except Exception as error:
+            logger.exception(error)
+        finally:
+            # Note: If the claim didn't finish its report (e.g. because it raised an unexpected exception), we do,
+            #       so its subscribers don't wait forever.
+            progress.report("failed", {"status_code": 500, "detail": "Failed to claim credit."})
+
+    @contextmanager
+    def share(
+        self, key: Hashable, orcid_id: str, progress: Optional[ClaimProgress] = None
+    ) -> Iterator[SharedClaimProgress]:
+        r"""
+        Returns the shared progress report of the claim having the specified key (i.e. the key under which concurrent
+        duplicates of the claim are coalesced), which the claim should report its stages to; and, if a progress report
+        is specified, relays those stages to it until the context exits.
+
+        Note: Only the first of the coalesced requests actually runs the claim, so it is the only one whose progress
+              report the claim is given. Sharing the report lets the others report the claim's stages, too.
+
+        >>> async def main():
+        ...     tracker = ClaimProgressTracker(ttl_seconds=60, max_entries=10)
+        ...     progress = ClaimProgress("0000-0000-0000-0001")
+        ...     duplicate_progress = ClaimProgress("0000-0000-0000-0001")
+        ...     with tracker.share("key", "0000-0000-0000-0001", progress) as shared_progress:
+        ...         shared_progress.report("credit_validated", {"credit_type": "Ambassador 2023"})
+        ...         with tracker.share("key", "0000-0000-0000-0001", duplicate_progress):
+        ...             shared_progress.report("affiliation_created", {"affiliation_put_code": "123"})
+        ...     return [event for event, data in duplicate_progress.events], tracker.num_shared
+        >>> asyncio.run(main())
+        (['credit_validated', 'affiliation_created'], 0)
+        """
+
+        shared_progress = self._shared_progress.get(key)
+        if shared_progress is None:
+            shared_progress = self._shared_progress[key] = SharedClaimProgress(orcid_id)
+        shared_progress.num_callers += 1
+        if progress is not None:
+            shared_progress.follow(progress)
+        try:
+            yield shared_progress
+        finally:
+            if progress is not None:
+                shared_progress.unfollow(progress)
+            shared_progress.num_callers -= 1
+            if shared_progress.num_callers == 0:
+                del self._shared_progress[key]
+
+    @property
+    def num_shared(self) -> int:
+        r"""The number of distinct claims whose progress reports are being shared"""
+
+        return len(self._shared_progress)
+
+    def get(self, orcid_id: str, progress_id: str) -> Optional[ClaimProgress]:
+        r"""
+        Returns the specified progress report; or `None` if there is no such report, it has expired, or it is about
+        a claim for a different ORCID ID.
+        """
+
+        progress = self._progress.get(progress_id)
+        return progress if progress is not None and progress.orcid_id == orcid_id else None
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,123 @@
+import gzip
+from typing import Iterable, Optional
+
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Note: Brotli compression is optional; it is available only if the `brotli` package is installed
+#       (e.g. `pip install brotli`). Without it, the app falls back to gzip.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Media types whose contents are worth compressing. Others (e.g. PNG images) are compressed already.
+COMPRESSIBLE_MEDIA_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def is_compressible(media_type: Optional[str]) -> bool:
+    r"""
+    Returns `True` if contents of the specified media type are worth compressing.
+
+    >>> is_compressible("image/svg+xml"), is_compressible("text/html; charset=utf-8"), is_compressible("image/png")
+    (True, True, False)
+    """
+
+    return media_type is not None and media_type.startswith(COMPRESSIBLE_MEDIA_TYPES)
+
+
+def get_available_encodings() -> tuple[str, ...]:
+    r"""Returns the content encodings the app can produce, in order of preference"""
+
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(content: bytes, encoding: str) -> bytes:
+    r"""
+    Compresses the specified content, as much as possible, using the specified content encoding.
+
+    Note: We compress ahead of time (e.g. static files, when the app starts), so we use the highest levels.
+
+    >>> gzip.decompress(compress(b"hello " * 100, "gzip")) == b"hello " * 100
+    True
+    """
+
+    if encoding == "br":
+        return brotli.compress(content, quality=11)
+    if encoding == "gzip":
+        # Note: We fix the timestamp in the gzip header, so that compressing the same content yields the same bytes.
+        return gzip.compress(content, compresslevel=9, mtime=0)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def choose_content_encoding(accept_encoding: Optional[str], available_encodings: Iterable[str]) -> Optional[str]:
+    r"""
+    Returns the first of the available content encodings that the `Accept-Encoding` request header accepts, or
+    `None` if it accepts none of them (in which case the content should be sent uncompressed).
+
+    Reference: https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Accept-Encoding
+
+    >>> choose_content_encoding("gzip, deflate, br", ("br", "gzip"))
+    'br'
+    >>> choose_content_encoding("gzip, br;q=0", ("br", "gzip"))
+    'gzip'
+    >>> choose_content_encoding("*", ("br", "gzip"))
+    'br'
+    >>> choose_content_encoding(None, ("br", "gzip")) is None
+    True
+    """
+
+    if not accept_encoding:
+        return None
+
+    # Parse the header into a mapping from each coding (e.g. "gzip") to its quality value (e.g. 1.0).
+    qualities: dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        name, _, value = params.strip().partition("=")
+        if name.strip() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    for encoding in available_encodings:
+        if qualities.get(encoding, qualities.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class CompressionMiddleware:
+    r"""
+    Compresses (via gzip) responses that are at least `minimum_size` bytes long, for clients that accept that, except
+    responses to requests whose paths start with any of the `excluded_path_prefixes`.
+
+    Note: We exclude the static files, which `FingerprintedStaticFiles` compresses ahead of time (once), instead of
+          for each request. Responses that already have a `Content-Encoding` (or are event streams) are left as is.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int,
+        compress_level: int = 6,
+        excluded_path_prefixes: tuple[str, ...] = ("/static/",),
+    ):
+        self.app = app
+        self.gzip_app = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=compress_level)
+        self.excluded_path_prefixes = excluded_path_prefixes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(self.excluded_path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        await self.gzip_app(scope, receive, send)
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -12,24 +14,174 @@ class Config(BaseSettings):
     # Base URL end users can use to access this web application.
     SERVER_BASE_URL: str = ""
 
-    # Random string the `SessionMiddleware` will use to encrypt session cookie values.
-    # Reference: https://www.starlette.io/middleware/#sessionmiddleware
+    # Random string the `ServerSideSessionMiddleware` will use to sign session cookie values (i.e. session IDs).
     SERVER_SESSION_SECRET_KEY: str = ""
 
+    # Where the app stores the contents of each session (e.g. the user's ORCID access token), and for how long.
+    # The session cookie contains only the session's ID. Expired sessions are deleted every
+    # `SESSION_SWEEP_INTERVAL_SECONDS` seconds.
+    # - "memory": the memory of the app's process (sessions do not survive the app restarting)
+    # - "sqlite": a local SQLite database
+    SESSION_STORE_BACKEND: Literal["memory", "sqlite"] = "memory"
+    SESSION_STORE_SQLITE_PATH: str = "sessions.sqlite3"
+    SESSION_MAX_AGE_SECONDS: int = 14 * 24 * 60 * 60
+    SESSION_SWEEP_INTERVAL_SECONDS: float = 600.0
+
     # ORCID URLs, Oauth scopes, and Client (integration) information.
     # Reference: https://info.orcid.org/documentation/api-tutorials/api-tutorial-add-and-update-data-on-an-orcid-record/
     ORCID_ACCESS_TOKEN_URL: str = "https://orcid.org/oauth/token"  # ends with "/token"
     ORCID_AUTHORIZE_BASE_URL: str = "https://orcid.org/oauth/authorize"  # ends with "/authorize"
     ORCID_API_BASE_URL: str = "https://api.orcid.org/v3.0"  # ends with "/v3.0"
+    ORCID_PUBLIC_API_BASE_URL: str = "https://pub.orcid.org/v3.0"  # ends with "/v3.0"; used by `reconcile.py`
     ORCID_OAUTH_SCOPES: str = "/authenticate /activities/update"  # space-delimited list
     ORCID_CLIENT_ID: str = ""
     ORCID_CLIENT_SECRET: str = ""
 
+    # How long before a user's ORCID access token expires the app starts renewing it (in the background) via the
+    # refresh token ORCID issued along with it; so the user doesn't have to log in again. A token that has already
+    # expired is renewed when the user next makes a request.
+    ORCID_ACCESS_TOKEN_REFRESH_MARGIN_SECONDS: float = 24 * 60 * 60.0
+
     # URL and shared secret used to access the NMDC ORCID Creditor Proxy,
     # which is a web application running on the Google Apps Script platform.
     NMDC_ORCID_CREDITOR_PROXY_URL: str = ""  # ends with "/exec"
     NMDC_ORCID_CREDITOR_PROXY_SHARED_SECRET: str = ""
 
+    # The format in which the app asks the proxy to return credits (see `wire_format.py`). The "columnar" format is
+    # more compact than the original "objects" format. Versions of the proxy that predate it respond in the "objects"
+    # format instead, which the app still accepts.
+    PROXY_WIRE_FORMAT: Literal["objects", "columnar"] = "columnar"
+
+    # Where the app reads credits from and records claims to:
+    # - "proxy":    the Google Sheets document, via the proxy (with per-ORCID ID caching)
+    # - "snapshot": an in-memory copy of the whole Google Sheets document, which the app downloads via
+    #               the proxy every `CREDIT_SNAPSHOT_REFRESH_INTERVAL_SECONDS` seconds (claims are still
+    #               recorded via the proxy)
+    # - "sqlite":   a local SQLite database (e.g. for offline development and benchmarking)
+    CREDIT_STORE_BACKEND: Literal["proxy", "snapshot", "sqlite"] = "proxy"
+    CREDIT_STORE_SQLITE_PATH: str = "credits.sqlite3"
+    CREDIT_SNAPSHOT_REFRESH_INTERVAL_SECONDS: float = 300.0
+
+    # Whether—when the app records claims via the proxy—the app records them in the background, via a durable
+    # outbox (a local SQLite database), instead of making the user wait for the proxy. Failed attempts to record
+    # a claim are retried with exponential backoff, and claims left in the outbox are retried when the app starts.
+    # A claim that still hasn't been recorded after `CLAIM_OUTBOX_MAX_ATTEMPTS` attempts is parked (i.e. kept in the
+    # outbox, but no longer retried), for an operator to look into.
+    CLAIM_OUTBOX_ENABLED: bool = True
+    CLAIM_OUTBOX_PATH: str = "claim_outbox.sqlite3"
+    CLAIM_OUTBOX_RETRY_BASE_DELAY_SECONDS: float = 2.0
+    CLAIM_OUTBOX_RETRY_MAX_DELAY_SECONDS: float = 300.0
+    CLAIM_OUTBOX_MAX_ATTEMPTS: int = 20
+
+    # Connection pool limits, timeouts, and protocol options for the HTTP client the app
+    # uses to send requests to upstream services (i.e. the proxy and the ORCID API).
+    # Note: Enabling HTTP/2 requires the `h2` package (e.g. `pip install httpx[http2]`).
+    # Reference: https://www.python-httpx.org/advanced/resource-limits/
+    # Reference: https://www.python-httpx.org/advanced/timeouts/
+    HTTP_CLIENT_MAX_CONNECTIONS: int = 100
+    HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_CLIENT_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    HTTP_CLIENT_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    HTTP_CLIENT_READ_TIMEOUT_SECONDS: float = 30.0  # Apps Script responses can take several seconds
+    HTTP_CLIENT_POOL_TIMEOUT_SECONDS: float = 5.0
+    HTTP_CLIENT_HTTP2_ENABLED: bool = False
+
+    # Limits on the requests the app sends to the proxy; since Apps Script limits the number of concurrent executions
+    # of (and the daily quota for) the proxy, and exceeding them would fail everyone's requests. At most
+    # `PROXY_MAX_CONCURRENCY` requests are sent at a time, and up to `PROXY_MAX_QUEUE_LENGTH` more wait for their
+    # turn. Once the queue is full, reads are rejected (with a "429 Too Many Requests" response) until there is room.
+    PROXY_MAX_CONCURRENCY: int = 20
+    PROXY_MAX_QUEUE_LENGTH: int = 100
+
+    # Limits on the rate at which each session, and each ORCID ID, can send requests that involve reading or claiming
+    # credits (on average, and in bursts). Requests exceeding them get a "429 Too Many Requests" response. Setting
+    # either value of a limit to 0 disables that limit.
+    RATE_LIMIT_PER_SESSION_PER_SECOND: float = 1.0
+    RATE_LIMIT_PER_SESSION_BURST: int = 10
+    RATE_LIMIT_PER_ORCID_ID_PER_SECOND: float = 2.0
+    RATE_LIMIT_PER_ORCID_ID_BURST: int = 20
+
+    # Overall time budget for handling each request; which bounds the timeouts (and retries) of the requests the app
+    # sends to upstream services while handling it. Each attempt to send a request to the proxy or to ORCID is also
+    # limited to `{PROXY,ORCID}_ATTEMPT_TIMEOUT_SECONDS`. Failed reads from the proxy are retried (up to
+    # `PROXY_READ_RETRY_MAX_ATTEMPTS` attempts in total), with jittered exponential backoff.
+    REQUEST_DEADLINE_SECONDS: float = 20.0
+    PROXY_ATTEMPT_TIMEOUT_SECONDS: float = 10.0
+    PROXY_READ_RETRY_MAX_ATTEMPTS: int = 3
+    PROXY_READ_RETRY_BASE_DELAY_SECONDS: float = 0.2
+    PROXY_READ_RETRY_MAX_DELAY_SECONDS: float = 2.0
+    ORCID_ATTEMPT_TIMEOUT_SECONDS: float = 10.0
+
+    # After this many consecutive failed requests to the proxy (or to ORCID), the app stops sending requests to it
+    # (failing fast, or serving cached credits even if they have expired) for `CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS`;
+    # after which it lets a single trial request through to check whether it has recovered.
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS: float = 30.0
+
+    # Lifetime and capacity of the in-memory cache of each ORCID ID's credits. Setting
+    # either one to 0 disables the cache.
+    CREDITS_CACHE_TTL_SECONDS: float = 60.0
+    CREDITS_CACHE_MAX_ENTRIES: int = 1000
+
+    # How long the "Credits" page waits for the user's credits (which the app starts fetching when the user logs in)
+    # so it can embed them. If they aren't available by then, the page is rendered without them and fetches them
+    # from the API instead.
+    CREDITS_PAGE_INLINE_WAIT_SECONDS: float = 3.0
+
+    # Minimum size of a response (e.g. an HTML page or a JSON payload) the app compresses, for clients that accept
+    # compressed responses. Smaller responses aren't worth the CPU time.
+    RESPONSE_COMPRESSION_MINIMUM_SIZE_BYTES: int = 1024
+
+    # Bearer token that grants access to the admin API endpoints (e.g. `/api/stats`). If empty, those endpoints
+    # are disabled.
+    ADMIN_API_KEY: str = ""
+
+    # How often the app rescans the whole credit store (in pages of `CREDIT_STATS_SEED_PAGE_SIZE` credits) to reseed
+    # the counters behind `/api/stats`; which otherwise are updated incrementally as credits are claimed. Rescanning
+    # accounts for credits that were added to the Google Sheets document since the last scan.
+    CREDIT_STATS_RESEED_INTERVAL_SECONDS: float = 6 * 60 * 60.0
+    CREDIT_STATS_SEED_PAGE_SIZE: int = 1000
+
+    # Where the app sends the spans of the requests it traces (see `tracing.py`), and what fraction of those requests
+    # it traces (from 0.0 to 1.0):
+    # - "memory": an in-memory buffer of the most recent `TRACING_BUFFER_CAPACITY` spans, which the `/api/traces`
+    #             (admin) endpoint returns
+    # - "jsonl":  a JSON Lines file, at `TRACING_JSONL_PATH`
+    # - "none":   nowhere (i.e. tracing is disabled)
+    TRACING_EXPORTER: Literal["memory", "jsonl", "none"] = "memory"
+    TRACING_SAMPLE_RATE: float = 1.0
+    TRACING_BUFFER_CAPACITY: int = 2000
+    TRACING_JSONL_PATH: str = "traces.jsonl"
+
+    # How the app logs. Log records are formatted and written to the console on a background thread (see
+    # `structured_logging.py`), as JSON ("json") or as plain text ("text"); with secrets (e.g. tokens) redacted.
+    # - `LOG_LEVEL`: minimum level of the records of the app itself (and of uvicorn's messages about the server)
+    # - `LOG_ACCESS_LEVEL`: minimum level of uvicorn's access log records (one per request, at the "INFO" level)
+    # - `LOG_HTTP_CLIENT_LEVEL`: minimum level of httpx's records (one per upstream request, at the "INFO" level)
+    # - `LOG_DEBUG_SAMPLE_RATE`: fraction (from 0.0 to 1.0) of "DEBUG" records that are written (the rest are dropped)
+    # - `LOG_QUEUE_MAX_SIZE`: maximum number of records waiting to be written; beyond which, records are dropped
+    LOG_LEVEL: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "INFO"
+    LOG_ACCESS_LEVEL: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "INFO"
+    LOG_HTTP_CLIENT_LEVEL: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "WARNING"
+    LOG_FORMAT: Literal["json", "text"] = "json"
+    LOG_DEBUG_SAMPLE_RATE: float = 1.0
+    LOG_QUEUE_MAX_SIZE: int = 10000
+
+    # Maximum number of ORCID affiliations the app will create concurrently when a user claims multiple credits at once.
+    CLAIM_BATCH_MAX_CONCURRENCY: int = 4
+
+    # How long, and for how many claims, the app keeps the progress report of each claim it makes in the background
+    # (see `claim_progress.py`), which the client follows via Server-Sent Events; and how often the app sends the
+    # client a keepalive message while there is no progress to report.
+    CLAIM_PROGRESS_TTL_SECONDS: float = 10 * 60.0
+    CLAIM_PROGRESS_MAX_ENTRIES: int = 10000
+    CLAIM_PROGRESS_KEEPALIVE_SECONDS: float = 15.0
+
+    # How long, and for how many requests, the app remembers its responses to requests that have an `Idempotency-Key`
+    # header; so it can respond to a retried request the same way, instead of claiming the credit(s) again.
+    IDEMPOTENCY_KEY_TTL_SECONDS: float = 24 * 60 * 60.0
+    IDEMPOTENCY_KEY_MAX_ENTRIES: int = 10000
+
     # Configure the class to read environment variable definitions from a `.env` file,
     # if such a file is present.
     # Reference: https://fastapi.tiangolo.com/advanced/settings/#reading-a-env-file
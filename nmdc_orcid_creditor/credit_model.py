@@ -0,0 +1,162 @@
+r"""
+The app's in-memory representation of a credit.
+
+Throughout the app, a credit is a dictionary mapping the names of the columns of the Google Sheets document
+(e.g. "column.ORCID_ID") to the credit's values in those columns, since that is how the proxy represents it.
+The credit stores build each credit as a `Credit`, which is such a dictionary, that also remembers the things the
+app derives from those values (e.g. the credit's parsed dates) once they have been derived; so that, when a credit
+is served from a cache or an index, claiming it doesn't involve deriving them again.
+"""
+
+from typing import Optional
+
+from nmdc_orcid_creditor.helpers import extract_year_month_day_from_datetime_string
+
+ClaimKey = tuple[str, str, str, str]
+DateParts = tuple[str, str, str]  # (year, month, day)
+
+
+def make_claim_key(credit: dict) -> ClaimKey:
+    r"""
+    Returns the combination of {ORCID ID, credit type, start date, end date} values that identifies the credit.
+
+    >>> make_claim_key({"column.ORCID_ID": "0000-0000-0000-0001", "column.CREDIT_TYPE": "Ambassador 2023"})
+    ('0000-0000-0000-0001', 'Ambassador 2023', '', '')
+    """
+
+    return (
+        credit.get("column.ORCID_ID", ""),
+        credit.get("column.CREDIT_TYPE", ""),
+        credit.get("column.START_DATE", ""),
+        credit.get("column.END_DATE", ""),
+    )
+
+
+def make_affiliation_date(date_parts: Optional[DateParts]) -> Optional[dict]:
+    r"""
+    Returns the ORCID API representation of the specified date, or `None` if there is no date.
+
+    >>> make_affiliation_date(("2023", "01", "23"))
+    {'year': {'value': '2023'}, 'month': {'value': '01'}, 'day': {'value': '23'}}
+    """
+
+    if date_parts is None:
+        return None
+    year, month, day = date_parts
+    return {"year": {"value": year}, "month": {"value": month}, "day": {"value": day}}
+
+
+class Credit(dict):
+    r"""
+    A credit (i.e. a dictionary mapping column names to values), which remembers the values derived from it.
+
+    Note: The derived values depend only on the columns that identify the credit and describe its affiliation, which
+          don't change once the credit has been read from the Google Sheets document. Values that do change (e.g.
+          whether the credit has been claimed) are read from the dictionary every time.
+
+    >>> credit = Credit({"column.CREDIT_TYPE": "Ambassador 2023", "column.START_DATE": "2023-01-23T08:00:00.000Z"})
+    >>> credit.claim_key
+    ('', 'Ambassador 2023', '2023-01-23T08:00:00.000Z', '')
+    >>> credit.date_parts
+    (('2023', '01', '23'), None)
+    >>> credit == {"column.CREDIT_TYPE": "Ambassador 2023", "column.START_DATE": "2023-01-23T08:00:00.000Z"}
+    True
+    >>> Credit.of(credit) is credit
+    True
+    >>> credit.copy().claim_key is credit.claim_key  # the copy remembers the derived values, too
+    True
+    """
+
+    __slots__ = ("_claim_key", "_date_parts", "_affiliation_details")
+
+    @classmethod
+    def of(cls, credit: dict) -> "Credit":
+        r"""Returns the specified credit if it is a `Credit` already; otherwise, returns a `Credit` copy of it"""
+
+        return credit if isinstance(credit, cls) else cls(credit)
+
+    def copy(self) -> "Credit":
+        r"""Returns a shallow copy of the credit, which remembers the values derived from it so far"""
+
+        credit = Credit(self)
+        for name in self.__slots__:
+            try:
+                setattr(credit, name, getattr(self, name))
+            except AttributeError:
+                pass
+        return credit
+
+    @property
+    def claim_key(self) -> ClaimKey:
+        r"""The combination of values that identifies the credit (see `make_claim_key`)"""
+
+        try:
+            return self._claim_key
+        except AttributeError:
+            self._claim_key = make_claim_key(self)
+            return self._claim_key
+
+    @property
+    def affiliation_type(self) -> str:
+        r"""The type of ORCID affiliation (i.e. "membership" or "service") that describes the credit"""
+
+        return self.get("column.AFFILIATION_TYPE", "").strip()
+
+    @property
+    def date_parts(self) -> tuple[Optional[DateParts], Optional[DateParts]]:
+        r"""
+        The (year, month, day) strings of the credit's start date and end date; each of which is `None` if the
+        credit doesn't have that date.
+
+        Note: This raises a `ValueError` if either date is not in ISO 8601 format.
+
+        >>> Credit({"column.START_DATE": "2023-01-23", "column.END_DATE": "not a date"}).date_parts
+        Traceback (most recent call last):
+        ...
+        ValueError: Invalid isoformat string: 'not a date'
+        """
+
+        try:
+            return self._date_parts
+        except AttributeError:
+            start_date = self.get("column.START_DATE", "").strip()
+            end_date = self.get("column.END_DATE", "").strip()
+            self._date_parts = (
+                extract_year_month_day_from_datetime_string(start_date) if len(start_date) > 0 else None,
+                extract_year_month_day_from_datetime_string(end_date) if len(end_date) > 0 else None,
+            )
+            return self._date_parts
+
+    @property
+    def affiliation_details(self) -> dict:
+        r"""
+        The fields of the ORCID affiliation describing the credit that are specific to the credit (as opposed to
+        the organization, which is the same for every credit).
+
+        Note: The ORCID API does allow the top-level "start-date" and "end-date" fields to be omitted.
+              When "start-date" is omitted, the person's ORCID profile will show only the end date (e.g. "2023-12-31 | Team member").
+              When "end-date" is omitted, the person's ORCID profile will append "to present" (e.g. "2022-01-01 to present | Team member").
+              When both are omitted, the person's ORCID profile will not show any dates (e.g. "Team member").
+
+        Note: Submitting a "url.value" value of "" is OK. In that situation, ORCID will not display the "URL" field
+              for the affiliation.
+
+        Note: This raises a `ValueError` if either date is not in ISO 8601 format. The returned dictionary is shared
+              by every caller, so it must not be modified.
+
+        >>> Credit({"column.CREDIT_TYPE": "Ambassador 2023", "column.END_DATE": "2023-12-31"}).affiliation_details
+        {'role-title': 'Ambassador 2023', 'end-date': {'year': {'value': '2023'}, 'month': {'value': '12'}, 'day': {'value': '31'}}, 'url': {'value': ''}}
+        """
+
+        try:
+            return self._affiliation_details
+        except AttributeError:
+            start_date_parts, end_date_parts = self.date_parts
+            details = {"role-title": f"{self.get('column.CREDIT_TYPE', '')}"}
+            if start_date_parts is not None:
+                details["start-date"] = make_affiliation_date(start_date_parts)
+            if end_date_parts is not None:
+                details["end-date"] = make_affiliation_date(end_date_parts)
+            details["url"] = {"value": self.get("column.DETAILS_URL", "").strip()}
+            self._affiliation_details = details
+            return details
@@ -0,0 +1,267 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Literal, Optional
+
+from nmdc_orcid_creditor.credit_store import CreditStore, CreditStoreError
+from nmdc_orcid_creditor.resilience import UpstreamUnavailableError
+
+logger = logging.getLogger("uvicorn")
+
+Granularity = Literal["day", "month", "year"]
+
+# Length of the prefix of an ISO 8601 date (e.g. "2024-06-01") that identifies the time bucket, of each granularity,
+# the date is in (e.g. "2024-06" for the "month" granularity).
+BUCKET_LENGTHS: dict[str, int] = {"day": 10, "month": 7, "year": 4}
+
+# The columns the statistics are computed from (along with those that identify each claim), which are the only ones
+# we ask the credit store for when seeding them.
+SEED_COLUMNS = (
+    "column.ORCID_ID",
+    "column.CREDIT_TYPE",
+    "column.START_DATE",
+    "column.END_DATE",
+    "column.CLAIMED_AT",
+    "column.AFFILIATION_PUT_CODE",
+)
+
+
+def get_claim_date(claimed_at: str) -> Optional[str]:
+    r"""
+    Returns the (UTC) date, in the ISO 8601 format, of the specified `column.CLAIMED_AT` value; or `None` if
+    the value is not a valid timestamp.
+
+    >>> get_claim_date("2024-06-01T23:30:00.000Z")
+    '2024-06-01'
+    >>> get_claim_date("2024-06-01T23:30:00.000-05:00")
+    '2024-06-02'
+    >>> get_claim_date("") is None
+    True
+    """
+
+    try:
+        claimed_at_datetime = datetime.fromisoformat(claimed_at.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if claimed_at_datetime.tzinfo is None:
+        claimed_at_datetime = claimed_at_datetime.replace(tzinfo=timezone.utc)
+    return claimed_at_datetime.astimezone(timezone.utc).date().isoformat()
+
+
+class CreditCounters:
+    r"""
+    Counts of credits and claims, per credit type; and counts of claims per time bucket (of each granularity).
+
+    >>> counters = CreditCounters()
+    >>> counters.add_credit({"column.CREDIT_TYPE": "Ambassador 2023", "column.CLAIMED_AT": ""})
+    >>> counters.add_claim("Ambassador 2023", "2024-06-01T12:00:00.000Z")
+    >>> counters.num_credits, counters.num_claimed
+    (Counter({'Ambassador 2023': 1}), Counter({'Ambassador 2023': 1}))
+    >>> counters.num_claims_by_bucket["month"]
+    {'Ambassador 2023': Counter({'2024-06': 1})}
+    """
+
+    __slots__ = ("num_credits", "num_claimed", "num_claims_by_bucket")
+
+    def __init__(self):
+        self.num_credits: Counter[str] = Counter()  # credit type -> number of credits
+        self.num_claimed: Counter[str] = Counter()  # credit type -> number of claimed credits
+        self.num_claims_by_bucket: dict[str, dict[str, Counter[str]]] = {
+            granularity: {} for granularity in BUCKET_LENGTHS
+        }  # granularity -> credit type -> bucket -> number of claims
+
+    def add_credit(self, credit: dict) -> None:
+        r"""Counts the specified credit (represented the way the proxy represents it), and its claim, if any"""
+
+        credit_type = credit.get("column.CREDIT_TYPE", "")
+        self.num_credits[credit_type] += 1
+        claimed_at = credit.get("column.CLAIMED_AT") or ""
+        if claimed_at != "":
+            self.add_claim(credit_type, claimed_at)
+
+    def add_claim(self, credit_type: str, claimed_at: str) -> None:
+        r"""
+        Counts a claim of a credit of the specified type, made at the specified time.
+
+        Note: Claims whose timestamps are invalid are counted, but not in any time bucket.
+        """
+
+        self.num_claimed[credit_type] += 1
+        claim_date = get_claim_date(claimed_at)
+        if claim_date is None:
+            return
+        for granularity, bucket_length in BUCKET_LENGTHS.items():
+            counts = self.num_claims_by_bucket[granularity].setdefault(credit_type, Counter())
+            counts[claim_date[:bucket_length]] += 1
+
+
+def get_claim_rate(num_claimed: int, num_credits: int) -> Optional[float]:
+    r"""
+    Returns the fraction of credits that have been claimed, or `None` if there are no credits.
+
+    >>> get_claim_rate(1, 4), get_claim_rate(0, 0)
+    (0.25, None)
+    """
+
+    return num_claimed / num_credits if num_credits > 0 else None
+
+
+class CreditStats:
+    r"""
+    Statistics about the credits in a credit store (e.g. how many credits of each type have been claimed, and when),
+    which are kept up to date incrementally; so that reporting them doesn't involve reading the whole store.
+
+    The counters are seeded by scanning the whole store (page by page) in the background when the app starts, and
+    again every `reseed_interval_seconds` (to account for credits added to the Google Sheets document meanwhile).
+    In between, each claim the app makes is counted via `record_claim`.
+
+    Note: Claims made while the store is being scanned may or may not be reflected in the scan. So, we keep track
+          of them, and—once the scan finishes—count the ones the scan didn't (identifying them by their put-codes).
+
+    >>> stats = CreditStats(credit_store=None, reseed_interval_seconds=60, clock=lambda: 0.0)
+    >>> stats.is_seeded
+    False
+    >>> stats.seed_from_credits([
+    ...     {"column.CREDIT_TYPE": "Ambassador 2023", "column.CLAIMED_AT": ""},
+    ...     {"column.CREDIT_TYPE": "Ambassador 2023", "column.CLAIMED_AT": ""},
+    ... ])
+    >>> stats.record_claim("Ambassador 2023", "2024-06-01T12:00:00.000Z", affiliation_put_code="123")
+    >>> stats.report(granularity="month")["credit_types"]
+    [{'credit_type': 'Ambassador 2023', 'num_credits': 2, 'num_claimed': 1, 'claim_rate': 0.5, 'buckets': [{'bucket': '2024-06', 'num_claims': 1, 'num_claimed_by_end': 1, 'claim_rate_by_end': 0.5}]}]
+    """
+
+    def __init__(
+        self,
+        credit_store: Optional[CreditStore],
+        reseed_interval_seconds: float,
+        page_size: int = 1000,
+        retry_delay_seconds: float = 60.0,
+        clock: Callable[[], float] = lambda: datetime.now(timezone.utc).timestamp(),
+    ):
+        self.credit_store = credit_store
+        self.reseed_interval_seconds = reseed_interval_seconds
+        self.page_size = page_size
+        self.retry_delay_seconds = retry_delay_seconds
+        self._clock = clock
+        self.counters: Optional[CreditCounters] = None
+        self.seeded_at: Optional[float] = None
+        self._claims_during_seed: Optional[list[tuple[str, str, str]]] = None  # (type, claimed at, put-code)
+        self._seed_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_seeded(self) -> bool:
+        r"""Whether the counters have been seeded (i.e. whether the statistics can be reported)"""
+
+        return self.counters is not None
+
+    def record_claim(self, credit_type: str, claimed_at: str, affiliation_put_code: str) -> None:
+        r"""Counts a claim the app has made"""
+
+        if self.counters is not None:
+            self.counters.add_claim(credit_type, claimed_at)
+        if self._claims_during_seed is not None:
+            self._claims_during_seed.append((credit_type, claimed_at, str(affiliation_put_code)))
+
+    def seed_from_credits(self, credits: list[dict]) -> None:
+        r"""Replaces the counters with ones seeded from the specified credits (e.g. in tests)"""
+
+        counters = CreditCounters()
+        for credit in credits:
+            counters.add_credit(credit)
+        self.counters = counters
+        self.seeded_at = self._clock()
+
+    async def seed(self) -> None:
+        r"""Scans the whole credit store and replaces the counters with ones seeded from its credits"""
+
+        counters = CreditCounters()
+        claimed_put_codes = set()
+        self._claims_during_seed = []
+        try:
+            async for credits in self.credit_store.iter_credit_pages(self.page_size, columns=SEED_COLUMNS):
+                for credit in credits:
+                    counters.add_credit(credit)
+                    if credit.get("column.CLAIMED_AT"):
+                        claimed_put_codes.add(str(credit.get("column.AFFILIATION_PUT_CODE", "")))
+            for credit_type, claimed_at, affiliation_put_code in self._claims_during_seed:
+                if affiliation_put_code not in claimed_put_codes:
+                    counters.add_claim(credit_type, claimed_at)
+        finally:
+            self._claims_during_seed = None
+
+        self.counters = counters
+        self.seeded_at = self._clock()
+        logger.info("Seeded credit statistics from %d credits", sum(counters.num_credits.values()))
+
+    async def _seed_periodically(self) -> None:
+        while True:
+            try:
+                await self.seed()
+                delay_seconds = self.reseed_interval_seconds
+            except (CreditStoreError, UpstreamUnavailableError) as error:
+                logger.warning("Failed to seed credit statistics: %s", error)
+                delay_seconds = min(self.retry_delay_seconds, self.reseed_interval_seconds)
+            await asyncio.sleep(delay_seconds)
+
+    async def start(self) -> None:
+        self._seed_task = asyncio.create_task(self._seed_periodically())
+
+    async def aclose(self) -> None:
+        if self._seed_task is not None:
+            self._seed_task.cancel()
+            await asyncio.gather(self._seed_task, return_exceptions=True)
+
+    def report(self, granularity: Granularity = "month", credit_type: Optional[str] = None) -> dict:
+        r"""
+        Returns the number of credits, number of claimed credits, and claim rate of each credit type (or only of
+        the specified one); along with the number of claims made in each time bucket of the specified granularity,
+        and the claim rate as of the end of that bucket.
+
+        Note: This takes time proportional to the number of credit types and time buckets, regardless of the
+              number of credits.
+        """
+
+        counters = self.counters
+        if counters is None:
+            raise RuntimeError("The credit statistics have not been seeded yet")
+
+        credit_types = sorted(counters.num_credits.keys() | counters.num_claimed.keys())
+        if credit_type is not None:
+            credit_types = [credit_type] if credit_type in credit_types else []
+
+        reports = []
+        for name in credit_types:
+            num_credits = counters.num_credits[name]
+            buckets = []
+            num_claimed_by_end = 0
+            for bucket, num_claims in sorted(counters.num_claims_by_bucket[granularity].get(name, {}).items()):
+                num_claimed_by_end += num_claims
+                buckets.append(
+                    {
+                        "bucket": bucket,
+                        "num_claims": num_claims,
+                        "num_claimed_by_end": num_claimed_by_end,
+                        "claim_rate_by_end": get_claim_rate(num_claimed_by_end, num_credits),
+                    }
+                )
+            reports.append(
+                {
+                    "credit_type": name,
+                    "num_credits": num_credits,
+                    "num_claimed": counters.num_claimed[name],
+                    "claim_rate": get_claim_rate(counters.num_claimed[name], num_credits),
+                    "buckets": buckets,
+                }
+            )
+
+        num_credits = sum(report["num_credits"] for report in reports)
+        num_claimed = sum(report["num_claimed"] for report in reports)
+        return {
+            "seeded_at": datetime.fromtimestamp(self.seeded_at, timezone.utc).isoformat(),
+            "granularity": granularity,
+            "num_credits": num_credits,
+            "num_claimed": num_claimed,
+            "claim_rate": get_claim_rate(num_claimed, num_credits),
+            "credit_types": reports,
+        }
@@ -0,0 +1,744 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable, Optional, Sequence
+
+import httpx
+
+from nmdc_orcid_creditor.config import Config
+from nmdc_orcid_creditor.credit_model import Credit, make_claim_key
+from nmdc_orcid_creditor.credits_cache import CreditsCache
+from nmdc_orcid_creditor.metrics import track_upstream_request
+from nmdc_orcid_creditor.resilience import (
+    AdmissionController,
+    AdmissionRejectedError,
+    CircuitBreaker,
+    RetryPolicy,
+    UpstreamUnavailableError,
+    get_attempt_timeout,
+    get_remaining_budget_seconds,
+)
+from nmdc_orcid_creditor.wire_format import WireFormat, decode_credits
+
+logger = logging.getLogger("uvicorn")
+
+
+class CreditStoreError(Exception):
+    r"""Raised when a credit store fails to read or write credits"""
+
+
+class CreditStoreOverloadedError(CreditStoreError):
+    r"""Raised when a credit store turns away a request because it is handling too many already"""
+
+    def __init__(self, message: str, retry_after_seconds: float):
+        super().__init__(message)
+        self.retry_after_seconds = retry_after_seconds
+
+
+class CreditStore(ABC):
+    r"""
+    A place where credits are stored.
+
+    Each credit is represented as a dictionary whose keys are the names of the columns of the Google Sheets
+    document (e.g. "column.ORCID_ID"), since that is the format in which the proxy returns them.
+    """
+
+    # Whether `mark_claimed` returns before the claim has been recorded (i.e. records it in the background).
+    defers_claim_recording = False
+
+    @abstractmethod
+    async def list_credits(self, orcid_id: str) -> list[dict]:
+        r"""Returns all credits associated with the specified ORCID ID"""
+
+    @abstractmethod
+    async def mark_claimed(
+        self,
+        orcid_id: str,
+        credit_type: str,
+        start_date: str,
+        end_date: str,
+        affiliation_put_code: str,
+    ) -> list[dict]:
+        r"""
+        Marks the first unclaimed credit having the specified combination of {ORCID ID, credit type, start date,
+        end date} values as having been claimed, and stores the specified affiliation "put-code" with it.
+
+        If a credit having that combination of values has already been claimed with that put-code (e.g. because
+        this is a retry of a claim whose response was lost), this does nothing; so that retrying a claim is safe.
+
+        Returns all credits associated with the specified ORCID ID, which will reflect the update.
+        """
+
+    async def mark_claimed_batch(self, orcid_id: str, claims: list[dict]) -> list[dict]:
+        r"""
+        Marks multiple credits of the specified ORCID ID as having been claimed. Each claim is a dictionary having the
+        keys `credit_type`, `start_date`, `end_date`, and `affiliation_put_code` (see `mark_claimed`).
+
+        Returns all credits associated with the specified ORCID ID, which will reflect the updates.
+        """
+
+        for claim in claims:
+            await self.mark_claimed(orcid_id=orcid_id, **claim)
+        return await self.list_credits(orcid_id)
+
+    async def find_unclaimed_credit(
+        self,
+        orcid_id: str,
+        credit_type: str,
+        start_date: str,
+        end_date: str,
+    ) -> Optional[dict]:
+        r"""
+        Returns the first unclaimed credit having the specified combination of {ORCID ID, credit type, start date,
+        end date} values, or `None` if there is no such credit.
+
+        Note: The credit's `column.CLAIMED_AT` value will be an empty string when that cell in the
+              Google Sheets spreadsheet is empty (which we use to indicate that the credit has not
+              been claimed).
+        """
+
+        for credit in await self.list_credits(orcid_id):
+            if (
+                credit.get("column.ORCID_ID") == orcid_id
+                and credit.get("column.CREDIT_TYPE") == credit_type
+                and credit.get("column.START_DATE") == start_date
+                and credit.get("column.END_DATE") == end_date
+                and credit.get("column.CLAIMED_AT") == ""
+            ):
+                return credit
+        return None
+
+    @abstractmethod
+    def iter_credit_pages(self, page_size: int, columns: Optional[Sequence[str]] = None) -> AsyncIterator[list[dict]]:
+        r"""
+        Yields all credits in the store (i.e. those of every ORCID ID), one page (of at most `page_size` credits)
+        at a time.
+
+        If `columns` is specified, the credits may include only those columns (e.g. to save bandwidth).
+        """
+
+    async def start(self) -> None:
+        r"""Starts any background work the store does"""
+
+    async def aclose(self) -> None:
+        r"""Stops any background work the store does, and releases any resources it holds"""
+
+
+class ProxyCreditStore(CreditStore):
+    r"""
+    A credit store backed by the Google Sheets document, which it accesses via the NMDC ORCID Creditor Proxy.
+    """
+
+    def __init__(
+        self,
+        http_client: httpx.AsyncClient,
+        proxy_url: str,
+        shared_secret: str,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        read_retry_policy: Optional[RetryPolicy] = None,
+        attempt_timeout_seconds: Optional[float] = None,
+        wire_format: WireFormat = "objects",
+        admission_controller: Optional[AdmissionController] = None,
+    ):
+        self.http_client = http_client
+        self.proxy_url = proxy_url
+        self.shared_secret = shared_secret
+        self.circuit_breaker = circuit_breaker
+        self.read_retry_policy = read_retry_policy
+        self.attempt_timeout_seconds = attempt_timeout_seconds
+        self.wire_format = wire_format
+        self.admission_controller = admission_controller
+
+    async def _attempt_request(self, method: str, params: dict, json: Optional[dict]) -> dict:
+        # Wait for our turn to send the request, if the number of concurrent requests to the proxy is limited.
+        #
+        # Note: Reads can be turned away when too many requests are waiting already (and retried by the client later).
+        #       Writes can't, since they record claims whose ORCID affiliations have already been created.
+        #
+        admission = nullcontext()
+        if self.admission_controller is not None:
+            admission = self.admission_controller.admit(may_reject=method == "GET")
+        async with admission:
+            return await self._send_request(method, params, json)
+
+    async def _send_request(self, method: str, params: dict, json: Optional[dict]) -> dict:
+        timeout = httpx.USE_CLIENT_DEFAULT
+        if self.attempt_timeout_seconds is not None:
+            timeout = get_attempt_timeout(self.attempt_timeout_seconds)
+        if self.wire_format != "objects":
+            params = {"format": self.wire_format, **params}
+        with track_upstream_request(f"proxy_{method.lower()}") as span, self.circuit_breaker or nullcontext():
+            # Propagate the trace (if any) to the proxy, which logs it along with the request.
+            #
+            # Note: We send the `traceparent` as a query parameter (rather than as a header), since Apps Script
+            #       doesn't expose request headers to web apps.
+            #
+            if span.traceparent is not None:
+                params = {**params, "traceparent": span.traceparent}
+                if "credit_type" in params:
+                    span.set_attribute("credit_type", params["credit_type"])
+            response = await self.http_client.request(
+                method,
+                self.proxy_url,
+                params={"shared_secret": self.shared_secret, **params},
+                json=json,
+                follow_redirects=True,
+                timeout=timeout,
+            )
+            span.set_attribute("http.status_code", response.status_code)
+            res_json = response.json()
+
+            # Note: This raises a `KeyError` if the proxy responded with an error message instead.
+            res_json["credits"] = decode_credits(res_json)
+        return res_json
+
+    async def _request(self, method: str, params: dict, json: Optional[dict] = None) -> dict:
+        r"""
+        Sends a request to the proxy and returns the JSON payload of its response.
+
+        GET requests (which are idempotent) are retried per the read retry policy, if any; as long as the current
+        request's deadline budget allows. POST requests are not retried, since the proxy may have processed them
+        even if we didn't receive its response.
+        """
+
+        max_attempts = 1
+        if method == "GET" and self.read_retry_policy is not None:
+            max_attempts = self.read_retry_policy.max_attempts
+        attempt = 1
+        while True:
+            try:
+                return await self._attempt_request(method, params, json)
+            except AdmissionRejectedError as error:
+                raise CreditStoreOverloadedError(str(error), error.retry_after_seconds) from error
+            except (httpx.HTTPError, ValueError, KeyError, UpstreamUnavailableError) as error:
+                # Note: A `ValueError` is raised when the response body is not valid JSON.
+                delay = self.read_retry_policy.get_delay(attempt) if attempt < max_attempts else 0.0
+                remaining_seconds = get_remaining_budget_seconds()
+                if (
+                    attempt >= max_attempts
+                    or isinstance(error, UpstreamUnavailableError)
+                    or (remaining_seconds is not None and delay >= remaining_seconds)  # no time left to retry
+                ):
+                    raise CreditStoreError(f"Proxy {method} request failed: {error!r}") from error
+                logger.warning("Proxy %s request failed (attempt %d); retrying in %.3fs", method, attempt, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def list_credits(self, orcid_id: str) -> list[dict]:
+        res_json = await self._request("GET", {"orcid_id": orcid_id})
+        return res_json["credits"]
+
+    async def export_credits(
+        self,
+        since_version: str = "",
+        offset: int = 0,
+        limit: Optional[int] = None,
+        columns: Optional[Sequence[str]] = None,
+    ) -> dict:
+        r"""
+        Returns all credits in the Google Sheets document, via the proxy's "export" action; as a dictionary
+        having a `version` (which changes whenever the sheet changes), an `unchanged` flag, and the `credits`.
+
+        If `since_version` is the sheet's current version, the proxy sets `unchanged` and omits the credits.
+
+        If `limit` is specified, the proxy returns (at most) that many credits, starting at `offset`; and the
+        dictionary's `next_offset` is the offset of the next page of credits (or `None`, if there are no more).
+
+        If `columns` is specified (and the store uses the columnar wire format), the credits include only those
+        columns.
+        """
+
+        params = {"action": "export", "since_version": since_version}
+        if limit is not None:
+            params.update(offset=str(offset), limit=str(limit))
+        if columns is not None and self.wire_format == "columnar":
+            params.update(columns=",".join(columns))
+        return await self._request("GET", params)
+
+    async def iter_credit_pages(
+        self, page_size: int, columns: Optional[Sequence[str]] = None
+    ) -> AsyncIterator[list[dict]]:
+        r"""
+        Yields all credits in the Google Sheets document, one page (of at most `page_size` credits) at a time; so
+        that callers can process the sheet as it arrives, without either side handling the whole sheet at once.
+
+        Note: If the sheet changes between pages, the pages may skip or repeat some rows; so we log a warning.
+        """
+
+        offset: Optional[int] = 0
+        version = None
+        while offset is not None:
+            page = await self.export_credits(offset=offset, limit=page_size, columns=columns)
+            if version is not None and page["version"] != version:
+                logger.warning("The sheet changed while its credits were being exported")
+            version = page["version"]
+            offset = page.get("next_offset")
+            yield page["credits"]
+
+    async def mark_claimed(
+        self,
+        orcid_id: str,
+        credit_type: str,
+        start_date: str,
+        end_date: str,
+        affiliation_put_code: str,
+    ) -> list[dict]:
+        params = {
+            "orcid_id": orcid_id,
+            "credit_type": credit_type,
+            "start_date": start_date,
+            "end_date": end_date,
+            "affiliation_put_code": affiliation_put_code,
+        }
+        res_json = await self._request("POST", params)
+        return res_json["credits"]
+
+    async def mark_claimed_batch(self, orcid_id: str, claims: list[dict]) -> list[dict]:
+        res_json = await self._request("POST", {"action": "claim_batch", "orcid_id": orcid_id}, json={"claims": claims})
+        return res_json["credits"]
+
+
+class CachingCreditStore(CreditStore):
+    r"""
+    A credit store that caches, per ORCID ID, the credits it reads from another credit store.
+
+    When a claim is recorded, the cached credits are replaced with the updated ones the other
+    store returns; so that reading them afterward does not involve the other store.
+
+    If reading credits from the other store fails, the store serves the credits it cached before
+    (even if they have expired), if any.
+    """
+
+    def __init__(self, store: CreditStore, cache: CreditsCache):
+        self.store = store
+        self.cache = cache
+
+    async def list_credits(self, orcid_id: str) -> list[dict]:
+        credits = self.cache.get(orcid_id)
+        if credits is None:
+            try:
+                credits = await self.store.list_credits(orcid_id)
+            except CreditStoreError as error:
+                # Serve the credits we cached before, if any, even though they may be out of date; rather than
+                # failing while the other store is unavailable.
+                credits = self.cache.get_stale(orcid_id)
+                if credits is None:
+                    raise
+                logger.warning("Serving stale credits of %s, since loading them failed: %s", orcid_id, error)
+                return credits
+            self.cache.set(orcid_id, credits)
+        return credits
+
+    async def mark_claimed(
+        self,
+        orcid_id: str,
+        credit_type: str,
+        start_date: str,
+        end_date: str,
+        affiliation_put_code: str,
+    ) -> list[dict]:
+        try:
+            credits = await self.store.mark_claimed(orcid_id, credit_type, start_date, end_date, affiliation_put_code)
+        except CreditStoreError:
+            self.cache.invalidate(orcid_id)  # the cached credits may no longer reflect the claim's status
+            raise
+        self.cache.set(orcid_id, credits)
+        return credits
+
+    async def mark_claimed_batch(self, orcid_id: str, claims: list[dict]) -> list[dict]:
+        try:
+            credits = await self.store.mark_claimed_batch(orcid_id, claims)
+        except CreditStoreError:
+            self.cache.invalidate(orcid_id)  # the cached credits may no longer reflect the claims' statuses
+            raise
+        self.cache.set(orcid_id, credits)
+        return credits
+
+    def iter_credit_pages(self, page_size: int, columns: Optional[Sequence[str]] = None) -> AsyncIterator[list[dict]]:
+        return self.store.iter_credit_pages(page_size, columns)
+
+    async def start(self) -> None:
+        await self.store.start()
+
+    async def aclose(self) -> None:
+        await self.store.aclose()
+
+
+# Mapping from the names of the columns of the SQLite table to those of the Google Sheets document.
+SQLITE_COLUMN_NAMES = {
+    "orcid_id": "column.ORCID_ID",
+    "credit_type": "column.CREDIT_TYPE",
+    "affiliation_type": "column.AFFILIATION_TYPE",
+    "start_date": "column.START_DATE",
+    "end_date": "column.END_DATE",
+    "details_url": "column.DETAILS_URL",
+    "claimed_at": "column.CLAIMED_AT",
+    "affiliation_put_code": "column.AFFILIATION_PUT_CODE",
+}
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS credits (
+    id                   INTEGER PRIMARY KEY,
+    orcid_id             TEXT NOT NULL,
+    credit_type          TEXT NOT NULL,
+    affiliation_type     TEXT NOT NULL DEFAULT '',
+    start_date           TEXT NOT NULL DEFAULT '',
+    end_date             TEXT NOT NULL DEFAULT '',
+    details_url          TEXT NOT NULL DEFAULT '',
+    claimed_at           TEXT,  -- NULL until the credit is claimed
+    affiliation_put_code TEXT
+);
+CREATE INDEX IF NOT EXISTS credits_by_orcid_id ON credits (orcid_id);
+CREATE INDEX IF NOT EXISTS credits_by_claim_key ON credits (orcid_id, credit_type, start_date, end_date);
+"""
+
+
+class SQLiteCreditStore(CreditStore):
+    r"""
+    A credit store backed by a local SQLite database, whose indexes let it look up an ORCID ID's credits (and find
+    a credit to claim) without scanning every row.
+
+    Note: SQLite calls are made on a worker thread so that they don't block the event loop.
+
+    >>> store = SQLiteCreditStore(":memory:")
+    >>> store.add_credits([{"column.ORCID_ID": "0000-0000-0000-0001", "column.CREDIT_TYPE": "Ambassador 2023"}])
+    >>> credits = asyncio.run(store.list_credits("0000-0000-0000-0001"))
+    >>> credits[0]["column.CREDIT_TYPE"], credits[0]["column.CLAIMED_AT"]
+    ('Ambassador 2023', '')
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.executescript(SQLITE_SCHEMA)
+
+    def add_credits(self, credits: Iterable[dict]) -> None:
+        r"""Inserts the specified credits (represented the way the proxy represents them) into the database"""
+
+        rows = [
+            {
+                name: credit.get(column_name) or (None if name in ("claimed_at", "affiliation_put_code") else "")
+                for name, column_name in SQLITE_COLUMN_NAMES.items()
+            }
+            for credit in credits
+        ]
+        placeholders = ", ".join(f":{name}" for name in SQLITE_COLUMN_NAMES)
+        with self._lock, self._connection:
+            self._connection.executemany(
+                f"INSERT INTO credits ({', '.join(SQLITE_COLUMN_NAMES)}) VALUES ({placeholders})",
+                rows,
+            )
+
+    def _list_credits(self, orcid_id: str) -> list[dict]:
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT {', '.join(SQLITE_COLUMN_NAMES)} FROM credits WHERE orcid_id = ? ORDER BY id",
+                (orcid_id,),
+            ).fetchall()
+
+        # Represent empty cells the way the proxy does (i.e. as empty strings).
+        return [Credit({SQLITE_COLUMN_NAMES[name]: row[name] or "" for name in row.keys()}) for row in rows]
+
+    def _list_credit_page(self, after_id: int, page_size: int) -> list[sqlite3.Row]:
+        with self._lock:
+            return self._connection.execute(
+                f"SELECT id, {', '.join(SQLITE_COLUMN_NAMES)} FROM credits WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, page_size),
+            ).fetchall()
+
+    def _find_unclaimed_credit(self, orcid_id, credit_type, start_date, end_date) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute(
+                f"""
+                SELECT {', '.join(SQLITE_COLUMN_NAMES)} FROM credits
+                WHERE orcid_id = ? AND credit_type = ? AND start_date = ? AND end_date = ? AND claimed_at IS NULL
+                ORDER BY id LIMIT 1
+                """,
+                (orcid_id, credit_type, start_date, end_date),
+            ).fetchone()
+        return None if row is None else Credit({SQLITE_COLUMN_NAMES[name]: row[name] or "" for name in row.keys()})
+
+    def _mark_claimed(self, orcid_id, credit_type, start_date, end_date, affiliation_put_code) -> None:
+        claimed_at = datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+        # Note: We claim the credit via a single `UPDATE` statement whose `WHERE` clause requires the credit to be
+        #       unclaimed, so that two concurrent claims cannot both claim the same credit. If it updates no rows,
+        #       either this claim has already been recorded, or there was no unclaimed credit to claim (e.g. another
+        #       claim got to it first).
+        with self._lock, self._connection:
+            claim_key = dict(orcid_id=orcid_id, credit_type=credit_type, start_date=start_date, end_date=end_date)
+            already_claimed = self._connection.execute(
+                """
+                SELECT 1 FROM credits
+                WHERE orcid_id = :orcid_id AND credit_type = :credit_type
+                  AND start_date = :start_date AND end_date = :end_date
+                  AND claimed_at IS NOT NULL AND affiliation_put_code = :affiliation_put_code
+                LIMIT 1
+                """,
+                dict(affiliation_put_code=affiliation_put_code, **claim_key),
+            ).fetchone()
+            if already_claimed is not None:
+                return
+            cursor = self._connection.execute(
+                """
+                UPDATE credits SET claimed_at = :claimed_at, affiliation_put_code = :affiliation_put_code
+                WHERE claimed_at IS NULL AND id = (
+                    SELECT id FROM credits
+                    WHERE orcid_id = :orcid_id AND credit_type = :credit_type
+                      AND start_date = :start_date AND end_date = :end_date
+                      AND claimed_at IS NULL
+                    ORDER BY id LIMIT 1
+                )
+                """,
+                dict(claimed_at=claimed_at, affiliation_put_code=affiliation_put_code, **claim_key),
+            )
+        if cursor.rowcount == 0:
+            raise CreditStoreError(f"No unclaimed {credit_type!r} credit from {start_date!r} to {end_date!r}")
+
+    async def list_credits(self, orcid_id: str) -> list[dict]:
+        try:
+            return await asyncio.to_thread(self._list_credits, orcid_id)
+        except sqlite3.Error as error:
+            raise CreditStoreError(f"SQLite query failed: {error!r}") from error
+
+    async def find_unclaimed_credit(
+        self,
+        orcid_id: str,
+        credit_type: str,
+        start_date: str,
+        end_date: str,
+    ) -> Optional[dict]:
+        try:
+            args = (orcid_id, credit_type, start_date, end_date)
+            return await asyncio.to_thread(self._find_unclaimed_credit, *args)
+        except sqlite3.Error as error:
+            raise CreditStoreError(f"SQLite query failed: {error!r}") from error
+
+    async def mark_claimed(
+        self,
+        orcid_id: str,
+        credit_type: str,
+        start_date: str,
+        end_date: str,
+        affiliation_put_code: str,
+    ) -> list[dict]:
+        try:
+            args = (orcid_id, credit_type, start_date, end_date, affiliation_put_code)
+            await asyncio.to_thread(self._mark_claimed, *args)
+            return await asyncio.to_thread(self._list_credits, orcid_id)
+        except sqlite3.Error as error:
+            raise CreditStoreError(f"SQLite query failed: {error!r}") from error
+
+    async def iter_credit_pages(
+        self, page_size: int, columns: Optional[Sequence[str]] = None
+    ) -> AsyncIterator[list[dict]]:
+        # Note: We page through the table by ID (rather than via `OFFSET`), so that each page is a single index seek.
+        after_id = 0
+        while True:
+            try:
+                rows = await asyncio.to_thread(self._list_credit_page, after_id, page_size)
+            except sqlite3.Error as error:
+                raise CreditStoreError(f"SQLite query failed: {error!r}") from error
+            if len(rows) == 0:
+                return
+            after_id = rows[-1]["id"]
+            yield [Credit({SQLITE_COLUMN_NAMES[name]: row[name] or "" for name in SQLITE_COLUMN_NAMES}) for row in rows]
+
+    async def aclose(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class CreditIndex:
+    r"""
+    An in-memory index of credits, keyed by ORCID ID and by claim key (see `make_claim_key`).
+
+    Note: An index is never modified once built. Instead, a modified copy of it is made and swapped in.
+
+    >>> index = CreditIndex([{"column.ORCID_ID": "0000-0000-0000-0001", "column.CLAIMED_AT": ""}], version="v1")
+    >>> len(index.by_orcid_id["0000-0000-0000-0001"]), len(index.by_claim_key)
+    (1, 1)
+    >>> index = index.with_credits_of("0000-0000-0000-0001", [])
+    >>> index.by_orcid_id["0000-0000-0000-0001"], len(index.by_claim_key), index.version
+    ([], 0, 'v1')
+    """
+
+    __slots__ = ("version", "by_orcid_id", "by_claim_key")
+
+    def __init__(self, credits: Iterable[dict], version: str = ""):
+        self.version = version
+        self.by_orcid_id: dict[str, list[dict]] = {}
+        self.by_claim_key: dict[tuple, list[dict]] = {}
+        for credit in credits:
+            self._add(credit)
+
+    def _add(self, credit: dict) -> None:
+        self.by_orcid_id.setdefault(credit.get("column.ORCID_ID", ""), []).append(credit)
+        self.by_claim_key.setdefault(make_claim_key(credit), []).append(credit)
+
+    def with_credits_of(self, orcid_id: str, credits: list[dict]) -> "CreditIndex":
+        r"""Returns a copy of this index, in which the specified ORCID ID's credits are the specified ones"""
+
+        index = CreditIndex([], version=self.version)
+        index.by_orcid_id = dict(self.by_orcid_id)
+        index.by_claim_key = dict(self.by_claim_key)
+        for credit in index.by_orcid_id.pop(orcid_id, []):
+            index.by_claim_key.pop(make_claim_key(credit), None)
+        index.by_orcid_id[orcid_id] = []
+        for credit in credits:
+            index._add(credit)
+        return index
+
+
+class SnapshotCreditStore(CreditStore):
+    r"""
+    A credit store that periodically downloads the whole Google Sheets document (in a single request to the proxy)
+    and serves reads from an in-memory index of it; so that reads don't involve the proxy at all.
+
+    Claims are written through to the proxy; and the credits the proxy returns are applied to the index right away.
+
+    Note: Until the first download finishes, reads are passed through to the proxy.
+    """
+
+    def __init__(self, proxy_store: ProxyCreditStore, refresh_interval_seconds: float):
+        self.proxy_store = proxy_store
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self.index: Optional[CreditIndex] = None
+        self._credits_claimed_during_refresh: Optional[dict[str, list[dict]]] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> bool:
+        r"""
+        Downloads the Google Sheets document (unless it hasn't changed since the last download) and swaps in
+        a new index of it. Returns `True` if the index was replaced, or `False` if the sheet had not changed.
+        """
+
+        # Keep track of claims made while the download is in progress, since the download may not reflect them.
+        self._credits_claimed_during_refresh = {}
+        try:
+            since_version = "" if self.index is None else self.index.version
+            snapshot = await self.proxy_store.export_credits(since_version=since_version)
+            if snapshot.get("unchanged", False):
+                return False
+            index = CreditIndex(snapshot["credits"], version=snapshot.get("version", ""))
+            for orcid_id, credits in self._credits_claimed_during_refresh.items():
+                index = index.with_credits_of(orcid_id, credits)
+        finally:
+            self._credits_claimed_during_refresh = None
+
+        self.index = index
+        logger.info(
+            "Loaded snapshot of %d credits (version: %s)", sum(map(len, index.by_orcid_id.values())), index.version
+        )
+        return True
+
+    async def _refresh_periodically(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except CreditStoreError as error:
+                logger.exception(error)
+            await asyncio.sleep(self.refresh_interval_seconds)
+
+    async def start(self) -> None:
+        self._refresh_task = asyncio.create_task(self._refresh_periodically())
+
+    async def aclose(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+
+    async def list_credits(self, orcid_id: str) -> list[dict]:
+        index = self.index
+        if index is None:
+            return await self.proxy_store.list_credits(orcid_id)
+        return list(index.by_orcid_id.get(orcid_id, []))
+
+    async def find_unclaimed_credit(
+        self,
+        orcid_id: str,
+        credit_type: str,
+        start_date: str,
+        end_date: str,
+    ) -> Optional[dict]:
+        index = self.index
+        if index is None:
+            return await super().find_unclaimed_credit(orcid_id, credit_type, start_date, end_date)
+        for credit in index.by_claim_key.get((orcid_id, credit_type, start_date, end_date), []):
+            if credit.get("column.CLAIMED_AT") == "":
+                return credit
+        return None
+
+    async def mark_claimed(
+        self,
+        orcid_id: str,
+        credit_type: str,
+        start_date: str,
+        end_date: str,
+        affiliation_put_code: str,
+    ) -> list[dict]:
+        credits = await self.proxy_store.mark_claimed(orcid_id, credit_type, start_date, end_date, affiliation_put_code)
+        self._apply_claimed_credits(orcid_id, credits)
+        return credits
+
+    async def mark_claimed_batch(self, orcid_id: str, claims: list[dict]) -> list[dict]:
+        credits = await self.proxy_store.mark_claimed_batch(orcid_id, claims)
+        self._apply_claimed_credits(orcid_id, credits)
+        return credits
+
+    async def iter_credit_pages(
+        self, page_size: int, columns: Optional[Sequence[str]] = None
+    ) -> AsyncIterator[list[dict]]:
+        index = self.index
+        if index is None:
+            async for credits in self.proxy_store.iter_credit_pages(page_size, columns):
+                yield credits
+            return
+        credits = [credit for credits_of_orcid_id in index.by_orcid_id.values() for credit in credits_of_orcid_id]
+        for offset in range(0, len(credits), page_size):
+            yield credits[offset : offset + page_size]
+
+    def _apply_claimed_credits(self, orcid_id: str, credits: list[dict]) -> None:
+        if self.index is not None:
+            self.index = self.index.with_credits_of(orcid_id, credits)
+        if self._credits_claimed_during_refresh is not None:
+            self._credits_claimed_during_refresh[orcid_id] = credits
+
+
+def create_credit_store(
+    config: Config,
+    http_client: httpx.AsyncClient,
+    credits_cache: CreditsCache,
+    proxy_circuit_breaker: Optional[CircuitBreaker] = None,
+    proxy_admission_controller: Optional[AdmissionController] = None,
+) -> CreditStore:
+    r"""Creates the credit store designated by the specified configuration"""
+
+    if config.CREDIT_STORE_BACKEND == "sqlite":
+        return SQLiteCreditStore(config.CREDIT_STORE_SQLITE_PATH)
+
+    proxy_store = ProxyCreditStore(
+        http_client,
+        proxy_url=config.NMDC_ORCID_CREDITOR_PROXY_URL,
+        shared_secret=config.NMDC_ORCID_CREDITOR_PROXY_SHARED_SECRET,
+        circuit_breaker=proxy_circuit_breaker,
+        read_retry_policy=RetryPolicy(
+            max_attempts=config.PROXY_READ_RETRY_MAX_ATTEMPTS,
+            base_delay_seconds=config.PROXY_READ_RETRY_BASE_DELAY_SECONDS,
+            max_delay_seconds=config.PROXY_READ_RETRY_MAX_DELAY_SECONDS,
+        ),
+        attempt_timeout_seconds=config.PROXY_ATTEMPT_TIMEOUT_SECONDS,
+        wire_format=config.PROXY_WIRE_FORMAT,
+        admission_controller=proxy_admission_controller,
+    )
+    if config.CREDIT_STORE_BACKEND == "snapshot":
+        return SnapshotCreditStore(
+            proxy_store, refresh_interval_seconds=config.CREDIT_SNAPSHOT_REFRESH_INTERVAL_SECONDS
+        )
+    return CachingCreditStore(proxy_store, credits_cache)
@@ -0,0 +1,100 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    r"""
+    An in-memory cache whose entries expire after a fixed amount of time.
+
+    Entries expire `ttl_seconds` after they were stored. Once the cache contains `max_entries` entries,
+    storing another one evicts the least recently used entry. The cache keeps count of hits, misses,
+    and evictions, so that its TTL and size can be tuned based upon real-world usage.
+
+    Expired entries are kept until they are evicted or replaced, so that `get_stale` can return them
+    (e.g. when the source of the values is unavailable).
+
+    Note: The cache is not thread-safe. It is meant to be used from within the event loop only.
+
+    >>> now = 0.0
+    >>> cache = TTLCache(ttl_seconds=10, max_entries=2, clock=lambda: now)
+    >>> cache.get("0000-0000-0000-0001") is None  # miss
+    True
+    >>> cache.set("0000-0000-0000-0001", [{"column.CREDIT_TYPE": "Ambassador 2023"}])
+    >>> cache.get("0000-0000-0000-0001")  # hit
+    [{'column.CREDIT_TYPE': 'Ambassador 2023'}]
+
+    Storing a third entry evicts the least recently used one:
+    >>> cache.set("0000-0000-0000-0002", [])
+    >>> _ = cache.get("0000-0000-0000-0001")  # marks 0001 as more recently used than 0002
+    >>> cache.set("0000-0000-0000-0003", [])
+    >>> cache.get("0000-0000-0000-0002") is None
+    True
+
+    Entries expire once their TTL has elapsed:
+    >>> now = 10.0
+    >>> cache.get("0000-0000-0000-0001") is None
+    True
+    >>> cache.get_stale("0000-0000-0000-0001")
+    [{'column.CREDIT_TYPE': 'Ambassador 2023'}]
+    >>> cache.stats()
+    {'hits': 2, 'misses': 3, 'evictions': 1, 'entries': 2}
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int, clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()  # key -> (expires at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        r"""Returns the cached value for the specified key, or `None` if there is none or it has expired"""
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def get_stale(self, key: Hashable) -> Optional[Any]:
+        r"""Returns the cached value for the specified key even if it has expired, or `None` if there is none"""
+
+        entry = self._entries.get(key)
+        return None if entry is None else entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        r"""Stores the specified value for the specified key, evicting the least recently used entry if full"""
+
+        if self.ttl_seconds <= 0 or self.max_entries <= 0:
+            return  # caching is disabled
+        self._entries[key] = (self._clock() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        r"""Removes the cached value, if any, for the specified key"""
+
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        r"""Removes all entries from the cache (without resetting its counters)"""
+
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        r"""Returns the cache's counters and its current number of entries"""
+
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self._entries)}
+
+
+class CreditsCache(TTLCache):
+    r"""An in-memory cache of credit lists, keyed by ORCID ID"""
@@ -0,0 +1,34 @@
+import httpx
+
+from nmdc_orcid_creditor.config import Config
+
+
+def create_http_client(config: Config) -> httpx.AsyncClient:
+    r"""
+    Creates the HTTP client the app uses to send requests to upstream services (i.e. the NMDC ORCID Creditor
+    Proxy and the ORCID API). The client keeps connections alive between requests, so that it can reuse them
+    instead of performing a new TCP (and TLS) handshake for every request.
+
+    Note: The client is meant to be shared across all requests the app handles; and to be closed (via its
+          `aclose` method) when the app shuts down.
+
+    Reference: https://www.python-httpx.org/async/#opening-and-closing-clients
+
+    >>> client = create_http_client(Config(HTTP_CLIENT_MAX_CONNECTIONS=10, HTTP_CLIENT_READ_TIMEOUT_SECONDS=12.5))
+    >>> client.timeout.read
+    12.5
+    >>> client.timeout.connect
+    5.0
+    """
+
+    limits = httpx.Limits(
+        max_connections=config.HTTP_CLIENT_MAX_CONNECTIONS,
+        max_keepalive_connections=config.HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.HTTP_CLIENT_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    timeout = httpx.Timeout(
+        config.HTTP_CLIENT_READ_TIMEOUT_SECONDS,  # applies to reading and writing
+        connect=config.HTTP_CLIENT_CONNECT_TIMEOUT_SECONDS,
+        pool=config.HTTP_CLIENT_POOL_TIMEOUT_SECONDS,
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=config.HTTP_CLIENT_HTTP2_ENABLED)
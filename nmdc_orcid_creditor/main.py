@@ -1,24 +1,68 @@
+import asyncio
+import hmac
+import json
 import logging
-from datetime import datetime
-from typing import Annotated, Union
+import math
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime, timezone
+from typing import Annotated, Awaitable, Callable, Literal, Optional, Union
 
-from fastapi import FastAPI, Request, Depends, HTTPException, status, Body
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request, Response, Depends, HTTPException, status, Body, Header, Query
 from fastapi.templating import Jinja2Templates
-from starlette.responses import HTMLResponse, RedirectResponse
-from starlette.middleware.sessions import SessionMiddleware
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from authlib.integrations.starlette_client import OAuth, OAuthError
+from pydantic import BaseModel, Field
 import httpx
 
+from nmdc_orcid_creditor.claim_outbox import ClaimOutbox, OutboxCreditStore
+from nmdc_orcid_creditor.claim_progress import ClaimProgress, ClaimProgressTracker
+from nmdc_orcid_creditor.compression import CompressionMiddleware
 from nmdc_orcid_creditor.config import cfg
+from nmdc_orcid_creditor.credit_model import Credit
+from nmdc_orcid_creditor.credit_stats import CreditStats
+from nmdc_orcid_creditor.credit_store import (
+    CreditStore,
+    CreditStoreError,
+    CreditStoreOverloadedError,
+    create_credit_store,
+)
+from nmdc_orcid_creditor.credits_cache import CreditsCache, TTLCache
 from nmdc_orcid_creditor.helpers import (
     extract_put_code_from_location_header,
-    extract_year_month_day_from_datetime_string,
+    if_none_match_matches,
+    make_etag,
+)
+from nmdc_orcid_creditor.http_client import create_http_client
+from nmdc_orcid_creditor.metrics import (
+    MetricsMiddleware,
+    record_claim_outcome,
+    record_rate_limited_request,
+    record_token_refresh_outcome,
+    record_upstream_error,
+    registry as metrics_registry,
+    track_upstream_request,
+)
+from nmdc_orcid_creditor.resilience import (
+    AdmissionController,
+    CircuitBreaker,
+    KeyedRateLimiter,
+    RequestDeadlineMiddleware,
+    UpstreamUnavailableError,
+    get_attempt_timeout,
+)
+from nmdc_orcid_creditor.session_store import ServerSideSessionMiddleware, create_session_store
+from nmdc_orcid_creditor.single_flight import SingleFlight
+from nmdc_orcid_creditor.static_files import FingerprintedStaticFiles, make_url_for
+from nmdc_orcid_creditor.structured_logging import create_background_logging
+from nmdc_orcid_creditor.tracing import (
+    RingBufferExporter,
+    TracingMiddleware,
+    create_tracer,
+    get_current_span,
+    hash_orcid_id,
 )
 
-# Enable debug output on the console.
 logger = logging.getLogger("uvicorn")
-logger.setLevel(logging.DEBUG)
 
 # Register ORCID as a remote application that uses OAuth 2.0.
 #
@@ -42,25 +86,223 @@ oauth.register(
     client_kwargs=dict(scope=cfg.ORCID_OAUTH_SCOPES),
 )
 
-app = FastAPI()
 
-# Add session middleware so the OAuth library can store data in a cookie(s)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    r"""
+    Creates resources that are shared across requests when the app starts up,
+    and releases them when the app shuts down.
+
+    Reference: https://fastapi.tiangolo.com/advanced/events/#lifespan
+    """
+
+    # Note: We configure logging here, rather than when this module is imported, since uvicorn (re)configures the
+    #       loggers it uses when it starts; which, depending upon how the app is run, may be after the import.
+    app.state.background_logging = create_background_logging(cfg)
+    app.state.background_logging.start()
+    app.state.session_store = create_session_store(cfg)
+    await app.state.session_store.start()
+    app.state.http_client = create_http_client(cfg)
+    app.state.credits_cache = CreditsCache(
+        ttl_seconds=cfg.CREDITS_CACHE_TTL_SECONDS,
+        max_entries=cfg.CREDITS_CACHE_MAX_ENTRIES,
+    )
+    app.state.proxy_circuit_breaker = CircuitBreaker(
+        "proxy",
+        failure_threshold=cfg.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout_seconds=cfg.CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS,
+    )
+    app.state.orcid_circuit_breaker = CircuitBreaker(
+        "orcid",
+        failure_threshold=cfg.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout_seconds=cfg.CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS,
+    )
+    app.state.proxy_admission_controller = AdmissionController(
+        "proxy", max_concurrency=cfg.PROXY_MAX_CONCURRENCY, max_queue_length=cfg.PROXY_MAX_QUEUE_LENGTH
+    )
+    app.state.credit_store = create_credit_store(
+        cfg,
+        app.state.http_client,
+        app.state.credits_cache,
+        app.state.proxy_circuit_breaker,
+        app.state.proxy_admission_controller,
+    )
+    if cfg.CLAIM_OUTBOX_ENABLED and cfg.CREDIT_STORE_BACKEND != "sqlite":
+        app.state.credit_store = OutboxCreditStore(
+            app.state.credit_store,
+            ClaimOutbox(cfg.CLAIM_OUTBOX_PATH),
+            retry_base_delay_seconds=cfg.CLAIM_OUTBOX_RETRY_BASE_DELAY_SECONDS,
+            retry_max_delay_seconds=cfg.CLAIM_OUTBOX_RETRY_MAX_DELAY_SECONDS,
+            max_attempts=cfg.CLAIM_OUTBOX_MAX_ATTEMPTS,
+        )
+    await app.state.credit_store.start()
+    app.state.credit_stats = CreditStats(
+        app.state.credit_store,
+        reseed_interval_seconds=cfg.CREDIT_STATS_RESEED_INTERVAL_SECONDS,
+        page_size=cfg.CREDIT_STATS_SEED_PAGE_SIZE,
+    )
+    await app.state.credit_stats.start()
+    app.state.single_flight = SingleFlight()
+    app.state.refreshed_orcid_access_tokens = TTLCache(
+        ttl_seconds=cfg.ORCID_ACCESS_TOKEN_REFRESH_MARGIN_SECONDS, max_entries=10000
+    )
+    app.state.idempotency_results = TTLCache(
+        ttl_seconds=cfg.IDEMPOTENCY_KEY_TTL_SECONDS,
+        max_entries=cfg.IDEMPOTENCY_KEY_MAX_ENTRIES,
+    )
+    app.state.session_rate_limiter = KeyedRateLimiter(
+        rate_per_second=cfg.RATE_LIMIT_PER_SESSION_PER_SECOND, burst=cfg.RATE_LIMIT_PER_SESSION_BURST
+    )
+    app.state.orcid_id_rate_limiter = KeyedRateLimiter(
+        rate_per_second=cfg.RATE_LIMIT_PER_ORCID_ID_PER_SECOND, burst=cfg.RATE_LIMIT_PER_ORCID_ID_BURST
+    )
+    app.state.claim_progress_tracker = ClaimProgressTracker(
+        ttl_seconds=cfg.CLAIM_PROGRESS_TTL_SECONDS, max_entries=cfg.CLAIM_PROGRESS_MAX_ENTRIES
+    )
+    yield
+    await app.state.claim_progress_tracker.aclose()
+    await app.state.credit_stats.aclose()
+    await app.state.credit_store.aclose()
+    await app.state.http_client.aclose()
+    await app.state.session_store.aclose()
+    app.state.background_logging.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Add session middleware so the OAuth library can store data in the session
 # when performing the `oauth.orcid.authorize_redirect(...)` step.
 #
 # Note: I assume (not sure) the value it stores there is the `state`
 #       query param value in the URL of the ORCID login page.
 #
+# Note: The session's contents are stored on the server (in the app's session store);
+#       the session cookie only contains the session's (signed) ID.
+#
 # Reference: https://www.starlette.io/middleware/#sessionmiddleware
 #
-app.add_middleware(SessionMiddleware, secret_key=cfg.SERVER_SESSION_SECRET_KEY)
+app.add_middleware(
+    ServerSideSessionMiddleware,
+    secret_key=cfg.SERVER_SESSION_SECRET_KEY,
+    max_age=cfg.SESSION_MAX_AGE_SECONDS,
+)
+
+# Compress responses (e.g. HTML pages and JSON payloads) that are large enough for compression to pay off.
+#
+# Note: The static files are compressed ahead of time (see `FingerprintedStaticFiles`), so this skips them.
+#
+app.add_middleware(CompressionMiddleware, minimum_size=cfg.RESPONSE_COMPRESSION_MINIMUM_SIZE_BYTES)
+
+# Give each request an overall deadline budget, which bounds the time the app spends waiting for upstream services.
+app.add_middleware(RequestDeadlineMiddleware, budget_seconds=cfg.REQUEST_DEADLINE_SECONDS)
+
+# Trace the requests of the login and claim flows, recording how long each upstream request they make takes.
+#
+# Note: The spans are kept in memory (see the `/api/traces` endpoint) or written to a file, per the configuration.
+#
+tracer = create_tracer(cfg)
+app.add_middleware(
+    TracingMiddleware,
+    tracer=tracer,
+    paths=("/exchange-code-for-token", "/credits", "/api/credits", "/api/credits/claim", "/api/credits/claim-batch"),
+)
+
+# Add middleware that records the number and latency of the requests the app handles (see the `/metrics` endpoint).
+#
+# Note: We add it last, so that it wraps the other middleware, whose work is included in the latencies it records.
+#
+app.add_middleware(MetricsMiddleware)
 
 # Designate a directory that will store static files, such as the favicon.
+#
+# Note: Each file is also served at a "fingerprinted" path (e.g. "/static/favicon.ab5df625bc.png"), which changes
+#       whenever the file does; so browsers can cache responses to requests for those paths indefinitely.
+#
 # Reference: https://fastapi.tiangolo.com/tutorial/static-files/
-app.mount("/static", StaticFiles(directory="static"), name="static")
+static_files = FingerprintedStaticFiles(directory="static")
+app.mount("/static", static_files, name="static")
 
 # Designate a directory that will store template files.
+#
+# Note: We make the templates' `url_for("static", path=...)` calls generate fingerprinted URLs.
+#
 # Reference: https://fastapi.tiangolo.com/advanced/templates/#using-jinja2templates
 templates = Jinja2Templates(directory="nmdc_orcid_creditor/templates")
+templates.env.globals["url_for"] = make_url_for(static_files)
+
+
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    r"""Returns the HTTP client the app uses to send requests to upstream services"""
+
+    return request.app.state.http_client
+
+
+def get_credit_store(request: Request) -> CreditStore:
+    r"""Returns the credit store the app reads credits from and records claims to"""
+
+    return request.app.state.credit_store
+
+
+def get_credits_cache(request: Request) -> CreditsCache:
+    r"""Returns the cache of each ORCID ID's credits"""
+
+    return request.app.state.credits_cache
+
+
+def get_orcid_circuit_breaker(request: Request) -> CircuitBreaker:
+    r"""Returns the circuit breaker that guards the requests the app sends to the ORCID API"""
+
+    return request.app.state.orcid_circuit_breaker
+
+
+def get_single_flight(request: Request) -> SingleFlight:
+    r"""Returns the object the app uses to coalesce concurrent, identical operations into one"""
+
+    return request.app.state.single_flight
+
+
+def get_idempotency_results(request: Request) -> TTLCache:
+    r"""Returns the cache of API responses, keyed by (ORCID ID, idempotency key)"""
+
+    return request.app.state.idempotency_results
+
+
+def get_refreshed_orcid_access_tokens(request: Request) -> TTLCache:
+    r"""Returns the cache of recently refreshed ORCID access tokens, keyed by the refresh tokens they replaced"""
+
+    return request.app.state.refreshed_orcid_access_tokens
+
+
+def get_claim_progress_tracker(request: Request) -> ClaimProgressTracker:
+    r"""Returns the tracker of the claims the app is making in the background, which was created at startup"""
+
+    return request.app.state.claim_progress_tracker
+
+
+def get_credit_stats(request: Request) -> CreditStats:
+    r"""Returns the incrementally maintained statistics about the credits in the credit store"""
+
+    return request.app.state.credit_stats
+
+
+def verify_admin_api_key(
+    authorization: Annotated[Optional[str], Header(description="`Bearer {ADMIN_API_KEY}`")] = None,
+) -> None:
+    r"""
+    Raises an `HTTPException` unless the request's `Authorization` header contains the admin API key.
+
+    Note: We compare the values in constant time, so that response times don't reveal how much of the key is right.
+    """
+
+    if cfg.ADMIN_API_KEY == "":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="The admin API is disabled")
+    expected_authorization = f"Bearer {cfg.ADMIN_API_KEY}"
+    if authorization is None or not hmac.compare_digest(authorization.encode(), expected_authorization.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid admin API key",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
 
 
 @app.get("/", response_class=HTMLResponse, include_in_schema=False)
@@ -79,11 +321,16 @@ async def get_redirect_to_orcid_login_page(request: Request):
 
 
 @app.get("/exchange-code-for-token", include_in_schema=False)
-async def get_exchange_code_for_token(request: Request):
+async def get_exchange_code_for_token(
+    request: Request,
+    credit_store: CreditStore = Depends(get_credit_store),
+    single_flight: SingleFlight = Depends(get_single_flight),
+):
     r"""Exchanges an ORCID authorization code for an ORCID access token"""
 
     try:
-        orcid_access_token: dict = await oauth.orcid.authorize_access_token(request)
+        with track_upstream_request("orcid_token_exchange"):
+            orcid_access_token: dict = await oauth.orcid.authorize_access_token(request)
     except (OAuthError, httpx.HTTPStatusError) as error:
         # Note: An `httpx.HTTPStatusError` is raised when the response status code is 4xx or 5xx.
         #       Reference: https://www.python-httpx.org/exceptions/#exception-classes
@@ -91,14 +338,19 @@ async def get_exchange_code_for_token(request: Request):
         return templates.TemplateResponse(
             request=request, name="error.html.jinja", context={"error_message": "Failed to log in to ORCID."}
         )
+    get_current_span().set_attribute("orcid_id_hash", hash_orcid_id(orcid_access_token["orcid"]))
 
     # Store the token in the session, overwriting any previous token.
     #
-    # Note: The session is persisted as a signed cookie on the client side. Because it is signed by the server,
-    #       the client cannot modify it; although the client can decode and read its contents.
+    # Note: The session is persisted in the server's session store. The client only receives a cookie containing
+    #       the session's ID, which is signed by the server; so the client can neither read nor modify the session.
     #
     request.session["orcid_access_token"] = orcid_access_token
 
+    # Start fetching the user's credits in the background, so that the fetch overlaps the redirect (and the "Credits"
+    # page, which embeds the credits, can be rendered sooner).
+    start_listing_credits(orcid_access_token["orcid"], credit_store, single_flight)
+
     # Now, redirect the client to the "Credits" page.
     return RedirectResponse(url=request.url_for("get_credits"))
 
@@ -108,8 +360,8 @@ def validate_orcid_access_token(orcid_access_token: dict) -> Union[dict, None]:
     Validates the ORCID access token, returning it if valid or `None` if invalid
 
     Note: This function does _not_ validate that the ORCID access token has not
-          been tampered with since we stored it in the session. That validation
-          is handled by the `SessionMiddleware`.
+          been tampered with since we stored it in the session. The session is
+          stored on the server, so the client cannot tamper with it.
     """
 
     # Check whether the token expires in the future (not the past or present).
@@ -121,10 +373,165 @@ def validate_orcid_access_token(orcid_access_token: dict) -> Union[dict, None]:
     return None
 
 
-def get_orcid_access_token(request: Request) -> Union[dict, None]:
-    r"""Returns the ORCID access token, if valid, present in the session; otherwise return `None`"""
+def should_refresh_orcid_access_token(orcid_access_token: dict, margin_seconds: float, now: float) -> bool:
+    r"""
+    Returns `True` if the ORCID access token can be refreshed (i.e. it came with a refresh token) and it expires
+    within the specified number of seconds from the specified time (or has expired already).
+
+    Note: For tokens whose lifetime is shorter than twice the margin, we use half the lifetime as the margin instead;
+          so that a freshly refreshed token isn't due to be refreshed again right away.
+
+    >>> token = dict(access_token="...", refresh_token="...", expires_at=1000, expires_in=1000)
+    >>> should_refresh_orcid_access_token(token, margin_seconds=100, now=850)
+    False
+    >>> should_refresh_orcid_access_token(token, margin_seconds=100, now=900)
+    True
+    >>> should_refresh_orcid_access_token(token, margin_seconds=3600, now=400)
+    False
+    >>> should_refresh_orcid_access_token(dict(access_token="...", expires_at=1000), margin_seconds=100, now=2000)
+    False
+    """
+
+    if not orcid_access_token.get("refresh_token") or "expires_at" not in orcid_access_token:
+        return False
+    margin_seconds = min(margin_seconds, orcid_access_token.get("expires_in", margin_seconds * 2) / 2)
+    return orcid_access_token["expires_at"] - now <= margin_seconds
+
+
+async def refresh_orcid_access_token(
+    orcid_access_token: dict,
+    http_client: httpx.AsyncClient,
+    refreshed_orcid_access_tokens: TTLCache,
+) -> Optional[dict]:
+    r"""
+    Gets a new ORCID access token in exchange for the refresh token that came with the specified one. Returns the new
+    token (which it also caches, keyed by the old refresh token), or `None` if it fails to get one.
+
+    Reference: https://datatracker.ietf.org/doc/html/rfc6749#section-6
+    """
+
+    refresh_token = orcid_access_token["refresh_token"]
+    try:
+        with track_upstream_request("orcid_token_refresh"):
+            response = await http_client.post(
+                cfg.ORCID_ACCESS_TOKEN_URL,
+                timeout=get_attempt_timeout(cfg.ORCID_ATTEMPT_TIMEOUT_SECONDS),
+                headers={"Accept": "application/json"},
+                data={
+                    "client_id": cfg.ORCID_CLIENT_ID,
+                    "client_secret": cfg.ORCID_CLIENT_SECRET,
+                    "grant_type": "refresh_token",
+                    "refresh_token": refresh_token,
+                },
+            )
+            if response.status_code >= 500:
+                response.raise_for_status()
+    except (httpx.HTTPError, UpstreamUnavailableError) as error:
+        # Note: An `UpstreamUnavailableError` is raised when the request's deadline leaves no time for the attempt.
+        logger.warning("Failed to refresh ORCID access token: %r", error)
+        record_token_refresh_outcome("failed")
+        return None
+
+    # If ORCID rejected the refresh token (e.g. because the user revoked the app's access), the user will have to log
+    # in again once the access token expires.
+    if response.status_code != 200:
+        logger.warning(
+            "ORCID rejected refresh token: status_code=%d content=%r", response.status_code, response.content
+        )
+        record_token_refresh_outcome("rejected")
+        return None
+
+    # Note: We keep the fields ORCID doesn't repeat in its response (if any), such as the user's name.
+    try:
+        token_fields = response.json()
+        refreshed_orcid_access_token = {
+            **orcid_access_token,
+            **token_fields,
+            "expires_at": int(datetime.now().timestamp() + token_fields["expires_in"]),
+        }
+    except (ValueError, KeyError, TypeError) as error:
+        # Note: A `ValueError` is raised when the response body is not valid JSON.
+        logger.warning("Failed to refresh ORCID access token: invalid response: %r", error)
+        record_token_refresh_outcome("failed")
+        return None
+    refreshed_orcid_access_tokens.set(refresh_token, refreshed_orcid_access_token)
+    record_token_refresh_outcome("refreshed")
+    return refreshed_orcid_access_token
+
+
+async def get_orcid_access_token(
+    request: Request,
+    http_client: httpx.AsyncClient = Depends(get_http_client),
+    single_flight: SingleFlight = Depends(get_single_flight),
+    refreshed_orcid_access_tokens: TTLCache = Depends(get_refreshed_orcid_access_tokens),
+) -> Union[dict, None]:
+    r"""
+    Returns the ORCID access token, if valid, present in the session; otherwise return `None`.
+
+    If the token is about to expire, this starts refreshing it in the background, and the session's next request will
+    get the new token. If the token has expired already, this refreshes it first (instead of the user having to log
+    in again). Concurrent requests refreshing the same token share a single request to ORCID.
+    """
+
+    orcid_access_token = request.session.get("orcid_access_token", {})
+    now = datetime.now().timestamp()
+    if should_refresh_orcid_access_token(orcid_access_token, cfg.ORCID_ACCESS_TOKEN_REFRESH_MARGIN_SECONDS, now):
+        refresh_token = orcid_access_token["refresh_token"]
+        refreshed_orcid_access_token = refreshed_orcid_access_tokens.get(refresh_token)
+        if refreshed_orcid_access_token is None:
+            refresh = single_flight.start(
+                ("refresh_orcid_access_token", refresh_token),
+                lambda: refresh_orcid_access_token(orcid_access_token, http_client, refreshed_orcid_access_tokens),
+            )
+            if validate_orcid_access_token(orcid_access_token) is None:
+                refreshed_orcid_access_token = await asyncio.shield(refresh)
+        if refreshed_orcid_access_token is not None:
+            request.session["orcid_access_token"] = orcid_access_token = refreshed_orcid_access_token
 
-    return validate_orcid_access_token(request.session.get("orcid_access_token", {}))
+    valid_orcid_access_token = validate_orcid_access_token(orcid_access_token)
+    if valid_orcid_access_token is not None:
+        get_current_span().set_attribute("orcid_id_hash", hash_orcid_id(valid_orcid_access_token["orcid"]))
+    return valid_orcid_access_token
+
+
+async def limit_request_rate(
+    request: Request,
+    orcid_access_token: Optional[dict] = Depends(get_orcid_access_token),
+) -> None:
+    r"""
+    Raises an `HTTPException` (telling the client when to try again) if the request exceeds the rate limit of its
+    session or of its ORCID ID.
+
+    Note: Requests that aren't part of any session (yet) share a limit per client IP address.
+    """
+
+    session_key = request.scope.get("session_id") or f"client:{request.client.host if request.client else ''}"
+    limits = [("session", request.app.state.session_rate_limiter, session_key)]
+    if orcid_access_token is not None:
+        limits.append(("orcid_id", request.app.state.orcid_id_rate_limiter, orcid_access_token["orcid"]))
+    for scope, rate_limiter, key in limits:
+        wait_seconds = rate_limiter.get_wait_seconds(key)
+        if wait_seconds > 0:
+            record_rate_limited_request(scope)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests. Please try again later.",
+                headers={"Retry-After": str(math.ceil(wait_seconds))},
+            )
+
+
+def raise_if_credit_store_overloaded(error: CreditStoreError) -> None:
+    r"""
+    Raises an `HTTPException` telling the client to try again later, if the specified error is the credit store
+    turning the request away because it is handling too many requests already.
+    """
+
+    if isinstance(error, CreditStoreOverloadedError):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="The app is handling too many requests right now. Please try again later.",
+            headers={"Retry-After": str(math.ceil(error.retry_after_seconds))},
+        )
 
 
 @app.get("/logout", include_in_schema=False)
@@ -135,8 +542,35 @@ async def logout(request: Request):
     return RedirectResponse(url=request.url_for("get_root"))
 
 
+def start_listing_credits(orcid_id: str, credit_store: CreditStore, single_flight: SingleFlight) -> asyncio.Future:
+    r"""
+    Starts getting the list of credits available to the specified ORCID ID, unless that is already in progress; and
+    returns the task doing so, without waiting for it.
+    """
+
+    return single_flight.start(("list_credits", orcid_id), lambda: credit_store.list_credits(orcid_id))
+
+
+def serialize_credits_payload(orcid_id: str, credits: list[dict]) -> bytes:
+    r"""
+    Serializes the credits available to the specified ORCID ID, the way `/api/credits` responds with them.
+
+    Note: The keys are sorted, so that equal payloads always serialize the same way (and so have the same ETag).
+
+    >>> serialize_credits_payload("0000-0000-0000-0001", [{"b": 1, "a": 2}])
+    b'{"credits":[{"a":2,"b":1}],"orcid_id":"0000-0000-0000-0001"}'
+    """
+
+    return json.dumps({"orcid_id": orcid_id, "credits": credits}, sort_keys=True, separators=(",", ":")).encode()
+
+
 @app.get("/credits", include_in_schema=False)
-async def get_credits(request: Request, orcid_access_token: dict = Depends(get_orcid_access_token)):
+async def get_credits(
+    request: Request,
+    orcid_access_token: dict = Depends(get_orcid_access_token),
+    credit_store: CreditStore = Depends(get_credit_store),
+    single_flight: SingleFlight = Depends(get_single_flight),
+):
     r"""Responds with the credits page, which displays the credits associated with the signed-in user"""
 
     if orcid_access_token is None:
@@ -144,19 +578,52 @@ async def get_credits(request: Request, orcid_access_token: dict = Depends(get_o
     orcid_id = orcid_access_token["orcid"]
     name = orcid_access_token["name"]
 
+    # Embed the user's credits (and their ETag) in the page, so the page doesn't have to fetch them from the API.
+    #
+    # Note: Usually, the app started fetching them when the user logged in (or they are cached), so there is little
+    #       to wait for. If fetching them fails or takes too long, we respond without them, and the page fetches them
+    #       from the API instead (joining the fetch that is still in progress, if any).
+    #
+    initial_credits = None
+    try:
+        credits = await asyncio.wait_for(
+            asyncio.shield(start_listing_credits(orcid_id, credit_store, single_flight)),
+            timeout=cfg.CREDITS_PAGE_INLINE_WAIT_SECONDS,
+        )
+        initial_credits = {"credits": credits, "etag": make_etag(serialize_credits_payload(orcid_id, credits))}
+    except (asyncio.TimeoutError, CreditStoreError) as error:
+        logger.warning("Rendering the credits page without credits: %r", error)
+
     # Respond with the credits page.
+    #
+    # Note: The page contains the user's credits, so we tell shared caches not to store it.
+    #
     context = {
         "orcid_id": orcid_id,
         "name": name,
+        "initial_credits": initial_credits,
     }
-    return templates.TemplateResponse(request=request, name="credits.html.jinja", context=context)
+    return templates.TemplateResponse(
+        request=request,
+        name="credits.html.jinja",
+        context=context,
+        headers={"Cache-Control": "private, no-cache", "Vary": "Cookie"},
+    )
 
 
-@app.get("/api/credits", tags=["Credits"])
+@app.get("/api/credits", tags=["Credits"], dependencies=[Depends(limit_request_rate)])
 async def get_api_credits(
+    if_none_match: Annotated[Optional[str], Header(description="The `ETag` of the credits the client has")] = None,
     orcid_access_token: dict = Depends(get_orcid_access_token),
+    credit_store: CreditStore = Depends(get_credit_store),
+    single_flight: SingleFlight = Depends(get_single_flight),
 ):
-    r"""Returns all credits associated with the specified ORCID ID"""
+    r"""
+    Returns all credits associated with the specified ORCID ID
+
+    The response has an `ETag` header. If the request has an `If-None-Match` header containing that value (i.e.
+    the client already has the current credits), the response will be "304 Not Modified", with no body.
+    """
 
     if orcid_access_token is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid ORCID access token")
@@ -164,137 +631,71 @@ async def get_api_credits(
 
     # Get a list of credits available to this ORCID ID.
     try:
-        response = httpx.get(
-            cfg.NMDC_ORCID_CREDITOR_PROXY_URL,
-            params={
-                "shared_secret": cfg.NMDC_ORCID_CREDITOR_PROXY_SHARED_SECRET,
-                "orcid_id": orcid_id,
-            },
-            follow_redirects=True,
-        )
-        res_json = response.json()
-        return {
-            "orcid_id": res_json["orcid_id"],
-            "credits": res_json["credits"],
-        }
-    except httpx.HTTPError as error:
+        # Note: If this ORCID ID's credits are already being fetched, we wait for that fetch to finish and
+        #       use its outcome, instead of fetching them again.
+        credits = await asyncio.shield(start_listing_credits(orcid_id, credit_store, single_flight))
+    except CreditStoreError as error:
         logger.exception(error)
+        raise_if_credit_store_overloaded(error)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to load credits")
 
-
-@app.post("/api/credits/claim", tags=["Credits"])
-async def post_api_credits_claim(
-    # Note: This parameter tells FastAPI the request payload will have a property named `credit_type`.
+    # Serialize the payload and derive the ETag from the result. If the client already has this version of the
+    # payload, respond without a body.
     #
-    # References:
-    # - https://fastapi.tiangolo.com/tutorial/body-multiple-params/#multiple-body-parameters (docs)
-    # - https://stackoverflow.com/a/70636163 (example)
+    # Note: The credits belong to the signed-in user, so we tell shared caches (e.g. proxies) not to store them; and
+    #       we tell the browser to revalidate its copy (via `If-None-Match`) before each use.
     #
-    credit_type: Annotated[str, Body(title="Credit Type", description="The type of the credit")],
-    start_date: Annotated[str, Body(title="Start Date", description="The start date, if any, of the credit")],
-    end_date: Annotated[str, Body(title="End Date", description="The end date, if any, of the credit")],
-    orcid_access_token: dict = Depends(get_orcid_access_token),
-):
-    r"""
-    Claim a credit associated with the signed-in user's ORCID ID, having the specified combination
-    of credit type, start date, and end date
-    """
+    content = serialize_credits_payload(orcid_id, credits)
+    headers = {"ETag": make_etag(content), "Cache-Control": "private, no-cache", "Vary": "Cookie"}
+    if if_none_match_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=content, media_type="application/json", headers=headers)
 
-    if orcid_access_token is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid ORCID access token")
-    orcid_id = orcid_access_token["orcid"]
 
-    # Get all of this user's credits from the Google Sheets document via the proxy.
-    all_credits = []
-    try:
-        response = httpx.get(
-            cfg.NMDC_ORCID_CREDITOR_PROXY_URL,
-            params={
-                "shared_secret": cfg.NMDC_ORCID_CREDITOR_PROXY_SHARED_SECRET,
-                "orcid_id": orcid_id,
-            },
-            follow_redirects=True,
-        )
-        res_json = response.json()
-        all_credits = res_json["credits"]
-    except httpx.HTTPError as error:
-        logger.exception(error)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to load credits")
+async def create_affiliation(
+    credit_to_claim: dict,
+    orcid_access_token: dict,
+    http_client: httpx.AsyncClient,
+    orcid_circuit_breaker: Optional[CircuitBreaker] = None,
+) -> str:
+    r"""
+    Creates an affiliation describing the specified credit, on the ORCID profile the specified ORCID access token
+    belongs to; and returns the newly-created affiliation's "put-code".
 
-    # Check whether the user has any unclaimed credits having the specified combination
-    # of {ORCID ID, credit type, start date, end date} values.
-    #
-    # Note: The credit's `column.CLAIMED_AT` value will be an empty string when
-    #       that cell in the Google Sheets spreadsheet is empty (which we use
-    #       to indicate that the credit has not been claimed).
-    #
-    # Note: We assume that the Google Sheets document does not contain multiple rows having the same combination
-    #       of `column.ORCID_ID` and `column.CREDIT_TYPE` values. In case it does, we process only the first row.
-    #
-    # TODO: Add a validation rule to the Google Sheets document to prevent multiple rows from having the same
-    #       combination of `column.ORCID_ID` and `column.CREDIT_TYPE` values. Accounting for duplicates there
-    #       would complicate this code.
-    #
-    # TODO: Also, update existing code and documentation to reflect the same assumption. Some existing code was
-    #       written under the contrary assumption that multiple rows of the spreadsheet _could_ have the same
-    #       combination of `column.ORCID_ID` and `column.CREDIT_TYPE` values.
-    #
-    credit_to_claim = None
-    for credit in all_credits:
-        if (
-            credit.get("column.ORCID_ID") == orcid_id
-            and credit.get("column.CREDIT_TYPE") == credit_type
-            and credit.get("column.START_DATE") == start_date
-            and credit.get("column.END_DATE") == end_date
-            and credit.get("column.CLAIMED_AT") == ""
-        ):
-            credit_to_claim = credit
-            break
+    Note: The request to the ORCID API is not retried, since ORCID may have created the affiliation even if we
+          didn't receive its response (in which case, retrying would create a duplicate affiliation).
 
-    # If the user has no such unclaimed credits, return an error response and abort.
-    if credit_to_claim is None:
-        logger.warning(f"Found no unclaimed credits of type '{credit_type}' for ORCID ID '{orcid_id}'")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"There are no matching credits available to claim.",
-        )
+    Note: This function raises an `HTTPException` if the credit is invalid or the affiliation cannot be created.
+    """
 
-    logger.debug(f"Claiming credit: {credit_to_claim}")
+    orcid_id = orcid_access_token["orcid"]
+    credit = Credit.of(credit_to_claim)
 
     # Get the affiliation type associated with the credit.
-    affiliation_type = credit_to_claim.get("column.AFFILIATION_TYPE", "").strip()
+    affiliation_type = credit.affiliation_type
     if affiliation_type not in ["membership", "service"]:
-        logger.error(f"The credit has an invalid affiliation type. Credit: {credit_to_claim}")
+        logger.error("The credit has an invalid affiliation type. Credit: %s", credit_to_claim)
+        record_claim_outcome("invalid_affiliation_type")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"The credit has an invalid affiliation type. Please report this to an administrator.",
         )
 
-    # Get the start date and end date strings associated with the credit; and—for any
-    # that isn't empty—parse it into its corresponding year, month, and day strings.
-    has_start_date = False
-    has_end_date = False
-    start_date = credit_to_claim.get("column.START_DATE", "").strip()
-    end_date = credit_to_claim.get("column.END_DATE", "").strip()
+    # Get the fields of the affiliation that are specific to the credit (i.e. its role title, URL, and—for any of its
+    # start date and end date that isn't empty—the corresponding year, month, and day strings).
+    #
+    # Note: The credit parses its dates only once, even if it is claimed (or fails to be claimed) repeatedly.
+    #
     try:
-        if len(start_date) > 0:
-            start_year, start_month, start_day = extract_year_month_day_from_datetime_string(start_date)
-            logger.debug(f"Parsed {start_date=} into {start_year=}, {start_month=}, {start_day=}")
-            has_start_date = True
-        if len(end_date) > 0:
-            end_year, end_month, end_day = extract_year_month_day_from_datetime_string(end_date)
-            logger.debug(f"Parsed {end_date=} into {end_year=}, {end_month=}, {end_day=}")
-            has_end_date = True
+        affiliation_details = credit.affiliation_details
     except ValueError as error:
-        logger.error(f"Failed to parse start date or end date. Details: {error}")
+        logger.error("Failed to parse start date or end date. Details: %s", error)
+        record_claim_outcome("invalid_date")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="The credit has an invalid date associated with it. Please report this to an administrator.",
         )
 
-    # Get the URL associated with the credit.
-    credit_url = credit_to_claim.get("column.DETAILS_URL", "").strip()
-
     # Create the ("membership" or "service") affiliation on the specified ORCID profile and extract the newly-created
     # affiliation's "put-code" from the API response. If we fail to do either thing, return an error response and abort
     # (instead of proceeding to record the claim event and "put-code" into the Google Sheets document).
@@ -307,37 +708,32 @@ async def post_api_credits_claim(
     try:
         orcid_api_url = f"{cfg.ORCID_API_BASE_URL}/{orcid_id}/{affiliation_type}"
 
-        # Build the start date and end date items (or lack thereof) for the API request payload (dictionary).
-        #
-        # Note: The ORCID API does allow the top-level "start-date" and "end-date" fields to be omitted.
-        #       When "start-date" is omitted, the person's ORCID profile will show only the end date (e.g. "2023-12-31 | Team member").
-        #       When "end-date" is omitted, the person's ORCID profile will append "to present"      (e.g. "2022-01-01 to present | Team member").
-        #       When both are omitted, the person's ORCID profile will not show any dates            (e.g. "Team member").
-        #        
-        start_date_item = {"start-date": {"year": {"value": start_year}, "month": {"value": start_month}, "day": {"value": start_day}}} if has_start_date else {}
-        end_date_item = {"end-date": {"year": {"value": end_year}, "month": {"value": end_month}, "day": {"value": end_day}}} if has_end_date else {}
-
-        response = httpx.post(
-            orcid_api_url,
-            headers={"Authorization": f"Bearer {orcid_access_token['access_token']}"},
-            json={
-                # TODO: Consider including a department and other information (see payload examples in ORCID docs).
-                "role-title": f"{credit_type}",
-                **start_date_item,
-                **end_date_item,
-                "organization": {
-                    "name": "National Microbiome Data Collaborative",
-                    "address": {"city": "Berkeley", "region": "California", "country": "US"},
-                    "disambiguated-organization": {
-                        "disambiguated-organization-identifier": "https://ror.org/05cwx3318",
-                        "disambiguation-source": "ROR",
+        timeout = get_attempt_timeout(cfg.ORCID_ATTEMPT_TIMEOUT_SECONDS)
+        with track_upstream_request("orcid_affiliation_post") as span, orcid_circuit_breaker or nullcontext():
+            span.set_attribute("credit_type", credit.get("column.CREDIT_TYPE", ""))
+            response = await http_client.post(
+                orcid_api_url,
+                timeout=timeout,
+                headers={"Authorization": f"Bearer {orcid_access_token['access_token']}"},
+                json={
+                    # TODO: Consider including a department and other information
+                    #       (see payload examples in ORCID docs).
+                    **affiliation_details,
+                    "organization": {
+                        "name": "National Microbiome Data Collaborative",
+                        "address": {"city": "Berkeley", "region": "California", "country": "US"},
+                        "disambiguated-organization": {
+                            "disambiguated-organization-identifier": "https://ror.org/05cwx3318",
+                            "disambiguation-source": "ROR",
+                        },
                     },
                 },
-                # Note: Submitting a "url.value" value of "" is OK. In that situation,
-                #       ORCID will not display the "URL" field for this affiliation.
-                "url": {"value": credit_url},
-            },
-        )
+            )
+            span.set_attribute("http.status_code", response.status_code)
+
+            # Let the circuit breaker know if ORCID is struggling (as opposed to rejecting this particular request).
+            if response.status_code >= 500 or response.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+                response.raise_for_status()
 
         # Try to extract the affiliation's "put-code" from the response's "location" header.
         response_location_header = response.headers.get("location", default="")
@@ -346,33 +742,579 @@ async def post_api_credits_claim(
         # If the response status code wasn't `201` or we failed to extract a "put-code",
         # abort; i.e., don't record that the credit has been claimed.
         if response.status_code != 201 or affiliation_put_code is None:
-            logger.debug(f"{response.status_code=}\n{response.headers=}\n{response.content=}")
+            logger.debug(
+                "Failed to create affiliation: status_code=%d headers=%r content=%r",
+                response.status_code,
+                response.headers,
+                response.content,
+            )
+            record_upstream_error("orcid_affiliation_post", f"status_{response.status_code}")
             raise RuntimeError("Failed to claim credit.")
         else:
-            logger.debug(f"Created affiliation having put-code: {affiliation_put_code}")
+            logger.debug("Created affiliation having put-code: %s", affiliation_put_code)
+    except UpstreamUnavailableError as error:
+        logger.warning("Did not attempt to create affiliation: %s", error)
+        record_claim_outcome("orcid_unavailable")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="ORCID is temporarily unavailable. Please try again later.",
+        )
     except (httpx.HTTPError, RuntimeError) as error:
         logger.exception(error)
+        record_claim_outcome("orcid_failure")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to claim credit.")
 
-    # Record the claim event, including the "put-code", into the Google Sheets document via the proxy.
+    return affiliation_put_code
+
+
+# Description of the `Idempotency-Key` header, which is accepted by the endpoints that claim credits.
+IDEMPOTENCY_KEY_DESCRIPTION = (
+    "A unique value identifying this request. If the client sends another request having the same value "
+    "(e.g. when retrying this one), the server will respond the way it did to this one; without claiming "
+    "anything again."
+)
+
+
+# Description of the `Prefer` header, which is accepted by the endpoints that claim credits.
+PREFER_DESCRIPTION = (
+    'If "respond-async", the server will respond right away (with "202 Accepted" and the URL of a stream of '
+    "Server-Sent Events reporting the claim's progress), instead of once it has finished claiming."
+)
+
+
+def prefers_async_response(prefer: Optional[str]) -> bool:
+    r"""
+    Returns whether the specified `Prefer` header value asks the server to respond to the request before it has
+    finished processing it.
+
+    Reference: https://www.rfc-editor.org/rfc/rfc7240#section-4.1
+
+    >>> prefers_async_response("respond-async, wait=10"), prefers_async_response("return=minimal")
+    (True, False)
+    """
+
+    if prefer is None:
+        return False
+    preferences = [preference.split(";")[0].split("=")[0].strip().lower() for preference in prefer.split(",")]
+    return "respond-async" in preferences
+
+
+def start_claiming_in_background(
+    request: Request,
+    orcid_id: str,
+    claim_progress_tracker: ClaimProgressTracker,
+    claim: Callable[[ClaimProgress], Awaitable[dict]],
+) -> JSONResponse:
+    r"""
+    Starts the specified claim in the background, ending its progress report with its outcome (i.e. what the claim
+    endpoint would otherwise have responded with); and returns a "202 Accepted" response containing the URL of the
+    progress report's event stream.
+    """
+
+    async def claim_and_report_outcome(progress: ClaimProgress) -> None:
+        try:
+            result = await claim(progress)
+        except HTTPException as error:
+            progress.report(
+                "failed",
+                {
+                    "status_code": error.status_code,
+                    "detail": error.detail,
+                    "retry_after": (error.headers or {}).get("Retry-After"),
+                },
+            )
+            return
+        progress.report("done", result)
+
+    progress_id = claim_progress_tracker.start(orcid_id, claim_and_report_outcome)
+    progress_url = str(request.url_for("get_api_credits_claim_progress_events", progress_id=progress_id))
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={"progress_id": progress_id, "progress_url": progress_url},
+        headers={"Location": progress_url, "Preference-Applied": "respond-async"},
+    )
+
+
+def make_claimed_at_timestamp() -> str:
+    r"""Returns the current time, formatted the way the proxy formats `column.CLAIMED_AT` values"""
+
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+async def claim_credit(
+    orcid_access_token: dict,
+    credit_type: str,
+    start_date: str,
+    end_date: str,
+    http_client: httpx.AsyncClient,
+    credit_store: CreditStore,
+    orcid_circuit_breaker: Optional[CircuitBreaker] = None,
+    credit_stats: Optional[CreditStats] = None,
+    progress: Optional[ClaimProgress] = None,
+) -> dict:
+    r"""
+    Claims the first unclaimed credit associated with the specified ORCID access token's ORCID ID, having the
+    specified combination of credit type, start date, and end date; and returns the content of the API response.
+
+    If a progress report is specified, this reports each stage of the claim to it as soon as the stage finishes.
+
+    Note: This function raises an `HTTPException` if it fails to claim the credit.
+    """
+
+    orcid_id = orcid_access_token["orcid"]
+    requested_credit = dict(credit_type=credit_type, start_date=start_date, end_date=end_date)
+    get_current_span().set_attribute("credit_type", credit_type)
+
+    # Check whether the user has any unclaimed credits having the specified combination
+    # of {ORCID ID, credit type, start date, end date} values.
+    #
+    # Note: We assume that the Google Sheets document does not contain multiple rows having the same combination
+    #       of `column.ORCID_ID` and `column.CREDIT_TYPE` values. In case it does, we process only the first row.
+    #
+    # TODO: Add a validation rule to the Google Sheets document to prevent multiple rows from having the same
+    #       combination of `column.ORCID_ID` and `column.CREDIT_TYPE` values. Accounting for duplicates there
+    #       would complicate this code.
+    #
+    # TODO: Also, update existing code and documentation to reflect the same assumption. Some existing code was
+    #       written under the contrary assumption that multiple rows of the spreadsheet _could_ have the same
+    #       combination of `column.ORCID_ID` and `column.CREDIT_TYPE` values.
+    #
+    try:
+        credit_to_claim = await credit_store.find_unclaimed_credit(orcid_id, credit_type, start_date, end_date)
+    except CreditStoreError as error:
+        logger.exception(error)
+        record_claim_outcome("load_failure")
+        raise_if_credit_store_overloaded(error)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to load credits")
+
+    # If the user has no such unclaimed credits, return an error response and abort.
+    if credit_to_claim is None:
+        logger.warning("Found no unclaimed credits of type '%s' for ORCID ID '%s'", credit_type, orcid_id)
+        record_claim_outcome("no_match")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"There are no matching credits available to claim.",
+        )
+
+    # Note: The credit is only formatted if debug output is enabled (and, then, on the logging thread).
+    logger.debug("Claiming credit: %s", credit_to_claim)
+    if progress is not None:
+        progress.report("credit_validated", requested_credit)
+
+    # Create the affiliation on the user's ORCID profile.
+    affiliation_put_code = await create_affiliation(
+        credit_to_claim, orcid_access_token, http_client, orcid_circuit_breaker
+    )
+    if progress is not None:
+        progress.report("affiliation_created", {**requested_credit, "affiliation_put_code": affiliation_put_code})
+
+    # Record the claim event, including the "put-code", into the credit store.
+    #
+    # Note: If the credit store records claims in the background, this only queues the claim to be recorded.
+    #
     try:
-        response = httpx.post(
-            cfg.NMDC_ORCID_CREDITOR_PROXY_URL,
-            params={
-                "shared_secret": cfg.NMDC_ORCID_CREDITOR_PROXY_SHARED_SECRET,
-                "orcid_id": orcid_id,
-                "credit_type": credit_type,
-                "start_date": credit_to_claim.get("column.START_DATE"),  # uses the value verbatim
-                "end_date": credit_to_claim.get("column.END_DATE"),  # uses the value verbatim
-                "affiliation_put_code": affiliation_put_code,
-            },
-            follow_redirects=True,
+        updated_credits = await credit_store.mark_claimed(
+            orcid_id=orcid_id,
+            credit_type=credit_type,
+            start_date=credit_to_claim.get("column.START_DATE"),  # uses the value verbatim
+            end_date=credit_to_claim.get("column.END_DATE"),  # uses the value verbatim
+            affiliation_put_code=affiliation_put_code,
         )
-        res_json = response.json()
-        return {
-            "orcid_id": res_json["orcid_id"],
-            "credits": res_json["credits"],
-        }
-    except httpx.HTTPError as error:
+    except CreditStoreError as error:
         logger.exception(error)
+        record_claim_outcome("recording_failure")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to record claim.")
+
+    record_claim_outcome("claimed")
+    if credit_stats is not None:
+        credit_stats.record_claim(credit_type, make_claimed_at_timestamp(), affiliation_put_code)
+    claim_recording_status = "pending" if credit_store.defers_claim_recording else "recorded"
+    if progress is not None:
+        progress.report("claim_recorded", {**requested_credit, "claim_recording_status": claim_recording_status})
+        progress.report("credits", {"credits": updated_credits})
+    return {
+        "orcid_id": orcid_id,
+        "credits": updated_credits,
+        "claim_recording_status": claim_recording_status,
+    }
+
+
+@app.post("/api/credits/claim", tags=["Credits"], dependencies=[Depends(limit_request_rate)])
+async def post_api_credits_claim(
+    # Note: This parameter tells FastAPI the request payload will have a property named `credit_type`.
+    #
+    # References:
+    # - https://fastapi.tiangolo.com/tutorial/body-multiple-params/#multiple-body-parameters (docs)
+    # - https://stackoverflow.com/a/70636163 (example)
+    #
+    credit_type: Annotated[str, Body(title="Credit Type", description="The type of the credit")],
+    start_date: Annotated[str, Body(title="Start Date", description="The start date, if any, of the credit")],
+    end_date: Annotated[str, Body(title="End Date", description="The end date, if any, of the credit")],
+    request: Request,
+    response: Response,
+    idempotency_key: Annotated[Optional[str], Header(description=IDEMPOTENCY_KEY_DESCRIPTION)] = None,
+    prefer: Annotated[Optional[str], Header(description=PREFER_DESCRIPTION)] = None,
+    orcid_access_token: dict = Depends(get_orcid_access_token),
+    http_client: httpx.AsyncClient = Depends(get_http_client),
+    credit_store: CreditStore = Depends(get_credit_store),
+    single_flight: SingleFlight = Depends(get_single_flight),
+    idempotency_results: TTLCache = Depends(get_idempotency_results),
+    orcid_circuit_breaker: CircuitBreaker = Depends(get_orcid_circuit_breaker),
+    credit_stats: CreditStats = Depends(get_credit_stats),
+    claim_progress_tracker: ClaimProgressTracker = Depends(get_claim_progress_tracker),
+):
+    r"""
+    Claim a credit associated with the signed-in user's ORCID ID, having the specified combination
+    of credit type, start date, and end date
+    """
+
+    if orcid_access_token is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid ORCID access token")
+    orcid_id = orcid_access_token["orcid"]
+
+    # If the client has made this request before (i.e. using the same idempotency key), respond the way we did then.
+    if idempotency_key is not None:
+        previous_result = idempotency_results.get((orcid_id, idempotency_key))
+        if previous_result is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return previous_result
+
+    # Claim the credit. If the same credit is already being claimed (e.g. because the user double-clicked the
+    # "Claim" button or has the page open in two tabs), wait for the outcome of that claim instead of claiming
+    # the credit a second time.
+    #
+    # Note: The claim reports its stages to a progress report shared by all the requests waiting for it, so that
+    #       each of them (not only the one that started it) can report those stages to its client.
+    #
+    async def claim(progress: Optional[ClaimProgress] = None) -> dict:
+        key = ("claim", orcid_id, credit_type, start_date, end_date)
+        with claim_progress_tracker.share(key, orcid_id, progress) as shared_progress:
+            result = await single_flight.do(
+                key,
+                lambda: claim_credit(
+                    orcid_access_token,
+                    credit_type,
+                    start_date,
+                    end_date,
+                    http_client,
+                    credit_store,
+                    orcid_circuit_breaker,
+                    credit_stats,
+                    shared_progress,
+                ),
+            )
+        if idempotency_key is not None:
+            idempotency_results.set((orcid_id, idempotency_key), result)
+        return result
+
+    # If the client prefers, claim the credit in the background, and respond with the URL of its progress report.
+    if prefers_async_response(prefer):
+        return start_claiming_in_background(request, orcid_id, claim_progress_tracker, claim)
+    return await claim()
+
+
+class CreditToClaim(BaseModel):
+    r"""A credit the client wants to claim, identified by its combination of credit type, start date, and end date"""
+
+    credit_type: str = Field(title="Credit Type", description="The type of the credit")
+    start_date: str = Field(title="Start Date", description="The start date, if any, of the credit")
+    end_date: str = Field(title="End Date", description="The end date, if any, of the credit")
+
+
+async def claim_credits(
+    orcid_access_token: dict,
+    credits: list[CreditToClaim],
+    http_client: httpx.AsyncClient,
+    credit_store: CreditStore,
+    orcid_circuit_breaker: Optional[CircuitBreaker] = None,
+    credit_stats: Optional[CreditStats] = None,
+    progress: Optional[ClaimProgress] = None,
+) -> dict:
+    r"""
+    Claims the specified credits associated with the specified ORCID access token's ORCID ID, and returns the content
+    of the API response, which reports whether each of them was claimed.
+
+    If a progress report is specified, this reports each stage of each credit's claim (or the reason the credit
+    could not be claimed) to it as soon as the stage finishes.
+
+    Note: This function raises an `HTTPException` if it fails to load the user's credits.
+    """
+
+    def report_progress(event: str, result: dict, **data) -> None:
+        if progress is not None:
+            requested_credit = dict(
+                credit_type=result["credit_type"], start_date=result["start_date"], end_date=result["end_date"]
+            )
+            progress.report(event, {**requested_credit, **data})
+
+    orcid_id = orcid_access_token["orcid"]
+
+    # Get all of this user's credits (once, for the whole batch).
+    try:
+        all_credits = await credit_store.list_credits(orcid_id)
+    except CreditStoreError as error:
+        logger.exception(error)
+        for _ in credits:
+            record_claim_outcome("load_failure")
+        raise_if_credit_store_overloaded(error)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to load credits")
+
+    # Find the first unclaimed credit matching each requested one; making sure
+    # not to match any credit more than once.
+    #
+    # Note: We index the unclaimed credits by claim key, so that matching each requested credit takes constant time,
+    #       rather than time proportional to the number of the user's credits.
+    #
+    unclaimed_credits_by_claim_key: dict[tuple, list[Credit]] = {}
+    for credit in map(Credit.of, all_credits):
+        if credit.get("column.CLAIMED_AT") == "":
+            unclaimed_credits_by_claim_key.setdefault(credit.claim_key, []).append(credit)
+    results = []
+    matches = []  # list of (result, credit) tuples
+    for requested_credit in credits:
+        result = {
+            **requested_credit.model_dump(),
+            "status": "failed",
+            "detail": None,
+            "affiliation_put_code": None,
+            "claim_recording_status": None,
+        }
+        results.append(result)
+        claim_key = (orcid_id, requested_credit.credit_type, requested_credit.start_date, requested_credit.end_date)
+        matching_credits = unclaimed_credits_by_claim_key.get(claim_key, [])
+        if len(matching_credits) == 0:
+            result["detail"] = "There are no matching credits available to claim."
+            record_claim_outcome("no_match")
+            report_progress("claim_failed", result, detail=result["detail"])
+            continue
+        credit_to_claim = matching_credits.pop(0)
+        matches.append((result, credit_to_claim))
+        report_progress("credit_validated", result)
+
+    # Create the affiliations on the user's ORCID profile concurrently (but only a limited number at a time).
+    semaphore = asyncio.Semaphore(cfg.CLAIM_BATCH_MAX_CONCURRENCY)
+
+    async def create_affiliation_for_match(result: dict, credit_to_claim: dict) -> None:
+        async with semaphore:
+            try:
+                result["affiliation_put_code"] = await create_affiliation(
+                    credit_to_claim, orcid_access_token, http_client, orcid_circuit_breaker
+                )
+                report_progress("affiliation_created", result, affiliation_put_code=result["affiliation_put_code"])
+            except HTTPException as error:
+                result["detail"] = error.detail
+                report_progress("claim_failed", result, detail=result["detail"])
+
+    await asyncio.gather(*[create_affiliation_for_match(result, credit) for result, credit in matches])
+
+    # Record all the claim events, including the "put-codes", into the credit store at once.
+    created = [(result, credit) for result, credit in matches if result["affiliation_put_code"] is not None]
+    updated_credits = all_credits
+    if len(created) > 0:
+        claims = [
+            dict(
+                credit_type=credit.get("column.CREDIT_TYPE"),
+                start_date=credit.get("column.START_DATE"),  # uses the value verbatim
+                end_date=credit.get("column.END_DATE"),  # uses the value verbatim
+                affiliation_put_code=result["affiliation_put_code"],
+            )
+            for result, credit in created
+        ]
+        try:
+            updated_credits = await credit_store.mark_claimed_batch(orcid_id, claims)
+            claimed_at = make_claimed_at_timestamp()
+            for result, _ in created:
+                result["status"] = "claimed"
+                result["claim_recording_status"] = "pending" if credit_store.defers_claim_recording else "recorded"
+                record_claim_outcome("claimed")
+                if credit_stats is not None:
+                    credit_stats.record_claim(result["credit_type"], claimed_at, result["affiliation_put_code"])
+                report_progress("claim_recorded", result, claim_recording_status=result["claim_recording_status"])
+            if progress is not None:
+                progress.report("credits", {"credits": updated_credits})
+        except CreditStoreError as error:
+            logger.exception(error)
+            for result, _ in created:
+                result["detail"] = "Failed to record claim."
+                record_claim_outcome("recording_failure")
+                report_progress("claim_failed", result, detail=result["detail"])
+
+    return {
+        "orcid_id": orcid_id,
+        "credits": updated_credits,
+        "results": results,
+    }
+
+
+@app.post("/api/credits/claim-batch", tags=["Credits"], dependencies=[Depends(limit_request_rate)])
+async def post_api_credits_claim_batch(
+    credits: Annotated[list[CreditToClaim], Body(embed=True, title="Credits", description="The credits to claim")],
+    request: Request,
+    response: Response,
+    idempotency_key: Annotated[Optional[str], Header(description=IDEMPOTENCY_KEY_DESCRIPTION)] = None,
+    prefer: Annotated[Optional[str], Header(description=PREFER_DESCRIPTION)] = None,
+    orcid_access_token: dict = Depends(get_orcid_access_token),
+    http_client: httpx.AsyncClient = Depends(get_http_client),
+    credit_store: CreditStore = Depends(get_credit_store),
+    single_flight: SingleFlight = Depends(get_single_flight),
+    idempotency_results: TTLCache = Depends(get_idempotency_results),
+    orcid_circuit_breaker: CircuitBreaker = Depends(get_orcid_circuit_breaker),
+    credit_stats: CreditStats = Depends(get_credit_stats),
+    claim_progress_tracker: ClaimProgressTracker = Depends(get_claim_progress_tracker),
+):
+    r"""
+    Claim multiple credits associated with the signed-in user's ORCID ID at once, reporting
+    whether each of them was claimed
+    """
+
+    if orcid_access_token is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid ORCID access token")
+    orcid_id = orcid_access_token["orcid"]
+
+    # If the client has made this request before (i.e. using the same idempotency key), respond the way we did then.
+    if idempotency_key is not None:
+        previous_result = idempotency_results.get((orcid_id, idempotency_key))
+        if previous_result is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return previous_result
+
+    # Claim the credits. If the same credits are already being claimed, wait for the outcome of that batch instead.
+    batch_key = tuple((c.credit_type, c.start_date, c.end_date) for c in credits)
+
+    async def claim(progress: Optional[ClaimProgress] = None) -> dict:
+        key = ("claim_batch", orcid_id, batch_key)
+        with claim_progress_tracker.share(key, orcid_id, progress) as shared_progress:
+            result = await single_flight.do(
+                key,
+                lambda: claim_credits(
+                    orcid_access_token,
+                    credits,
+                    http_client,
+                    credit_store,
+                    orcid_circuit_breaker,
+                    credit_stats,
+                    shared_progress,
+                ),
+            )
+        if idempotency_key is not None:
+            idempotency_results.set((orcid_id, idempotency_key), result)
+        return result
+
+    # If the client prefers, claim the credits in the background, and respond with the URL of their progress report.
+    if prefers_async_response(prefer):
+        return start_claiming_in_background(request, orcid_id, claim_progress_tracker, claim)
+    return await claim()
+
+
+@app.get("/api/credits/claim-progress/{progress_id}/events", tags=["Credits"], response_class=StreamingResponse)
+async def get_api_credits_claim_progress_events(
+    progress_id: str,
+    last_event_id: Annotated[
+        Optional[int], Header(description="The ID of the last event the client received, if it is reconnecting")
+    ] = None,
+    orcid_access_token: dict = Depends(get_orcid_access_token),
+    claim_progress_tracker: ClaimProgressTracker = Depends(get_claim_progress_tracker),
+):
+    r"""
+    Streams the progress of a claim (or batch of claims) the server is making in the background, as Server-Sent
+    Events; from when the credit is validated ("credit_validated"), to when the ORCID affiliation is created
+    ("affiliation_created") and the claim is recorded ("claim_recorded"), followed by the refreshed list of the
+    user's credits ("credits"). The stream ends with a "done" event (containing what the claim endpoint would
+    otherwise have responded with) or a "failed" event.
+    """
+
+    if orcid_access_token is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid ORCID access token")
+    progress = claim_progress_tracker.get(orcid_access_token["orcid"], progress_id)
+    if progress is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No such claim is in progress")
+
+    # Note: We tell reverse proxies (e.g. NGINX) not to buffer the stream, so each event reaches the client right away.
+    return StreamingResponse(
+        progress.subscribe(last_event_id or 0, keepalive_seconds=cfg.CLAIM_PROGRESS_KEEPALIVE_SECONDS),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Diagnostics"])
+async def get_metrics(request: Request):
+    r"""
+    Returns the app's metrics (e.g. the latencies of requests to upstream services), in the Prometheus text format
+
+    Reference: https://prometheus.io/docs/instrumenting/exposition_formats/#text-based-format
+    """
+
+    for circuit_breaker in (request.app.state.proxy_circuit_breaker, request.app.state.orcid_circuit_breaker):
+        circuit_breaker.report_state()  # e.g. in case an open breaker has become half-open since it was last used
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/circuit-breakers", tags=["Diagnostics"])
+async def get_api_circuit_breakers(request: Request):
+    r"""Returns the state and counters of the circuit breaker of each upstream service (i.e. the proxy and ORCID)"""
+
+    return [
+        request.app.state.proxy_circuit_breaker.stats(),
+        request.app.state.orcid_circuit_breaker.stats(),
+    ]
+
+
+@app.get("/api/proxy-admission/stats", tags=["Diagnostics"])
+async def get_api_proxy_admission_stats(request: Request):
+    r"""
+    Returns the number of requests to the proxy that are in progress and waiting for their turn, and the number that
+    have been turned away (because too many were waiting already)
+    """
+
+    return request.app.state.proxy_admission_controller.stats()
+
+
+@app.get("/api/credits-cache/stats", tags=["Diagnostics"])
+async def get_api_credits_cache_stats(credits_cache: CreditsCache = Depends(get_credits_cache)):
+    r"""Returns the hit, miss, and eviction counters of the credits cache, along with its current number of entries"""
+
+    return credits_cache.stats()
+
+
+@app.get("/api/stats", tags=["Admin"], dependencies=[Depends(verify_admin_api_key)])
+async def get_api_stats(
+    granularity: Annotated[
+        Literal["day", "month", "year"], Query(description="The size of the time buckets to count claims in")
+    ] = "month",
+    credit_type: Annotated[Optional[str], Query(description="The credit type to report on (default: all)")] = None,
+    credit_stats: CreditStats = Depends(get_credit_stats),
+):
+    r"""
+    Returns, for each credit type, the number of credits, the number of them that have been claimed, and the claim
+    rate; along with the number of claims made in each time bucket (e.g. each month) and the claim rate as of then
+
+    Note: The statistics are maintained incrementally (as credits are claimed), so reporting them doesn't involve
+          reading the credits. They are seeded from a full scan of the credit store when the app starts.
+    """
+
+    if not credit_stats.is_seeded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The statistics are still being computed",
+            headers={"Retry-After": "60"},
+        )
+    return credit_stats.report(granularity=granularity, credit_type=credit_type)
+
+
+@app.get("/api/traces", tags=["Admin"], dependencies=[Depends(verify_admin_api_key)])
+async def get_api_traces(
+    limit: Annotated[int, Query(ge=1, le=1000, description="The maximum number of traces to return")] = 50,
+):
+    r"""
+    Returns the most recent traces of requests in the login and claim flows (most recent first); each of which
+    consists of a span for the request as a whole and a span for each upstream request the app made while handling it
+
+    Note: Only the traces of a sample of requests (per `TRACING_SAMPLE_RATE`) are recorded; and the app keeps only a
+          limited number of spans in memory. This endpoint is only available when the spans are kept in memory (as
+          opposed to being written to a file).
+    """
+
+    if not isinstance(tracer.exporter, RingBufferExporter):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Traces are not being kept in memory")
+    return tracer.exporter.list_traces(limit=limit)
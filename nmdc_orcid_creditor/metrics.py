@@ -0,0 +1,375 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Iterator, Optional, Union
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from nmdc_orcid_creditor.tracing import Span, NonRecordingSpan, start_span
+
+# Upper bounds (in seconds) of the buckets of the latency histograms. The upstream services
+# (especially the proxy, which runs on Google Apps Script) can take several seconds to respond.
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...], extra: str = "") -> str:
+    r"""
+    Returns the label set of a sample, in the Prometheus text format.
+
+    >>> _format_labels(("upstream",), ('proxy_"get"',), extra='le="0.5"')
+    '{upstream="proxy_\\"get\\"",le="0.5"}'
+    >>> _format_labels((), ())
+    ''
+    """
+
+    pairs = [_format_label(name, value) for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_label(name: str, value: str) -> str:
+    escaped_value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'{name}="{escaped_value}"'
+
+
+class _Metric:
+    r"""
+    A metric, whose samples are broken down by the values of its labels.
+
+    Note: Each combination of label values gets its own "child" object, which `labels` caches; so that updating a
+          metric (e.g. `counter.labels("GET").inc()`) costs a dictionary lookup and an addition, and no allocations.
+    """
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._children: dict[tuple[str, ...], object] = {}
+
+    def _make_child(self):
+        raise NotImplementedError
+
+    def labels(self, *label_values: str):
+        r"""Returns the child having the specified label values (in the order of the metric's label names)"""
+
+        child = self._children.get(label_values)
+        if child is None:
+            child = self._children.setdefault(label_values, self._make_child())
+        return child
+
+    def _render_samples(self) -> Iterator[str]:
+        for label_values, child in sorted(self._children.items()):
+            yield f"{self.name}{_format_labels(self.label_names, label_values)} {child.value}"
+
+    def render(self) -> str:
+        r"""Returns the metric's samples, in the Prometheus text format"""
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._render_samples())
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter(_Metric):
+    r"""
+    A value that only goes up (e.g. the number of requests the app has handled).
+
+    >>> counter = Counter("requests_total", "Requests handled", ("method",))
+    >>> counter.labels("GET").inc()
+    >>> print(counter.render())
+    # HELP requests_total Requests handled
+    # TYPE requests_total counter
+    requests_total{method="GET"} 1.0
+    """
+
+    type_name = "counter"
+
+    def _make_child(self) -> _CounterChild:
+        return _CounterChild()
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Gauge(_Metric):
+    r"""A value that can go up and down (e.g. the number of requests the app is handling right now)"""
+
+    type_name = "gauge"
+
+    def _make_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+
+class _HistogramChild:
+    __slots__ = ("bucket_counts", "sum", "count")
+
+    def __init__(self, num_buckets: int):
+        self.bucket_counts = [0] * (num_buckets + 1)  # the last one is the "+Inf" bucket
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    r"""
+    A distribution of observed values (e.g. request latencies), counted in buckets.
+
+    >>> histogram = Histogram("latency_seconds", "Latency", ("upstream",), buckets=(0.1, 1.0))
+    >>> histogram.observe(0.05, "proxy_get")
+    >>> histogram.observe(0.5, "proxy_get")
+    >>> print(histogram.render())
+    # HELP latency_seconds Latency
+    # TYPE latency_seconds histogram
+    latency_seconds_bucket{upstream="proxy_get",le="0.1"} 1
+    latency_seconds_bucket{upstream="proxy_get",le="1.0"} 2
+    latency_seconds_bucket{upstream="proxy_get",le="+Inf"} 2
+    latency_seconds_sum{upstream="proxy_get"} 0.55
+    latency_seconds_count{upstream="proxy_get"} 2
+    """
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _make_child(self) -> _HistogramChild:
+        return _HistogramChild(len(self.buckets))
+
+    def observe(self, value: float, *label_values: str) -> None:
+        r"""Records the specified value in the child having the specified label values"""
+
+        child = self.labels(*label_values)
+
+        # Note: We store per-bucket (not cumulative) counts, so that each observation increments only one of them.
+        child.bucket_counts[bisect_left(self.buckets, value)] += 1
+        child.sum += value
+        child.count += 1
+
+    def _render_samples(self) -> Iterator[str]:
+        for label_values, child in sorted(self._children.items()):
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip((*self.buckets, "+Inf"), child.bucket_counts):
+                cumulative_count += bucket_count
+                labels = _format_labels(self.label_names, label_values, extra=f'le="{upper_bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative_count}"
+            labels = _format_labels(self.label_names, label_values)
+            yield f"{self.name}_sum{labels} {round(child.sum, 9)}"
+            yield f"{self.name}_count{labels} {child.count}"
+
+
+class MetricsRegistry:
+    r"""A collection of metrics, which can be rendered in the Prometheus text format all at once"""
+
+    def __init__(self):
+        self.metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        r"""
+        Returns the samples of all the registered metrics, in the Prometheus text format.
+
+        Reference: https://prometheus.io/docs/instrumenting/exposition_formats/#text-based-format
+        """
+
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+# The registry of the app's metrics, which the `/metrics` endpoint exports.
+registry = MetricsRegistry()
+
+UPSTREAM_REQUEST_DURATION_SECONDS = registry.register(
+    Histogram(
+        "upstream_request_duration_seconds",
+        "Latency of requests the app sends to upstream services",
+        ("upstream",),
+    )
+)
+UPSTREAM_REQUEST_ERRORS_TOTAL = registry.register(
+    Counter(
+        "upstream_request_errors_total",
+        "Requests to upstream services that failed, by kind of failure",
+        ("upstream", "kind"),
+    )
+)
+HTTP_REQUESTS_TOTAL = registry.register(
+    Counter("http_requests_total", "Requests the app has handled", ("method", "route", "status"))
+)
+HTTP_REQUEST_DURATION_SECONDS = registry.register(
+    Histogram("http_request_duration_seconds", "Latency of requests the app has handled", ("method", "route"))
+)
+HTTP_REQUESTS_IN_FLIGHT = registry.register(Gauge("http_requests_in_flight", "Requests the app is handling right now"))
+CIRCUIT_BREAKER_STATE = registry.register(
+    Gauge(
+        "circuit_breaker_state",
+        "State of the circuit breaker of each upstream service (0=closed, 1=half-open, 2=open)",
+        ("upstream",),
+    )
+)
+CLAIM_OUTCOMES_TOTAL = registry.register(
+    Counter("claim_outcomes_total", "Outcomes of attempts to claim a credit", ("outcome",))
+)
+ORCID_TOKEN_REFRESHES_TOTAL = registry.register(
+    Counter("orcid_token_refreshes_total", "Outcomes of attempts to refresh an ORCID access token", ("outcome",))
+)
+
+ADMISSION_QUEUE_DEPTH = registry.register(
+    Gauge("admission_queue_depth", "Requests waiting for their turn to be sent to an upstream service", ("upstream",))
+)
+ADMISSION_WAIT_SECONDS = registry.register(
+    Histogram(
+        "admission_wait_seconds",
+        "Time requests spent waiting for their turn to be sent to an upstream service",
+        ("upstream",),
+    )
+)
+ADMISSION_REJECTIONS_TOTAL = registry.register(
+    Counter(
+        "admission_rejections_total",
+        "Requests to an upstream service that were turned away because too many were waiting already",
+        ("upstream",),
+    )
+)
+RATE_LIMITED_REQUESTS_TOTAL = registry.register(
+    Counter("rate_limited_requests_total", "Requests the app rejected for exceeding a rate limit", ("scope",))
+)
+CLAIM_PROGRESS_SUBSCRIBERS = registry.register(
+    Gauge("claim_progress_subscribers", "Clients following the progress of a claim (via Server-Sent Events) right now")
+)
+CLAIM_OUTBOX_ENTRIES = registry.register(
+    Gauge(
+        "claim_outbox_entries",
+        "Claims in the outbox, by state (pending=yet to be recorded, parked=given up on after too many attempts)",
+        ("state",),
+    )
+)
+LOG_RECORDS_DROPPED_TOTAL = registry.register(
+    Counter("log_records_dropped_total", "Log records that were not written, by reason", ("reason",))
+)
+
+
+def record_upstream_error(upstream: str, kind: str) -> None:
+    r"""Records that a request to the specified upstream service failed in the specified way"""
+
+    UPSTREAM_REQUEST_ERRORS_TOTAL.labels(upstream, kind).inc()
+
+
+@contextmanager
+def track_upstream_request(upstream: str) -> Iterator[Union[Span, NonRecordingSpan]]:
+    r"""
+    Records how long the code in the `with` block takes, as the latency of a request to the specified upstream
+    service; and, if the code raises an exception, records that the request failed.
+
+    The code also runs in a span of its own (if the current request is being traced), which it can add attributes
+    (e.g. the response's status code) to.
+    """
+
+    started_at = time.perf_counter()
+    try:
+        with start_span(upstream) as span:
+            yield span
+    except Exception as error:
+        record_upstream_error(upstream, type(error).__name__)
+        raise
+    finally:
+        UPSTREAM_REQUEST_DURATION_SECONDS.observe(time.perf_counter() - started_at, upstream)
+
+
+def record_rate_limited_request(scope: str) -> None:
+    r"""Records that the app rejected a request for exceeding the rate limit of the specified scope (e.g. "session")"""
+
+    RATE_LIMITED_REQUESTS_TOTAL.labels(scope).inc()
+
+
+def record_dropped_log_record(reason: str) -> None:
+    r"""Records that a log record was not written, for the specified reason (e.g. "sampled" or "queue_full")"""
+
+    LOG_RECORDS_DROPPED_TOTAL.labels(reason).inc()
+
+
+def record_claim_outcome(outcome: str) -> None:
+    r"""Records the outcome (e.g. "claimed" or "no_match") of an attempt to claim a credit"""
+
+    CLAIM_OUTCOMES_TOTAL.labels(outcome).inc()
+
+
+def record_token_refresh_outcome(outcome: str) -> None:
+    r"""Records the outcome (e.g. "refreshed" or "rejected") of an attempt to refresh an ORCID access token"""
+
+    ORCID_TOKEN_REFRESHES_TOTAL.labels(outcome).inc()
+
+
+class MetricsMiddleware:
+    r"""
+    Records the number, latency, and status codes of the requests the app handles, by route; and the number of
+    requests the app is handling right now.
+
+    Note: Requests are labeled with the path template of the route that handled them (e.g. "/api/credits"), rather
+          than with their actual path; so that the number of label combinations stays small.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._route_paths: Optional[dict] = None  # endpoint -> path template
+
+    def _get_route_path(self, scope: Scope) -> str:
+        if self._route_paths is None:
+            self._route_paths = {
+                getattr(route, "endpoint", None) or getattr(route, "app", None): route.path
+                for route in scope["app"].routes
+            }
+        return self._route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500  # in case the app raises an exception before responding
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels()
+        in_flight.inc()
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - started_at
+            in_flight.dec()
+
+            # Note: The router stores the matched route's endpoint in the scope (which we share with it).
+            route_path = self._get_route_path(scope)
+            HTTP_REQUESTS_TOTAL.labels(scope["method"], route_path, str(status_code)).inc()
+            HTTP_REQUEST_DURATION_SECONDS.observe(duration, scope["method"], route_path)
@@ -0,0 +1,325 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import urlencode
+
+import httpx
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, RedirectResponse
+
+from nmdc_orcid_creditor.wire_format import encode_credits
+
+
+def make_orcid_id(index: int) -> str:
+    r"""
+    Returns a (fake) ORCID ID derived from the specified number.
+
+    >>> make_orcid_id(1234)
+    '0000-0000-0000-1234'
+    """
+
+    digits = f"{index:016d}"
+    return "-".join(digits[i : i + 4] for i in range(0, 16, 4))
+
+
+class MockProxy:
+    r"""
+    A local stand-in for the NMDC ORCID Creditor Proxy (the Google Apps Script web app), which serves a sheet of
+    `num_rows` synthetic credits spread evenly across `num_users` ORCID IDs.
+
+    Each request is delayed by `latency_seconds`; and a fraction (`error_rate`) of requests fail the way the real
+    proxy fails (i.e. with an HTTP 200 response whose JSON payload contains an error message instead of credits).
+    Like the real proxy, it responds in the wire format the request specifies (see `wire_format.py`).
+
+    >>> proxy = MockProxy(num_rows=4, num_users=2)
+    >>> transport = httpx.ASGITransport(app=proxy.app)
+    >>> async def fetch():
+    ...     async with httpx.AsyncClient(transport=transport, base_url="https://proxy.test") as client:
+    ...         return (await client.get("/exec", params={"orcid_id": make_orcid_id(1)})).json()
+    >>> [credit["column.CREDIT_TYPE"] for credit in asyncio.run(fetch())["credits"]]
+    ['Ambassador 1', 'Ambassador 3']
+    """
+
+    def __init__(
+        self,
+        num_rows: int = 1000,
+        num_users: int = 100,
+        latency_seconds: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency_seconds = latency_seconds
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.credits_by_orcid_id: dict[str, list[dict]] = {}
+        for row_index in range(num_rows):
+            orcid_id = make_orcid_id(row_index % num_users)
+            self.credits_by_orcid_id.setdefault(orcid_id, []).append(
+                {
+                    "column.ORCID_ID": orcid_id,
+                    "column.CREDIT_TYPE": f"Ambassador {row_index}",
+                    "column.AFFILIATION_TYPE": "service",
+                    "column.START_DATE": "2023-01-01T08:00:00.000Z",
+                    "column.END_DATE": "2023-12-31T08:00:00.000Z",
+                    "column.DETAILS_URL": "",
+                    "column.CLAIMED_AT": "",
+                    "column.AFFILIATION_PUT_CODE": "",
+                }
+            )
+        self.num_claims = 0
+        self.app = self._create_app()
+
+    def _claim(self, orcid_id: str, credit_type: str, start_date: str, end_date: str, put_code: str) -> None:
+        credits = [
+            credit
+            for credit in self.credits_by_orcid_id.get(orcid_id, [])
+            if credit["column.CREDIT_TYPE"] == credit_type
+            and credit["column.START_DATE"] == start_date
+            and credit["column.END_DATE"] == end_date
+        ]
+
+        # Like the proxy, treat a claim that has already been recorded (e.g. a retry) as having succeeded.
+        if any(
+            credit["column.CLAIMED_AT"] != "" and credit["column.AFFILIATION_PUT_CODE"] == put_code
+            for credit in credits
+        ):
+            return
+        for credit in credits:
+            if credit["column.CLAIMED_AT"] == "":
+                credit["column.CLAIMED_AT"] = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+                credit["column.AFFILIATION_PUT_CODE"] = put_code
+                self.num_claims += 1
+                break
+
+    async def _respond(self, payload_factory) -> Response:
+        await asyncio.sleep(self.latency_seconds)
+        if self._random.random() < self.error_rate:
+            return JSONResponse({"error": "Service unavailable. Try again later."})
+        return JSONResponse(payload_factory())
+
+    def _create_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.get("/exec")
+        async def get_exec(
+            orcid_id: str = "",
+            action: str = "",
+            since_version: str = "",
+            offset: int = 0,
+            limit: Optional[int] = None,
+            format: str = "objects",
+            columns: str = "",
+        ):
+            column_names = columns.split(",") if columns else None
+            if action == "export":
+
+                def export() -> dict:
+                    credits = list(itertools.chain.from_iterable(self.credits_by_orcid_id.values()))
+                    version = hashlib.sha256(json.dumps(credits).encode("utf-8")).hexdigest()
+                    total = len(credits)
+                    snapshot = {"version": version, "unchanged": version == since_version, "total": total}
+                    if snapshot["unchanged"]:
+                        return {**snapshot, **encode_credits([], format), "next_offset": None}
+                    end = total if limit is None else min(total, offset + limit)
+                    page = encode_credits(credits[offset:end], format, column_names)
+                    return {**snapshot, **page, "next_offset": end if end < total else None}
+
+                return await self._respond(export)
+            return await self._respond(
+                lambda: {"orcid_id": orcid_id, **encode_credits(self.credits_by_orcid_id.get(orcid_id, []), format)}
+            )
+
+        @app.post("/exec")
+        async def post_exec(request: Request):
+            params = request.query_params
+            orcid_id = params.get("orcid_id", "")
+            if params.get("action") == "claim_batch":
+                claims = (await request.json())["claims"]
+            else:
+                claims = [params]
+
+            def claim() -> dict:
+                for c in claims:
+                    self._claim(orcid_id, c["credit_type"], c["start_date"], c["end_date"], c["affiliation_put_code"])
+                credits = self.credits_by_orcid_id.get(orcid_id, [])
+                return {"orcid_id": orcid_id, **encode_credits(credits, params.get("format", "objects"))}
+
+            return await self._respond(claim)
+
+        return app
+
+
+class MockOrcid:
+    r"""
+    A local stand-in for ORCID's OAuth endpoints (`/oauth/authorize` and `/oauth/token`) and for the ORCID API's
+    endpoints for creating affiliations (`/v3.0/{orcid_id}/{affiliation_type}`) and for summarizing a record's
+    activities, including its affiliations (`/v3.0/{orcid_id}/activities`).
+
+    The authorization endpoint signs in "users" having the ORCID IDs of `MockProxy`'s users, in turn; and redirects
+    the client back to the app right away (i.e. without displaying a login page). The token endpoint also issues
+    "/read-public" tokens, via the client credentials grant.
+
+    Each request is delayed by `latency_seconds`; and a fraction (`error_rate`) of requests to create or list
+    affiliations fail (with an HTTP 500 response).
+
+    >>> orcid = MockOrcid()
+    >>> put_code = orcid.add_affiliation("0000-0000-0000-0001", "service", "Ambassador 2023", "2023-01-01", None)
+    >>> transport = httpx.ASGITransport(app=orcid.app)
+    >>> async def fetch():
+    ...     async with httpx.AsyncClient(transport=transport, base_url="https://pub.orcid.test") as client:
+    ...         return (await client.get("/v3.0/0000-0000-0000-0001/activities")).json()
+    >>> summary = asyncio.run(fetch())["services"]["affiliation-group"][0]["summaries"][0]["service-summary"]
+    >>> summary["put-code"] == put_code, summary["start-date"]["year"]["value"], summary["end-date"]
+    (True, '2023', None)
+    """
+
+    def __init__(
+        self,
+        num_users: int = 100,
+        latency_seconds: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        client_id: str = "APP-MOCK",
+    ):
+        self.num_users = num_users
+        self.latency_seconds = latency_seconds
+        self.error_rate = error_rate
+        self.client_id = client_id
+        self._random = random.Random(seed)
+        self._user_indexes = itertools.cycle(range(num_users))
+        self._orcid_ids_by_code: dict[str, str] = {}
+        self._code_numbers = itertools.count()
+        self._put_codes = itertools.count(10000)
+        self.affiliations: dict[str, list[dict]] = {}  # ORCID ID -> affiliation summaries (in ORCID's format)
+        self.num_activities_requests = 0
+        self.app = self._create_app()
+
+    def add_affiliation(
+        self,
+        orcid_id: str,
+        affiliation_type: str,
+        role_title: str,
+        start_date: Optional[str],
+        end_date: Optional[str],
+        source_client_id: Optional[str] = None,
+    ) -> int:
+        r"""
+        Adds an affiliation (e.g. one created by the app, or by someone else if `source_client_id` differs from
+        this service's `client_id`) to the specified ORCID record, and returns its put-code. Dates are "YYYY-MM-DD".
+        """
+
+        def to_fuzzy_date(date: Optional[str]) -> Optional[dict]:
+            if date is None:
+                return None
+            year, month, day = date.split("-")
+            return {"year": {"value": year}, "month": {"value": month}, "day": {"value": day}}
+
+        put_code = next(self._put_codes)
+        summary = {
+            "put-code": put_code,
+            "role-title": role_title,
+            "start-date": to_fuzzy_date(start_date),
+            "end-date": to_fuzzy_date(end_date),
+            "organization": {"name": "National Microbiome Data Collaborative"},
+            "source": {"source-client-id": {"path": source_client_id or self.client_id}},
+        }
+        self.affiliations.setdefault(orcid_id, []).append({"affiliation_type": affiliation_type, "summary": summary})
+        return put_code
+
+    def _create_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.get("/oauth/authorize")
+        async def authorize(redirect_uri: str, state: str = ""):
+            await asyncio.sleep(self.latency_seconds)
+            code = f"code-{next(self._code_numbers)}"
+            self._orcid_ids_by_code[code] = make_orcid_id(next(self._user_indexes))
+            return RedirectResponse(f"{redirect_uri}?{urlencode({'code': code, 'state': state})}", status_code=302)
+
+        @app.post("/oauth/token")
+        async def token(request: Request):
+            await asyncio.sleep(self.latency_seconds)
+            form = await request.form()
+            if form.get("grant_type") == "client_credentials":
+                return JSONResponse(
+                    {"access_token": "read-public-token", "token_type": "bearer", "scope": "/read-public"}
+                )
+            orcid_id: Optional[str] = self._orcid_ids_by_code.pop(str(form.get("code", "")), None)
+            if orcid_id is None:
+                return JSONResponse({"error": "invalid_grant"}, status_code=400)
+            return JSONResponse(
+                {
+                    "access_token": f"access-token-{orcid_id}",
+                    "token_type": "bearer",
+                    "refresh_token": f"refresh-token-{orcid_id}",
+                    "expires_in": 631138518,
+                    "scope": "/activities/update",
+                    "name": f"User {orcid_id}",
+                    "orcid": orcid_id,
+                }
+            )
+
+        @app.post("/v3.0/{orcid_id}/{affiliation_type}")
+        async def create_affiliation(request: Request, orcid_id: str, affiliation_type: str):
+            await asyncio.sleep(self.latency_seconds)
+            if self._random.random() < self.error_rate:
+                return JSONResponse({"user-message": "Something went wrong."}, status_code=500)
+            payload = await request.json()
+            dates = [payload.get(key) for key in ("start-date", "end-date")]
+            start_date, end_date = [
+                None if d is None else "-".join(d[part]["value"] for part in ("year", "month", "day")) for d in dates
+            ]
+            put_code = self.add_affiliation(orcid_id, affiliation_type, payload["role-title"], start_date, end_date)
+            location = f"https://api.sandbox.orcid.org/v3.0/{orcid_id}/{affiliation_type}/{put_code}"
+            return Response(status_code=201, headers={"location": location})
+
+        @app.get("/v3.0/{orcid_id}/activities")
+        async def get_activities(orcid_id: str):
+            await asyncio.sleep(self.latency_seconds)
+            self.num_activities_requests += 1
+            if self._random.random() < self.error_rate:
+                return JSONResponse({"user-message": "Something went wrong."}, status_code=500)
+            activities = {}
+            for affiliation_type in ("membership", "service"):
+                groups = [
+                    {"summaries": [{f"{affiliation_type}-summary": affiliation["summary"]}]}
+                    for affiliation in self.affiliations.get(orcid_id, [])
+                    if affiliation["affiliation_type"] == affiliation_type
+                ]
+                activities[f"{affiliation_type}s"] = {"affiliation-group": groups}
+            return JSONResponse(activities)
+
+        return app
+
+
+class HostRoutingTransport(httpx.AsyncBaseTransport):
+    r"""
+    An HTTP transport that sends each request to the ASGI app mapped to the request's host (or to a suffix of it,
+    such as "orcid.org"); and refuses to send requests to any other host, so that nothing reaches the network.
+
+    >>> transport = HostRoutingTransport({"orcid.org": MockOrcid().app})
+    >>> async def send(url):
+    ...     async with httpx.AsyncClient(transport=transport) as client:
+    ...         return await client.post(url, json={"role-title": "Ambassador 2023"})
+    >>> asyncio.run(send("https://api.sandbox.orcid.org/v3.0/0000-0000-0000-0001/service")).status_code
+    201
+    >>> asyncio.run(send("https://example.com/"))
+    Traceback (most recent call last):
+    ...
+    httpx.ConnectError: No mock service is mapped to host: example.com
+    """
+
+    def __init__(self, apps_by_host: dict):
+        self.apps_by_host = apps_by_host
+        self._transports = {host: httpx.ASGITransport(app=app) for host, app in apps_by_host.items()}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        for mapped_host, transport in self._transports.items():
+            if host == mapped_host or host.endswith(f".{mapped_host}"):
+                return await transport.handle_async_request(request)
+        raise httpx.ConnectError(f"No mock service is mapped to host: {host}", request=request)
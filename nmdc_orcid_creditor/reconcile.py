@@ -0,0 +1,368 @@
+r"""
+A command-line tool that reconciles the claims recorded in the Google Sheets document with the affiliations on the
+claimants' ORCID records; and reports the discrepancies it finds, one JSON object per line (JSONL):
+
+- "missing":          A row has a put-code, but the ORCID record has no affiliation having that put-code (e.g. the
+                      person deleted it, or made it private).
+- "mismatched_dates": A row has a put-code, but the dates of the affiliation having that put-code differ from the
+                      row's dates.
+- "orphaned":         The ORCID record has an affiliation the app created, whose put-code is not on any of the
+                      person's rows (e.g. the app failed to record the claim).
+- "error":            The tool could not read (or compare the credits with) the ORCID record.
+
+The tool reads the sheet one page at a time (via the proxy's "export" action) and, meanwhile, reads the ORCID record
+of each ORCID ID it encounters via ORCID's public API; using a bounded pool of workers, whose requests (together) are
+rate-limited to stay within ORCID's limits.
+
+Note: The tool gets a "/read-public" access token via the client credentials grant, using the app's ORCID client
+      ID and secret. It reads only public information, so affiliations people have made private appear "missing".
+
+Reference: https://info.orcid.org/documentation/features/public-api/
+
+Usage:
+    $ poetry run python -m nmdc_orcid_creditor.reconcile --output report.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import Counter
+from contextlib import nullcontext
+from typing import Callable, Optional
+
+import httpx
+
+from nmdc_orcid_creditor.config import Config, cfg
+from nmdc_orcid_creditor.credit_store import ProxyCreditStore
+from nmdc_orcid_creditor.helpers import extract_year_month_day_from_datetime_string
+from nmdc_orcid_creditor.http_client import create_http_client
+from nmdc_orcid_creditor.resilience import RetryPolicy, TokenBucket
+
+AFFILIATION_TYPES = ("membership", "service")
+
+
+def normalize_put_code(value) -> str:
+    r"""
+    Returns the specified put-code (which the sheet may store as a string or as a number) as a string.
+
+    >>> normalize_put_code(12345), normalize_put_code(12345.0), normalize_put_code(" 12345 "), normalize_put_code("")
+    ('12345', '12345', '12345', '')
+    """
+
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def format_sheet_date(date_str: str) -> Optional[str]:
+    r"""
+    Returns the date (in the "YYYY-MM-DD" format) the app would put on an affiliation, given the specified date string
+    from the sheet; or `None` if the string is empty. Unparsable strings are returned as is.
+
+    >>> format_sheet_date("2023-01-23T08:00:00.000Z"), format_sheet_date(""), format_sheet_date("soon")
+    ('2023-01-23', None, 'soon')
+    """
+
+    date_str = str(date_str).strip()
+    if date_str == "":
+        return None
+    try:
+        return "-".join(extract_year_month_day_from_datetime_string(date_str))
+    except ValueError:
+        return date_str
+
+
+def format_orcid_date(fuzzy_date: Optional[dict]) -> Optional[str]:
+    r"""
+    Returns the specified ORCID "fuzzy date" (whose month and day are optional) as a "YYYY[-MM[-DD]]" string; or
+    `None` if there is no date.
+
+    >>> format_orcid_date({"year": {"value": "2023"}, "month": {"value": "01"}, "day": None})
+    '2023-01'
+    >>> format_orcid_date(None) is None
+    True
+    """
+
+    if fuzzy_date is None:
+        return None
+    parts = [(fuzzy_date.get(part) or {}).get("value") for part in ("year", "month", "day")]
+    return "-".join(part for part in parts if part) or None
+
+
+def extract_affiliation_summaries(activities: dict) -> list[tuple[str, dict]]:
+    r"""
+    Returns the (affiliation type, summary) pairs of the memberships and services in the specified payload of the
+    ORCID API's "activities" endpoint.
+
+    >>> activities = {"services": {"affiliation-group": [{"summaries": [{"service-summary": {"put-code": 1}}]}]}}
+    >>> extract_affiliation_summaries(activities)
+    [('service', {'put-code': 1})]
+    """
+
+    pairs = []
+    for affiliation_type in AFFILIATION_TYPES:
+        section = activities.get(f"{affiliation_type}s") or {}
+        for group in section.get("affiliation-group") or []:
+            for summary in group.get("summaries") or []:
+                pairs.append((affiliation_type, summary[f"{affiliation_type}-summary"]))
+    return pairs
+
+
+def diff_record(orcid_id: str, credits: list[dict], activities: dict, client_id: str) -> list[dict]:
+    r"""
+    Compares the specified ORCID ID's credits (i.e. rows of the sheet) with the affiliations on their ORCID record,
+    and returns the discrepancies. Affiliations whose source is the ORCID client having `client_id` are considered to
+    have been created by the app.
+
+    >>> credit = {"column.CREDIT_TYPE": "Ambassador", "column.AFFILIATION_TYPE": "service",
+    ...           "column.START_DATE": "2023-01-01", "column.END_DATE": "", "column.AFFILIATION_PUT_CODE": 1}
+    >>> summary = {"put-code": 1, "start-date": {"year": {"value": "2022"}}, "end-date": None,
+    ...            "source": {"source-client-id": {"path": "APP-1"}}}
+    >>> activities = {"services": {"affiliation-group": [{"summaries": [{"service-summary": summary}]}]}}
+    >>> [entry["kind"] for entry in diff_record("0000-0000-0000-0001", [credit], activities, "APP-1")]
+    ['mismatched_dates']
+    """
+
+    affiliations = {normalize_put_code(s["put-code"]): (t, s) for t, s in extract_affiliation_summaries(activities)}
+    entries = []
+    recorded_put_codes = set()
+    for credit in credits:
+        put_code = normalize_put_code(credit.get("column.AFFILIATION_PUT_CODE", ""))
+        if put_code == "":
+            continue
+        recorded_put_codes.add(put_code)
+        entry = {
+            "orcid_id": orcid_id,
+            "affiliation_type": credit.get("column.AFFILIATION_TYPE", ""),
+            "put_code": put_code,
+            "credit_type": credit.get("column.CREDIT_TYPE", ""),
+            "sheet_dates": {
+                "start": format_sheet_date(credit.get("column.START_DATE", "")),
+                "end": format_sheet_date(credit.get("column.END_DATE", "")),
+            },
+        }
+        if put_code not in affiliations:
+            entries.append({"kind": "missing", **entry})
+            continue
+        _, summary = affiliations[put_code]
+        orcid_dates = {
+            "start": format_orcid_date(summary.get("start-date")),
+            "end": format_orcid_date(summary.get("end-date")),
+        }
+        if orcid_dates != entry["sheet_dates"]:
+            entries.append({"kind": "mismatched_dates", **entry, "orcid_dates": orcid_dates})
+
+    for put_code, (affiliation_type, summary) in affiliations.items():
+        source_client_id = ((summary.get("source") or {}).get("source-client-id") or {}).get("path")
+        if source_client_id == client_id and put_code not in recorded_put_codes:
+            entries.append(
+                {
+                    "kind": "orphaned",
+                    "orcid_id": orcid_id,
+                    "affiliation_type": affiliation_type,
+                    "put_code": put_code,
+                    "role_title": summary.get("role-title"),
+                    "orcid_dates": {
+                        "start": format_orcid_date(summary.get("start-date")),
+                        "end": format_orcid_date(summary.get("end-date")),
+                    },
+                }
+            )
+    return entries
+
+
+async def get_read_public_access_token(http_client: httpx.AsyncClient, config: Config) -> str:
+    r"""
+    Gets an access token for reading public information via ORCID's public API, via the client credentials grant.
+
+    Reference: https://info.orcid.org/documentation/api-tutorials/api-tutorial-read-data-on-a-record/
+    """
+
+    response = await http_client.post(
+        config.ORCID_ACCESS_TOKEN_URL,
+        headers={"Accept": "application/json"},
+        data={
+            "client_id": config.ORCID_CLIENT_ID,
+            "client_secret": config.ORCID_CLIENT_SECRET,
+            "grant_type": "client_credentials",
+            "scope": "/read-public",
+        },
+    )
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+class Reconciler:
+    r"""
+    Reconciles the credits in the Google Sheets document (read via `credit_store`) with the affiliations on ORCID
+    records (read via ORCID's public API), writing each discrepancy it finds via `write_entry`.
+
+    Note: Up to `concurrency` ORCID records are read at a time, and no faster than `rate_limiter` allows. Failed
+          reads (including ones ORCID rejects because of its own rate limits) are retried per `retry_policy`.
+    """
+
+    def __init__(
+        self,
+        credit_store: ProxyCreditStore,
+        http_client: httpx.AsyncClient,
+        public_api_base_url: str,
+        access_token: str,
+        client_id: str,
+        concurrency: int,
+        rate_limiter: TokenBucket,
+        retry_policy: RetryPolicy,
+        page_size: int,
+    ):
+        self.credit_store = credit_store
+        self.http_client = http_client
+        self.public_api_base_url = public_api_base_url
+        self.access_token = access_token
+        self.client_id = client_id
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.page_size = page_size
+        self.num_requests = 0
+
+    async def fetch_activities(self, orcid_id: str) -> dict:
+        r"""Returns the summary of the activities (including the affiliations) on the specified ORCID record"""
+
+        attempt = 1
+        while True:
+            await self.rate_limiter.acquire()
+            self.num_requests += 1
+            try:
+                response = await self.http_client.get(
+                    f"{self.public_api_base_url}/{orcid_id}/activities",
+                    headers={"Accept": "application/json", "Authorization": f"Bearer {self.access_token}"},
+                )
+                response.raise_for_status()
+                return response.json()
+            except (httpx.HTTPError, ValueError) as error:
+                # Note: Don't retry requests ORCID rejected for reasons (e.g. an invalid ORCID ID) other than load.
+                if isinstance(error, httpx.HTTPStatusError) and not (
+                    error.response.status_code == 429 or error.response.status_code >= 500
+                ):
+                    raise
+                if attempt >= self.retry_policy.max_attempts:
+                    raise
+                delay = self.retry_policy.get_delay(attempt)
+                if isinstance(error, httpx.HTTPStatusError):
+                    retry_after = error.response.headers.get("retry-after", "")
+                    delay = max(delay, float(retry_after)) if retry_after.isdigit() else delay
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def run(self, write_entry: Callable[[dict], None]) -> dict:
+        r"""Reconciles all the credits, and returns statistics about the run"""
+
+        started_at = time.perf_counter()
+        credits_by_orcid_id: dict[str, list[dict]] = {}
+        unprocessed_activities: dict[str, dict] = {}  # activities fetched before the whole sheet was read
+        is_sheet_read = False
+        num_rows = 0
+        kinds: Counter = Counter()
+
+        # Note: The queue is bounded, so that reading the sheet pauses (instead of using more and more memory) when
+        #       the workers fall behind.
+        queue: asyncio.Queue[str] = asyncio.Queue(maxsize=self.concurrency * 4)
+
+        def write_entries(entries: list[dict]) -> None:
+            for entry in entries:
+                kinds[entry["kind"]] += 1
+                write_entry(entry)
+
+        def process(orcid_id: str, activities: dict) -> None:
+            write_entries(diff_record(orcid_id, credits_by_orcid_id[orcid_id], activities, self.client_id))
+
+        async def work() -> None:
+            while True:
+                orcid_id = await queue.get()
+                try:
+                    activities = await self.fetch_activities(orcid_id)
+                    # Note: We can't compare an ORCID ID's credits with their record until we have read all of their
+                    #       credits (i.e. the whole sheet), so we set aside the records we read before then.
+                    if is_sheet_read:
+                        process(orcid_id, activities)
+                    else:
+                        unprocessed_activities[orcid_id] = activities
+                except Exception as error:
+                    # Note: We report the error and move on to the next ORCID ID, rather than abort the whole run.
+                    write_entries([{"kind": "error", "orcid_id": orcid_id, "detail": repr(error)}])
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(work()) for _ in range(self.concurrency)]
+        try:
+            async for page in self.credit_store.iter_credit_pages(self.page_size):
+                num_rows += len(page)
+                for credit in page:
+                    orcid_id = str(credit.get("column.ORCID_ID", "")).strip()
+                    if orcid_id == "":
+                        continue
+                    if orcid_id not in credits_by_orcid_id:
+                        credits_by_orcid_id[orcid_id] = []
+                        await queue.put(orcid_id)
+                    credits_by_orcid_id[orcid_id].append(credit)
+
+            is_sheet_read = True
+            for orcid_id, activities in unprocessed_activities.items():
+                process(orcid_id, activities)
+            unprocessed_activities.clear()
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        return {
+            "num_rows": num_rows,
+            "num_orcid_ids": len(credits_by_orcid_id),
+            "num_orcid_requests": self.num_requests,
+            "num_entries_by_kind": dict(kinds),
+            "duration_seconds": round(time.perf_counter() - started_at, 3),
+        }
+
+
+def main_cli(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Reconcile the claims in the sheet with the affiliations on ORCID.")
+    parser.add_argument("--output", help="file to write the JSONL report to (default: standard output)")
+    parser.add_argument("--page-size", type=int, default=1000, help="rows to read from the sheet per request")
+    parser.add_argument("--concurrency", type=int, default=16, help="ORCID records to read at a time")
+    parser.add_argument("--rate-limit", type=float, default=20.0, help="requests per second to ORCID's public API")
+    parser.add_argument("--burst", type=int, default=20, help="requests to ORCID's public API allowed in a burst")
+    parser.add_argument("--max-attempts", type=int, default=5, help="attempts to read each ORCID record")
+    args = parser.parse_args(argv)
+
+    async def reconcile() -> dict:
+        async with create_http_client(cfg) as http_client:
+            credit_store = ProxyCreditStore(
+                http_client,
+                proxy_url=cfg.NMDC_ORCID_CREDITOR_PROXY_URL,
+                shared_secret=cfg.NMDC_ORCID_CREDITOR_PROXY_SHARED_SECRET,
+                read_retry_policy=RetryPolicy(args.max_attempts, base_delay_seconds=1.0, max_delay_seconds=30.0),
+                wire_format=cfg.PROXY_WIRE_FORMAT,
+            )
+            reconciler = Reconciler(
+                credit_store,
+                http_client,
+                public_api_base_url=cfg.ORCID_PUBLIC_API_BASE_URL,
+                access_token=await get_read_public_access_token(http_client, cfg),
+                client_id=cfg.ORCID_CLIENT_ID,
+                concurrency=args.concurrency,
+                rate_limiter=TokenBucket(args.rate_limit, burst=args.burst),
+                retry_policy=RetryPolicy(args.max_attempts, base_delay_seconds=0.5, max_delay_seconds=30.0),
+                page_size=args.page_size,
+            )
+            with open(args.output, "w") if args.output else nullcontext(sys.stdout) as f:
+                return await reconciler.run(lambda entry: f.write(json.dumps(entry) + "\n"))
+
+    stats = asyncio.run(reconcile())
+    print(json.dumps(stats, indent=2), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
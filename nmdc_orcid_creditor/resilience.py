@@ -0,0 +1,416 @@
+import asyncio
+import math
+import random
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Hashable, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from nmdc_orcid_creditor.credits_cache import TTLCache
+from nmdc_orcid_creditor.metrics import (
+    ADMISSION_QUEUE_DEPTH,
+    ADMISSION_REJECTIONS_TOTAL,
+    ADMISSION_WAIT_SECONDS,
+    CIRCUIT_BREAKER_STATE,
+)
+
+
+class UpstreamUnavailableError(Exception):
+    r"""Raised instead of sending a request to an upstream service, when the request would be futile"""
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    r"""Raised when a circuit breaker is rejecting requests to an upstream service that has been failing"""
+
+
+class DeadlineExceededError(UpstreamUnavailableError):
+    r"""Raised when the current request's deadline budget has run out"""
+
+
+class AdmissionRejectedError(Exception):
+    r"""Raised when a request is turned away because too many requests are waiting for their turn already"""
+
+    def __init__(self, message: str, retry_after_seconds: float):
+        super().__init__(message)
+        self.retry_after_seconds = retry_after_seconds
+
+
+# The time (per `time.monotonic`) by which the request the app is handling in the current context has to be handled.
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+def get_remaining_budget_seconds() -> Optional[float]:
+    r"""Returns the time remaining in the current request's deadline budget, or `None` if there is no such budget"""
+
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def get_attempt_timeout(max_seconds: float) -> float:
+    r"""
+    Returns the number of seconds an attempt to send a request to an upstream service can take, which is the lesser
+    of `max_seconds` and the time remaining in the current request's deadline budget (if any).
+
+    Note: This function raises a `DeadlineExceededError` if the current request's deadline budget has run out.
+
+    >>> get_attempt_timeout(10.0)  # no deadline budget
+    10.0
+    >>> token = _deadline.set(time.monotonic() + 2.0)
+    >>> get_attempt_timeout(10.0) <= 2.0
+    True
+    >>> _deadline.reset(token)
+    """
+
+    remaining_seconds = get_remaining_budget_seconds()
+    if remaining_seconds is None:
+        return max_seconds
+    if remaining_seconds <= 0:
+        raise DeadlineExceededError("The request's deadline budget has run out")
+    return min(max_seconds, remaining_seconds)
+
+
+class RequestDeadlineMiddleware:
+    r"""
+    Gives each request an overall deadline budget of `budget_seconds`, which bounds the timeouts (and retries) of
+    the requests the app sends to upstream services while handling it (see `get_attempt_timeout`).
+    """
+
+    def __init__(self, app: ASGIApp, budget_seconds: float, excluded_path_prefixes: tuple[str, ...] = ("/static/",)):
+        self.app = app
+        self.budget_seconds = budget_seconds
+        self.excluded_path_prefixes = excluded_path_prefixes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(self.excluded_path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        token = _deadline.set(time.monotonic() + self.budget_seconds)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
+
+
+class RetryPolicy:
+    r"""
+    How many times to attempt an idempotent request to an upstream service, and how long to wait between attempts.
+
+    The delays grow exponentially, and are "fully jittered" (i.e. chosen at random between zero and the exponentially
+    growing cap), so that clients that failed at the same moment don't all retry at the same moment, too.
+
+    Reference: https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+
+    >>> policy = RetryPolicy(max_attempts=3, base_delay_seconds=0.5, max_delay_seconds=1.0, rng=random.Random(0))
+    >>> [0.0 <= policy.get_delay(attempt) <= min(1.0, 0.5 * 2 ** (attempt - 1)) for attempt in (1, 2, 3)]
+    [True, True, True]
+    """
+
+    def __init__(
+        self,
+        max_attempts: int,
+        base_delay_seconds: float,
+        max_delay_seconds: float,
+        rng: Optional[random.Random] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._rng = rng or random.Random()
+
+    def get_delay(self, attempt: int) -> float:
+        r"""Returns the number of seconds to wait after the specified (1-based) attempt failed"""
+
+        return self._rng.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    r"""
+    Keeps track of the health of an upstream service, and rejects requests to it while it is unhealthy; so that the
+    app fails fast, instead of tying up connections (and users) waiting for a service that is likely to fail anyway.
+
+    - "closed":    Requests are allowed. After `failure_threshold` consecutive failures, the breaker opens.
+    - "open":      Requests are rejected (with a `CircuitOpenError`). After `reset_timeout_seconds`, the breaker
+                   becomes half-open.
+    - "half_open": A single trial request is allowed. If it succeeds, the breaker closes; otherwise, it opens again.
+
+    Use it as a context manager around a request, which counts as having failed if it raises an `Exception`.
+
+    >>> now = 0.0
+    >>> breaker = CircuitBreaker("example", failure_threshold=2, reset_timeout_seconds=30, clock=lambda: now)
+    >>> for _ in range(2):
+    ...     try:
+    ...         with breaker:
+    ...             raise TimeoutError()
+    ...     except TimeoutError:
+    ...         pass
+    >>> breaker.state
+    'open'
+    >>> with breaker:
+    ...     pass
+    Traceback (most recent call last):
+    ...
+    nmdc_orcid_creditor.resilience.CircuitOpenError: The circuit breaker for example is open
+    >>> now = 30.0
+    >>> breaker.state
+    'half_open'
+    >>> with breaker:  # the trial request succeeds
+    ...     pass
+    >>> breaker.state
+    'closed'
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_timeout_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self._clock = clock
+        self._is_open = False
+        self._opened_at = 0.0
+        self._is_trial_in_progress = False
+        self.consecutive_failures = 0
+        self.num_rejections = 0
+        self.report_state()
+
+    @property
+    def state(self) -> str:
+        if not self._is_open:
+            return self.CLOSED
+        if self._clock() >= self._opened_at + self.reset_timeout_seconds:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def report_state(self) -> None:
+        r"""Updates the gauge (see the `/metrics` endpoint) that reflects the breaker's state"""
+
+        CIRCUIT_BREAKER_STATE.labels(self.name).set({self.CLOSED: 0, self.HALF_OPEN: 1, self.OPEN: 2}[self.state])
+
+    def __enter__(self) -> "CircuitBreaker":
+        state = self.state
+        if state == self.OPEN or (state == self.HALF_OPEN and self._is_trial_in_progress):
+            self.num_rejections += 1
+            raise CircuitOpenError(f"The circuit breaker for {self.name} is open")
+        if state == self.HALF_OPEN:
+            self._is_trial_in_progress = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._is_trial_in_progress = False
+        if exc_type is None:
+            self.consecutive_failures = 0
+            self._is_open = False
+        elif issubclass(exc_type, Exception):
+            self.consecutive_failures += 1
+            if self._is_open or self.consecutive_failures >= self.failure_threshold:
+                self._is_open = True
+                self._opened_at = self._clock()
+        # Note: Otherwise (e.g. the request was cancelled), the request tells us nothing about the service's health.
+        self.report_state()
+
+    def stats(self) -> dict:
+        r"""Returns the breaker's state and counters"""
+
+        return {
+            "name": self.name,
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "num_rejections": self.num_rejections,
+        }
+
+
+class TokenBucket:
+    r"""
+    Limits the rate of some operation (e.g. sending requests to an upstream service) to `rate_per_second` on
+    average, while allowing bursts of up to `burst` operations.
+
+    The bucket holds up to `burst` tokens, and is refilled at `rate_per_second` tokens per second. Each operation
+    takes a token; when the bucket is empty, the operation has to wait (or be rejected).
+
+    Reference: https://en.wikipedia.org/wiki/Token_bucket
+
+    >>> now = 0.0
+    >>> bucket = TokenBucket(rate_per_second=2, burst=2, clock=lambda: now)
+    >>> bucket.try_acquire(), bucket.try_acquire(), bucket.try_acquire()
+    (True, True, False)
+    >>> bucket.get_wait_seconds()
+    0.5
+    >>> now = 0.5
+    >>> bucket.try_acquire()
+    True
+    """
+
+    def __init__(self, rate_per_second: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._refilled_at = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate_per_second)
+        self._refilled_at = now
+
+    def try_acquire(self) -> bool:
+        r"""Takes a token and returns `True`, if one is available; otherwise, returns `False`"""
+
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def get_wait_seconds(self) -> float:
+        r"""Returns the number of seconds until a token will be available"""
+
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate_per_second)
+
+    async def acquire(self) -> None:
+        r"""Takes a token, waiting until one is available"""
+
+        while not self.try_acquire():
+            await asyncio.sleep(self.get_wait_seconds())
+
+
+class KeyedRateLimiter:
+    r"""
+    Limits the rate of some operation separately for each key (e.g. each ORCID ID), via a `TokenBucket` per key.
+
+    Note: A bucket that has been idle long enough to refill completely is equivalent to a new one; so we only keep
+          buckets for that long (and only for the `max_keys` most recently used keys), which bounds memory usage.
+
+    >>> now = 0.0
+    >>> limiter = KeyedRateLimiter(rate_per_second=1, burst=2, clock=lambda: now)
+    >>> [limiter.get_wait_seconds("a") for _ in range(3)], limiter.get_wait_seconds("b")
+    ([0.0, 0.0, 1.0], 0.0)
+    """
+
+    def __init__(
+        self, rate_per_second: float, burst: int, max_keys: int = 10000, clock: Callable[[], float] = time.monotonic
+    ):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self._clock = clock
+        is_enabled = rate_per_second > 0 and burst > 0
+        self._buckets = TTLCache(ttl_seconds=burst / rate_per_second if is_enabled else 0, max_entries=max_keys)
+        self.is_enabled = is_enabled
+
+    def get_wait_seconds(self, key: Hashable) -> float:
+        r"""
+        Takes a token from the key's bucket and returns `0.0`, if one is available; otherwise, returns the number of
+        seconds until one will be. If the limiter is disabled (i.e. its rate or burst is 0), this always returns `0.0`.
+        """
+
+        if not self.is_enabled:
+            return 0.0
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate_per_second, self.burst, clock=self._clock)
+        self._buckets.set(key, bucket)  # renews the entry, since the bucket is in use
+        return 0.0 if bucket.try_acquire() else bucket.get_wait_seconds()
+
+
+class AdmissionController:
+    r"""
+    Limits the number of concurrent requests to an upstream service (e.g. the proxy, which Apps Script limits to a
+    few dozen concurrent executions) to `max_concurrency`; and the number of requests waiting for their turn to
+    `max_queue_length`. Further requests are turned away with an `AdmissionRejectedError` (unless they can't be
+    turned away), rather than letting the queue, and the time requests spend in it, grow without bound.
+
+    The rejection includes an estimate of when there will be room in the queue, based on how long recent requests
+    held their turn.
+
+    Note: Requests also stop waiting (raising a `DeadlineExceededError`) if the current request's deadline budget
+          runs out while they do.
+
+    >>> async def main():
+    ...     controller = AdmissionController("example", max_concurrency=1, max_queue_length=1)
+    ...     async def send():
+    ...         async with controller.admit():
+    ...             await asyncio.sleep(0.01)
+    ...     results = await asyncio.gather(send(), send(), send(), return_exceptions=True)
+    ...     return [type(result).__name__ for result in results], controller.stats()["num_rejections"]
+    >>> asyncio.run(main())
+    (['NoneType', 'NoneType', 'AdmissionRejectedError'], 1)
+    """
+
+    def __init__(
+        self, name: str, max_concurrency: int, max_queue_length: int, clock: Callable[[], float] = time.monotonic
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue_length = max_queue_length
+        self._clock = clock
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.num_active = 0
+        self.num_waiting = 0
+        self.num_rejections = 0
+        self.mean_hold_seconds = 0.0  # exponentially weighted moving average
+
+    def get_retry_after_seconds(self) -> int:
+        r"""Returns an estimate of the number of (whole) seconds until there will be room in the queue"""
+
+        return max(1, math.ceil(self.mean_hold_seconds * (self.num_waiting + 1) / self.max_concurrency))
+
+    @asynccontextmanager
+    async def admit(self, may_reject: bool = True) -> AsyncIterator[None]:
+        r"""
+        Waits for the request's turn, then runs the code in the `async with` block (i.e. sends the request). Raises an
+        `AdmissionRejectedError` if the queue is full, unless `may_reject` is `False` (e.g. for requests that record
+        something that has already happened elsewhere), in which case the request waits regardless.
+        """
+
+        if may_reject and self._semaphore.locked() and self.num_waiting >= self.max_queue_length:
+            self.num_rejections += 1
+            ADMISSION_REJECTIONS_TOTAL.labels(self.name).inc()
+            raise AdmissionRejectedError(
+                f"Too many requests to {self.name} are waiting already", self.get_retry_after_seconds()
+            )
+
+        started_waiting_at = self._clock()
+        queue_depth = ADMISSION_QUEUE_DEPTH.labels(self.name)
+        self.num_waiting += 1
+        queue_depth.inc()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=get_remaining_budget_seconds())
+        except TimeoutError:
+            raise DeadlineExceededError(f"Ran out of time waiting for a turn to send a request to {self.name}")
+        finally:
+            self.num_waiting -= 1
+            queue_depth.dec()
+
+        admitted_at = self._clock()
+        ADMISSION_WAIT_SECONDS.observe(admitted_at - started_waiting_at, self.name)
+        self.num_active += 1
+        try:
+            yield
+        finally:
+            self.num_active -= 1
+            self._semaphore.release()
+            self.mean_hold_seconds += 0.2 * ((self._clock() - admitted_at) - self.mean_hold_seconds)
+
+    def stats(self) -> dict:
+        r"""Returns the numbers of requests in progress and waiting, and the number of rejections so far"""
+
+        return {
+            "name": self.name,
+            "max_concurrency": self.max_concurrency,
+            "max_queue_length": self.max_queue_length,
+            "num_active": self.num_active,
+            "num_waiting": self.num_waiting,
+            "num_rejections": self.num_rejections,
+            "mean_hold_seconds": round(self.mean_hold_seconds, 3),
+        }
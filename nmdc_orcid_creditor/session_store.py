@@ -0,0 +1,336 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Literal, Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from nmdc_orcid_creditor.config import Config
+
+logger = logging.getLogger("uvicorn")
+
+
+class SessionStore(ABC):
+    r"""
+    A place where the server stores the contents of each session, keyed by session ID.
+
+    Each session expires `max_age_seconds` after it was last saved. Expired sessions are never returned; and,
+    once the store has been started, they are deleted in the background every `sweep_interval_seconds` seconds.
+    """
+
+    def __init__(self, max_age_seconds: float, sweep_interval_seconds: float, clock: Callable[[], float] = time.time):
+        self.max_age_seconds = max_age_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._clock = clock
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    @abstractmethod
+    async def load(self, session_id: str) -> Optional[dict]:
+        r"""Returns the contents of the specified session, or `None` if there is no such session or it has expired"""
+
+    @abstractmethod
+    async def save(self, session_id: str, data: dict) -> None:
+        r"""Stores the specified contents for the specified session, (re)starting the session's lifetime"""
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> None:
+        r"""Deletes the specified session (e.g. when the user logs out, or to revoke the session)"""
+
+    @abstractmethod
+    async def sweep(self) -> int:
+        r"""Deletes all expired sessions and returns the number of sessions deleted"""
+
+    async def _sweep_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval_seconds)
+            try:
+                num_deleted = await self.sweep()
+                if num_deleted > 0:
+                    logger.debug("Deleted %d expired session(s)", num_deleted)
+            except sqlite3.Error as error:
+                logger.exception(error)
+
+    async def start(self) -> None:
+        r"""Starts deleting expired sessions in the background"""
+
+        self._sweep_task = asyncio.create_task(self._sweep_periodically())
+
+    async def aclose(self) -> None:
+        r"""Stops deleting expired sessions in the background, and releases any resources the store holds"""
+
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            await asyncio.gather(self._sweep_task, return_exceptions=True)
+
+
+class InMemorySessionStore(SessionStore):
+    r"""
+    A session store that keeps sessions in the memory of the app's process.
+
+    Note: Sessions do not survive the app restarting, and are not shared between multiple processes of the app.
+
+    >>> now = 0.0
+    >>> store = InMemorySessionStore(max_age_seconds=60, sweep_interval_seconds=10, clock=lambda: now)
+    >>> asyncio.run(store.save("abc", {"orcid_access_token": {"orcid": "0000-0000-0000-0001"}}))
+    >>> asyncio.run(store.load("abc"))
+    {'orcid_access_token': {'orcid': '0000-0000-0000-0001'}}
+    >>> now = 60.0
+    >>> asyncio.run(store.load("abc")) is None  # expired
+    True
+    >>> asyncio.run(store.sweep())
+    1
+    """
+
+    def __init__(self, max_age_seconds: float, sweep_interval_seconds: float, clock: Callable[[], float] = time.time):
+        super().__init__(max_age_seconds, sweep_interval_seconds, clock)
+        self._sessions: dict[str, tuple[float, str]] = {}  # session ID -> (expires at, contents as JSON)
+
+    async def load(self, session_id: str) -> Optional[dict]:
+        entry = self._sessions.get(session_id)
+        if entry is None or entry[0] <= self._clock():
+            return None
+
+        # Note: We store each session's contents as JSON, so that the dictionary we return here is a copy
+        #       the caller can modify without affecting the stored session until it saves the session.
+        return json.loads(entry[1])
+
+    async def save(self, session_id: str, data: dict) -> None:
+        self._sessions[session_id] = (self._clock() + self.max_age_seconds, json.dumps(data))
+
+    async def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+    async def sweep(self) -> int:
+        now = self._clock()
+        expired_session_ids = [
+            session_id for session_id, (expires_at, _) in self._sessions.items() if expires_at <= now
+        ]
+        for session_id in expired_session_ids:
+            del self._sessions[session_id]
+        return len(expired_session_ids)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    data       TEXT NOT NULL,  -- JSON
+    expires_at REAL NOT NULL   -- Unix timestamp
+);
+CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
+"""
+
+
+class SQLiteSessionStore(SessionStore):
+    r"""
+    A session store backed by a local SQLite database, so that sessions survive the app restarting.
+
+    Note: SQLite calls are made on a worker thread so that they don't block the event loop.
+
+    >>> store = SQLiteSessionStore(":memory:", max_age_seconds=60, sweep_interval_seconds=10)
+    >>> asyncio.run(store.save("abc", {"orcid_access_token": {"orcid": "0000-0000-0000-0001"}}))
+    >>> asyncio.run(store.load("abc"))
+    {'orcid_access_token': {'orcid': '0000-0000-0000-0001'}}
+    >>> asyncio.run(store.delete("abc"))
+    >>> asyncio.run(store.load("abc")) is None
+    True
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_age_seconds: float,
+        sweep_interval_seconds: float,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__(max_age_seconds, sweep_interval_seconds, clock)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.executescript(SQLITE_SCHEMA)
+
+    def _load(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM sessions WHERE session_id = ? AND expires_at > ?",
+                (session_id, self._clock()),
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _save(self, session_id: str, data: dict) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, expires_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(data), self._clock() + self.max_age_seconds),
+            )
+
+    def _delete(self, session_id: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def _sweep(self) -> int:
+        with self._lock, self._connection:
+            cursor = self._connection.execute("DELETE FROM sessions WHERE expires_at <= ?", (self._clock(),))
+        return cursor.rowcount
+
+    async def load(self, session_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self._load, session_id)
+
+    async def save(self, session_id: str, data: dict) -> None:
+        await asyncio.to_thread(self._save, session_id, data)
+
+    async def delete(self, session_id: str) -> None:
+        await asyncio.to_thread(self._delete, session_id)
+
+    async def sweep(self) -> int:
+        return await asyncio.to_thread(self._sweep)
+
+    async def aclose(self) -> None:
+        await super().aclose()
+        with self._lock:
+            self._connection.close()
+
+
+def create_session_store(config: Config) -> SessionStore:
+    r"""Creates the session store specified by the configuration"""
+
+    if config.SESSION_STORE_BACKEND == "sqlite":
+        return SQLiteSessionStore(
+            config.SESSION_STORE_SQLITE_PATH,
+            max_age_seconds=config.SESSION_MAX_AGE_SECONDS,
+            sweep_interval_seconds=config.SESSION_SWEEP_INTERVAL_SECONDS,
+        )
+    return InMemorySessionStore(
+        max_age_seconds=config.SESSION_MAX_AGE_SECONDS,
+        sweep_interval_seconds=config.SESSION_SWEEP_INTERVAL_SECONDS,
+    )
+
+
+class ServerSideSessionMiddleware:
+    r"""
+    A drop-in replacement for Starlette's `SessionMiddleware` that stores each session's contents on the server
+    (in the app's session store, at `app.state.session_store`), so that the session cookie contains only the
+    session's ID, signed with the secret key.
+
+    Unlike with `SessionMiddleware`, whose cookie contains the whole (signed) session, the client cannot read the
+    session's contents; the cookie stays small no matter what the session contains; and the server can revoke a
+    session by deleting it from the store.
+
+    Note: The session is only loaded (and saved) for requests whose paths do not begin with any of the
+          `excluded_path_prefixes`; for other requests (e.g. requests for static files), it is empty.
+
+    Note: Whenever the user the session identifies changes (i.e. the user logs in, as determined by `get_identity`)
+          the session gets a new ID (and the old one is deleted), which prevents session fixation attacks (i.e. a
+          session ID planted before the user logs in remaining valid after they log in). Other changes (e.g. a
+          refreshed access token) are saved under the same ID; and, when the session is cleared (i.e. the user logs
+          out), it is deleted.
+
+    Reference: https://www.starlette.io/middleware/#sessionmiddleware
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        secret_key: str,
+        session_cookie: str = "session",
+        max_age: int = 14 * 24 * 60 * 60,  # 14 days, in seconds
+        path: str = "/",
+        same_site: Literal["lax", "strict", "none"] = "lax",
+        https_only: bool = False,
+        excluded_path_prefixes: tuple[str, ...] = ("/static/",),
+        get_identity: Callable[[dict], Any] = lambda session: (session.get("orcid_access_token") or {}).get("orcid"),
+    ):
+        self.app = app
+        self.secret_key = secret_key.encode("utf-8")
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.path = path
+        self.security_flags = "httponly; samesite=" + same_site
+        if https_only:  # Secure flag can be used with HTTPS only
+            self.security_flags += "; secure"
+        self.excluded_path_prefixes = excluded_path_prefixes
+        self.get_identity = get_identity
+
+    def _sign(self, session_id: str) -> str:
+        signature = hmac.new(self.secret_key, session_id.encode("utf-8"), hashlib.sha256).hexdigest()
+        return f"{session_id}.{signature}"
+
+    def _unsign(self, cookie_value: str) -> Optional[str]:
+        r"""Returns the session ID in the specified cookie value, or `None` if the cookie value was not signed by us"""
+
+        session_id, _, _ = cookie_value.partition(".")
+        return session_id if hmac.compare_digest(self._sign(session_id), cookie_value) else None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        if scope["path"].startswith(self.excluded_path_prefixes):
+            scope["session"] = {}
+            await self.app(scope, receive, send)
+            return
+
+        session_store: SessionStore = scope["app"].state.session_store
+        connection = HTTPConnection(scope)
+
+        # Load the session whose ID is in the cookie, if any.
+        session_id = None
+        initial_data = None
+        if self.session_cookie in connection.cookies:
+            session_id = self._unsign(connection.cookies[self.session_cookie])
+            if session_id is not None:
+                initial_data = await session_store.load(session_id)
+        scope["session"] = {} if initial_data is None else initial_data
+
+        # Note: We expose the ID of the existing session (if any), so the app can tell sessions apart (e.g. to limit
+        #       the rate of each session's requests).
+        scope["session_id"] = session_id if initial_data is not None else None
+        initial_data_json = json.dumps(initial_data or {}, sort_keys=True)
+        initial_identity = self.get_identity(scope["session"])
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                data = scope["session"]
+                if json.dumps(data, sort_keys=True) != initial_data_json:
+                    headers = MutableHeaders(scope=message)
+                    if not data:
+                        # The session has been cleared.
+                        if scope["session_id"] is not None:
+                            await session_store.delete(scope["session_id"])
+                        new_session_id = ""
+                        header_value = "{session_cookie}={data}; path={path}; Max-Age=0; {security_flags}"
+                    else:
+                        # We have (new) session data to persist. If the session is new, or the user it identifies
+                        # has changed (i.e. the user has logged in), persist it under a new ID; otherwise (e.g. the
+                        # access token has been refreshed), persist it in place, so that other requests using the
+                        # same cookie (e.g. those made concurrently from other tabs) keep working.
+                        if scope["session_id"] is None or self.get_identity(data) != initial_identity:
+                            if scope["session_id"] is not None:
+                                await session_store.delete(scope["session_id"])
+                            new_session_id = secrets.token_urlsafe(32)
+                        else:
+                            new_session_id = scope["session_id"]
+                        await session_store.save(new_session_id, data)
+                        header_value = "{session_cookie}={data}; path={path}; Max-Age={max_age}; {security_flags}"
+                    headers.append(
+                        "Set-Cookie",
+                        header_value.format(
+                            session_cookie=self.session_cookie,
+                            data=self._sign(new_session_id) if new_session_id else "null",
+                            path=self.path,
+                            max_age=self.max_age,
+                            security_flags=self.security_flags,
+                        ),
+                    )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,61 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    r"""
+    Coalesces concurrent calls having the same key, so that only one of them does the work; and the others
+    wait for, and share, its outcome (whether a result or an exception).
+
+    Note: The work is done in a task of its own, so it runs to completion even if the caller that started
+          it gets cancelled (e.g. because its client disconnected) while other callers are waiting for it.
+
+    >>> async def main():
+    ...     single_flight = SingleFlight()
+    ...     num_calls = 0
+    ...     async def fetch():
+    ...         nonlocal num_calls
+    ...         num_calls += 1
+    ...         await asyncio.sleep(0.01)
+    ...         return "result"
+    ...     results = await asyncio.gather(*[single_flight.do("key", fetch) for _ in range(3)])
+    ...     return results, num_calls
+    >>> asyncio.run(main())
+    (['result', 'result', 'result'], 1)
+    """
+
+    def __init__(self):
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+
+    @property
+    def num_in_flight(self) -> int:
+        r"""The number of distinct keys whose work is in progress"""
+
+        return len(self._in_flight)
+
+    def start(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> "asyncio.Future[T]":
+        r"""
+        Starts calling `fn` in the background (unless a call having the same key is already in progress) and returns
+        the call's task, without waiting for it; so that a later `do` having the same key can share its outcome.
+
+        Note: If nobody ends up waiting for the task, any exception it raises is discarded (rather than logged by
+              asyncio as "never retrieved").
+        """
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        r"""
+        Returns the outcome of calling `fn`; or, if a call having the same key is already in progress,
+        the outcome of that call (without calling `fn`).
+        """
+
+        return await asyncio.shield(self.start(key, fn))
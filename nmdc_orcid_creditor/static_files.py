@@ -0,0 +1,132 @@
+import hashlib
+import mimetypes
+import os
+import posixpath
+from dataclasses import dataclass, field
+from typing import Callable
+
+from jinja2 import pass_context
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+from nmdc_orcid_creditor.compression import choose_content_encoding, compress, get_available_encodings, is_compressible
+from nmdc_orcid_creditor.helpers import if_none_match_matches, make_etag
+
+# The `Cache-Control` header of responses to requests for fingerprinted static files. Since a fingerprinted URL
+# changes whenever the file's contents do, browsers can keep those responses for a year without revalidating them.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def make_fingerprinted_path(path: str, content: bytes) -> str:
+    r"""
+    Returns a version of the specified path whose file name includes a fingerprint (i.e. a digest) of the content.
+
+    >>> make_fingerprinted_path("images/favicon.png", b"...")
+    'images/favicon.ab5df625bc.png'
+    >>> make_fingerprinted_path("LICENSE", b"...")
+    'LICENSE.ab5df625bc'
+    """
+
+    stem, extension = posixpath.splitext(path)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:10]}{extension}"
+
+
+@dataclass
+class StaticAsset:
+    r"""A static file, held in memory along with its precompressed variants"""
+
+    media_type: str
+    content: bytes
+    etag: str
+    encoded_contents: dict[str, bytes] = field(default_factory=dict)  # content encoding -> content
+
+
+class FingerprintedStaticFiles(StaticFiles):
+    r"""
+    Serves the files in the specified directory—like `StaticFiles` does—and also at fingerprinted paths (e.g.
+    "favicon.ab5df625bc.png"), whose responses can be cached by browsers "forever" (see `IMMUTABLE_CACHE_CONTROL`).
+
+    The files are read (and the compressible ones are compressed, via every available content encoding) once, when
+    this object is created; so each request for a fingerprinted path is served from memory, in the most compact
+    encoding the client accepts.
+
+    Note: Use `get_fingerprinted_path` to get the fingerprinted path of a file (e.g. when rendering a template).
+          Requests for the files' original paths are still served (e.g. for bookmarked URLs), without the caching.
+    """
+
+    def __init__(self, *, directory: str, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.assets: dict[str, StaticAsset] = {}  # fingerprinted path -> asset
+        self.fingerprinted_paths: dict[str, str] = {}  # original path -> fingerprinted path
+        for parent_dir, _, file_names in os.walk(directory):
+            for file_name in file_names:
+                full_path = os.path.join(parent_dir, file_name)
+                path = os.path.relpath(full_path, directory).replace(os.sep, "/")
+                with open(full_path, "rb") as f:
+                    content = f.read()
+                self._add_asset(path, content)
+
+    def _add_asset(self, path: str, content: bytes) -> None:
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        asset = StaticAsset(media_type=media_type, content=content, etag=make_etag(content))
+        if is_compressible(media_type):
+            for encoding in get_available_encodings():
+                encoded_content = compress(content, encoding)
+                # Note: We keep only the variants that are meaningfully smaller than the original.
+                if len(encoded_content) < len(content) * 0.9:
+                    asset.encoded_contents[encoding] = encoded_content
+        fingerprinted_path = make_fingerprinted_path(path, content)
+        self.assets[fingerprinted_path] = asset
+        self.fingerprinted_paths[path] = fingerprinted_path
+
+    def get_fingerprinted_path(self, path: str) -> str:
+        r"""
+        Returns the fingerprinted version of the specified path (which may start with a "/"), or the path itself if
+        there is no such file.
+        """
+
+        fingerprinted_path = self.fingerprinted_paths.get(path.lstrip("/"))
+        if fingerprinted_path is None:
+            return path
+        return "/" + fingerprinted_path if path.startswith("/") else fingerprinted_path
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        asset = self.assets.get(path.replace(os.sep, "/"))
+        if asset is None:
+            return await super().get_response(path, scope)
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+
+        request_headers = Headers(scope=scope)
+        headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": asset.etag}
+        if asset.encoded_contents:
+            headers["Vary"] = "Accept-Encoding"
+        if if_none_match_matches(request_headers.get("if-none-match"), asset.etag):
+            return Response(status_code=304, headers=headers)
+
+        content = asset.content
+        encoding = choose_content_encoding(request_headers.get("accept-encoding"), asset.encoded_contents)
+        if encoding is not None:
+            content = asset.encoded_contents[encoding]
+            headers["Content-Encoding"] = encoding
+            # Note: The compressed representation is not byte-for-byte identical to the original, so its ETag is weak.
+            headers["ETag"] = f"W/{asset.etag}"
+        return Response(content=content, media_type=asset.media_type, headers=headers)
+
+
+def make_url_for(static_files: FingerprintedStaticFiles, static_route_name: str = "static") -> Callable:
+    r"""
+    Returns a replacement for the `url_for` function that `Jinja2Templates` makes available to templates, which
+    generates fingerprinted URLs for static files (e.g. `url_for("static", path="/favicon.png")`).
+    """
+
+    @pass_context
+    def url_for(context: dict, name: str, /, **path_params) -> str:
+        if name == static_route_name and "path" in path_params:
+            path_params["path"] = static_files.get_fingerprinted_path(path_params["path"])
+        return str(context["request"].url_for(name, **path_params))
+
+    return url_for
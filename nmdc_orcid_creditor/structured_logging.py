@@ -0,0 +1,228 @@
+r"""
+Logging that stays off the request path.
+
+The app's log records (along with those of uvicorn and httpx) are handed to a queue, from which a background thread
+formats them (as JSON, by default) and writes them to the console; so that neither formatting a record nor writing it
+blocks the event loop. Formatting is lazy: a record's message is only interpolated (on the background thread) if the
+record is actually written; and records below the configured level aren't even created, as long as the code that
+logs them passes its values as arguments (e.g. `logger.debug("Claiming credit: %s", credit)`) instead of
+interpolating them itself (e.g. via an f-string).
+
+Before a record is written, anything in it that looks like a secret (e.g. an access token, or the `shared_secret`
+query parameter of the proxy URLs httpx logs) is redacted.
+
+Reference: https://docs.python.org/3/howto/logging-cookbook.html#dealing-with-handlers-that-block
+"""
+
+import json
+import logging
+import queue
+import random
+import re
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Optional, TextIO
+
+from nmdc_orcid_creditor.config import Config
+from nmdc_orcid_creditor.metrics import record_dropped_log_record
+from nmdc_orcid_creditor.tracing import get_current_span
+
+# Patterns of the parts of log messages that are secrets, which we replace with `REDACTED`; namely:
+# - values of keys/parameters whose names mention a token, secret, or password (e.g. `shared_secret=...` in a URL,
+#   `'access_token': '...'` in a dictionary, or `\"refresh_token\": \"...\"` in a JSON string within JSON)
+# - values of `code` query parameters (e.g. the OAuth authorization code in the URL of `/exchange-code-for-token`)
+# - bearer tokens (e.g. in an `Authorization` header)
+SECRET_PATTERNS = (
+    re.compile(
+        r"""((?:token|secret|password)\\?["']?\s*[:=]\s*\\?["']?)[^"'\\&\s,}]+""",
+        re.IGNORECASE,
+    ),
+    re.compile(r"""([?&]code=)[^"'&\s]+"""),
+    re.compile(r"(Bearer\s+)[\w.~+/-]+=*", re.IGNORECASE),
+)
+REDACTED = "REDACTED"
+
+# Names of the attributes every log record has, as opposed to those passed via the `extra` argument of a logging
+# call (e.g. `logger.info("Claimed credit", extra={"credit_type": credit_type})`), which we include in the JSON.
+#
+# Note: uvicorn passes a "color_message" (a copy of the message, with terminal color codes) with some of its records.
+#
+STANDARD_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {
+    "message",
+    "asctime",
+    "trace_id",
+    "color_message",
+}
+
+# Names of the loggers whose records we route through the queue, other than the app's (i.e. the "uvicorn" logger).
+UVICORN_ACCESS_LOGGER_NAME = "uvicorn.access"
+HTTPX_LOGGER_NAME = "httpx"
+
+
+def redact(text: str) -> str:
+    r"""
+    Returns the specified text, with anything in it that looks like a secret replaced with `REDACTED`.
+
+    >>> redact("HTTP Request: GET https://example.com/exec?orcid_id=0000-0000-0000-0001&shared_secret=s3cr3t")
+    'HTTP Request: GET https://example.com/exec?orcid_id=0000-0000-0000-0001&shared_secret=REDACTED'
+    >>> redact("{'access_token': 'abc', 'token_type': 'bearer', 'orcid': '0000-0000-0000-0001'}")
+    "{'access_token': 'REDACTED', 'token_type': 'bearer', 'orcid': '0000-0000-0000-0001'}"
+    >>> redact('{"message": "{\\"refresh_token\\": \\"def\\"}"}')
+    '{"message": "{\\"refresh_token\\": \\"REDACTED\\"}"}'
+    >>> redact("GET /exchange-code-for-token?code=Ab1Cd2 Authorization: Bearer abc.def")
+    'GET /exchange-code-for-token?code=REDACTED Authorization: Bearer REDACTED'
+    """
+
+    for pattern in SECRET_PATTERNS:
+        text = pattern.sub(rf"\g<1>{REDACTED}", text)
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    r"""
+    Formats each log record as a line of JSON; including any values passed via the `extra` argument of the logging
+    call, and the ID of the trace the record was logged in (if any). Secrets are redacted.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id is not None:
+            entry["trace_id"] = trace_id
+        for name, value in vars(record).items():
+            if name not in STANDARD_RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return redact(json.dumps(entry, default=str))
+
+
+class RedactingFormatter(logging.Formatter):
+    r"""Formats each log record the way `logging.Formatter` does, with secrets redacted"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(super().format(record))
+
+
+class DebugSamplingFilter(logging.Filter):
+    r"""
+    Lets through a `sample_rate` fraction of `DEBUG` records (which can be numerous), and all other records.
+
+    >>> sampling_filter = DebugSamplingFilter(sample_rate=0.0)
+    >>> sampling_filter.filter(logging.makeLogRecord({"levelno": logging.DEBUG}))
+    False
+    >>> sampling_filter.filter(logging.makeLogRecord({"levelno": logging.INFO}))
+    True
+    """
+
+    def __init__(
+        self,
+        sample_rate: float,
+        should_sample: Callable[[float], bool] = lambda sample_rate: random.random() < sample_rate,
+    ):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self._should_sample = should_sample
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.sample_rate >= 1.0 or self._should_sample(self.sample_rate):
+            return True
+        record_dropped_log_record("sampled")
+        return False
+
+
+class DeferredFormattingQueueHandler(QueueHandler):
+    r"""
+    A `QueueHandler` that leaves formatting each record to the handler on the other end of the queue; and that drops
+    records (instead of blocking) if the queue is full.
+
+    Note: The standard `QueueHandler` formats each record before enqueuing it (so the record can be pickled and sent
+          to another process). Our queue is consumed by a thread of the same process, so we enqueue the record as is
+          and let that thread format it. The trade-off is that, if the code that logged a record modifies one of
+          the record's arguments afterward, the record may reflect the modification.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Note: We get the trace ID now, since the current span is specific to the code that logged the record.
+        span = get_current_span()
+        if span.is_recording:
+            record.trace_id = span.trace_id
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            record_dropped_log_record("queue_full")
+
+
+class BackgroundLogging:
+    r"""
+    Routes the records of the specified loggers (at the specified levels) through a bounded queue, to a handler
+    that formats them and writes them to the specified stream on a background thread.
+
+    When stopped, it writes the records still in the queue, and restores the loggers to the way they were.
+    """
+
+    def __init__(
+        self,
+        logger_levels: dict[str, int],
+        formatter: logging.Formatter,
+        debug_sample_rate: float = 1.0,
+        max_queue_size: int = 10000,
+        stream: Optional[TextIO] = None,
+    ):
+        self.logger_levels = logger_levels
+        stream_handler = logging.StreamHandler(sys.stderr if stream is None else stream)
+        stream_handler.setFormatter(formatter)
+        self.queue_handler = DeferredFormattingQueueHandler(queue.Queue(maxsize=max_queue_size))
+        self.queue_handler.addFilter(DebugSamplingFilter(debug_sample_rate))
+        self._listener = QueueListener(self.queue_handler.queue, stream_handler)
+        self._original_logger_states: dict[str, tuple[list[logging.Handler], bool, int]] = {}
+
+    def start(self) -> None:
+        for name, level in self.logger_levels.items():
+            logger = logging.getLogger(name)
+            self._original_logger_states[name] = (logger.handlers[:], logger.propagate, logger.level)
+
+            # Note: We replace the loggers' existing handlers (e.g. the console handlers uvicorn configures), since
+            #       those write each record synchronously, on the thread that logged it.
+            logger.handlers = [self.queue_handler]
+            logger.propagate = False
+            logger.setLevel(level)
+        self._listener.start()
+
+    def stop(self) -> None:
+        self._listener.stop()
+        for name, (handlers, propagate, level) in self._original_logger_states.items():
+            logger = logging.getLogger(name)
+            logger.handlers = handlers
+            logger.propagate = propagate
+            logger.setLevel(level)
+        self._original_logger_states.clear()
+
+
+def create_background_logging(config: Config, stream: Optional[TextIO] = None) -> BackgroundLogging:
+    r"""Returns a `BackgroundLogging` instance that logs the way the specified configuration specifies"""
+
+    if config.LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = RedactingFormatter("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    return BackgroundLogging(
+        logger_levels={
+            "uvicorn": logging.getLevelName(config.LOG_LEVEL),
+            UVICORN_ACCESS_LOGGER_NAME: logging.getLevelName(config.LOG_ACCESS_LEVEL),
+            HTTPX_LOGGER_NAME: logging.getLevelName(config.LOG_HTTP_CLIENT_LEVEL),
+        },
+        formatter=formatter,
+        debug_sample_rate=config.LOG_DEBUG_SAMPLE_RATE,
+        max_queue_size=config.LOG_QUEUE_MAX_SIZE,
+        stream=stream,
+    )
@@ -0,0 +1,34 @@
+import asyncio
+
+from nmdc_orcid_creditor.benchmark import SCENARIOS, run_benchmark
+
+
+def test_run_benchmark():
+    benchmark = asyncio.run(
+        run_benchmark(
+            concurrency_levels=(1, 3),
+            num_requests=6,
+            num_rows=60,
+            num_users=10,
+            proxy_latency_seconds=0,
+            orcid_latency_seconds=0,
+        )
+    )
+
+    # Test: Each scenario was run at each concurrency level, entirely against the stand-ins, without errors.
+    results = benchmark["results"]
+    assert [(r["scenario"], r["concurrency"]) for r in results] == [(s, c) for s in SCENARIOS for c in (1, 3)]
+    for result in results:
+        assert result["requests"] == 6
+        assert result["errors"] == 0
+        assert 0 < result["latency_ms"]["p50"] <= result["latency_ms"]["p95"] <= result["latency_ms"]["p99"]
+
+    # Test: The sizes of the proxy's payloads, in each wire format, were measured; and the columnar format is smaller.
+    objects, columnar, columnar_subset = benchmark["wire_formats"]
+    assert (objects["wire_format"], columnar["wire_format"]) == ("objects", "columnar")
+    assert objects["rows"] == 60
+    assert objects["payload_bytes"] > columnar["payload_bytes"] > columnar_subset["payload_bytes"]
+
+    # Test: Matching claims was measured for each representation of the credits.
+    assert [r["representation"] for r in benchmark["claim_matching"]] == ["dicts", "credits_cold", "credits_warm"]
+    assert all(r["rows"] == 60 and r["match_ms"] > 0 for r in benchmark["claim_matching"])
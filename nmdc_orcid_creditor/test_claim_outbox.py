@@ -0,0 +1,177 @@
+import asyncio
+
+from nmdc_orcid_creditor.claim_outbox import ClaimOutbox, OutboxCreditStore
+from nmdc_orcid_creditor.credit_model import Credit
+from nmdc_orcid_creditor.credit_store import SQLiteCreditStore, CreditStoreError
+
+orcid_id = "0000-0000-0000-0001"
+claim = dict(credit_type="Ambassador 2023", start_date="", end_date="", affiliation_put_code="12345")
+
+
+class FlakyCreditStore(SQLiteCreditStore):
+    r"""A SQLite credit store whose first `num_failures` attempts to mark a credit as claimed fail."""
+
+    def __init__(self, num_failures: int):
+        super().__init__(":memory:")
+        self.add_credits([{"column.ORCID_ID": orcid_id, "column.CREDIT_TYPE": "Ambassador 2023"}])
+        self.num_failures = num_failures
+
+    async def mark_claimed(self, *args, **kwargs) -> list[dict]:
+        if self.num_failures > 0:
+            self.num_failures -= 1
+            raise CreditStoreError("Proxy is unavailable")
+        return await super().mark_claimed(*args, **kwargs)
+
+
+def make_store(inner_store, outbox_path: str) -> OutboxCreditStore:
+    return OutboxCreditStore(
+        inner_store,
+        ClaimOutbox(outbox_path),
+        retry_base_delay_seconds=0.01,
+        retry_max_delay_seconds=0.05,
+    )
+
+
+def test_outbox_credit_store_retries_until_claim_is_recorded(tmp_path):
+    inner_store = FlakyCreditStore(num_failures=2)
+    store = make_store(inner_store, str(tmp_path / "outbox.sqlite3"))
+
+    async def claim_and_wait():
+        await store.start()
+        credits = await store.mark_claimed(orcid_id=orcid_id, **claim)
+        pending_credits = await inner_store.list_credits(orcid_id)
+        for _ in range(100):
+            if store.num_pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        recorded_credits = await inner_store.list_credits(orcid_id)
+        await store.aclose()
+        return credits, pending_credits, recorded_credits
+
+    credits, pending_credits, recorded_credits = asyncio.run(claim_and_wait())
+
+    # Test: The claim was reflected right away (in a `Credit`), although it had not been recorded in the inner store
+    #       yet.
+    assert isinstance(credits[0], Credit)
+    assert credits[0]["column.AFFILIATION_PUT_CODE"] == "12345"
+    assert pending_credits[0]["column.CLAIMED_AT"] == ""
+
+    # Test: The claim was eventually recorded in the inner store, after the failed attempts.
+    assert inner_store.num_failures == 0
+    assert store.num_pending == 0
+    assert recorded_credits[0]["column.AFFILIATION_PUT_CODE"] == "12345"
+
+
+def test_outbox_credit_store_replays_leftover_entries_on_start(tmp_path):
+    outbox_path = str(tmp_path / "outbox.sqlite3")
+
+    # Simulate the app having stopped before it recorded a claim.
+    ClaimOutbox(outbox_path).add(orcid_id, [claim])
+
+    inner_store = FlakyCreditStore(num_failures=0)
+    store = make_store(inner_store, outbox_path)
+
+    async def start_and_wait():
+        await store.start()
+        for _ in range(100):
+            if store.num_pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        recorded_credits = await inner_store.list_credits(orcid_id)
+        await store.aclose()
+        return recorded_credits
+
+    recorded_credits = asyncio.run(start_and_wait())
+
+    # Test: The leftover claim was recorded, and removed from the outbox.
+    assert recorded_credits[0]["column.AFFILIATION_PUT_CODE"] == "12345"
+    assert ClaimOutbox(outbox_path).list_entries() == []
+
+
+class RecordingCreditStore(FlakyCreditStore):
+    r"""A flaky SQLite credit store that records the batches of claims it is asked to mark as claimed."""
+
+    def __init__(self, num_failures: int):
+        super().__init__(num_failures)
+        self.add_credits([{"column.ORCID_ID": orcid_id, "column.CREDIT_TYPE": "Ambassador 2024"}])
+        self.batches = []
+
+    async def mark_claimed_batch(self, orcid_id: str, claims: list[dict]) -> list[dict]:
+        self.batches.append((orcid_id, [c["credit_type"] for c in claims]))
+        return await super().mark_claimed_batch(orcid_id, claims)
+
+
+def test_outbox_credit_store_records_due_claims_of_each_orcid_id_in_one_batch(tmp_path):
+    inner_store = RecordingCreditStore(num_failures=0)
+    store = make_store(inner_store, str(tmp_path / "outbox.sqlite3"))
+    claims = [claim, {**claim, "credit_type": "Ambassador 2024", "affiliation_put_code": "67890"}]
+    ClaimOutbox(str(tmp_path / "outbox.sqlite3")).add(orcid_id, claims)
+
+    async def start_and_wait():
+        await store.start()
+        for _ in range(100):
+            if store.num_pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        await store.aclose()
+
+    asyncio.run(start_and_wait())
+
+    # Test: Both claims were recorded via a single batch.
+    assert store.num_pending == 0
+    assert inner_store.batches == [(orcid_id, ["Ambassador 2023", "Ambassador 2024"])]
+    assert ClaimOutbox(str(tmp_path / "outbox.sqlite3")).list_entries() == []
+
+
+def test_outbox_credit_store_parks_claims_that_keep_failing(tmp_path):
+    inner_store = FlakyCreditStore(num_failures=100)
+    store = OutboxCreditStore(
+        inner_store,
+        ClaimOutbox(str(tmp_path / "outbox.sqlite3")),
+        retry_base_delay_seconds=0.0,
+        retry_max_delay_seconds=0.0,
+        max_attempts=3,
+    )
+
+    async def claim_and_drain():
+        credits = await store.mark_claimed(orcid_id=orcid_id, **claim)
+        for _ in range(3):
+            await store.drain()
+        return credits, await store.list_credits(orcid_id)
+
+    credits, credits_after_parking = asyncio.run(claim_and_drain())
+
+    # Test: The claim was parked after the maximum number of attempts, and is no longer attempted.
+    assert inner_store.num_failures == 100 - 3
+    assert (store.num_pending, store.num_parked) == (0, 1)
+    (entry,) = store.outbox.list_entries()
+    assert entry["attempts"] == 3 and entry["parked_at"] is not None
+
+    # Test: The parked claim is still reflected in the credits (since its affiliation exists).
+    assert credits_after_parking[0]["column.AFFILIATION_PUT_CODE"] == "12345"
+
+
+def test_outbox_credit_store_replays_recorded_claims_without_claiming_another_credit(tmp_path):
+    inner_store = FlakyCreditStore(num_failures=0)
+    inner_store.add_credits([{"column.ORCID_ID": orcid_id, "column.CREDIT_TYPE": "Ambassador 2023"}])
+    store = make_store(inner_store, str(tmp_path / "outbox.sqlite3"))
+
+    # Simulate the app having stopped after it recorded a claim, but before it removed the claim's entry.
+    asyncio.run(inner_store.mark_claimed(orcid_id=orcid_id, **claim))
+    ClaimOutbox(str(tmp_path / "outbox.sqlite3")).add(orcid_id, [claim])
+
+    async def start_and_wait():
+        await store.start()
+        for _ in range(100):
+            if store.num_pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        recorded_credits = await inner_store.list_credits(orcid_id)
+        await store.aclose()
+        return recorded_credits
+
+    recorded_credits = asyncio.run(start_and_wait())
+
+    # Test: Replaying the claim succeeded, and left the other (identical) credit unclaimed.
+    assert store.num_pending == 0
+    assert [credit["column.CLAIMED_AT"] != "" for credit in recorded_credits] == [True, False]
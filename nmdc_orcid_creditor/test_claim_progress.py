@@ -0,0 +1,85 @@
+import asyncio
+
+from nmdc_orcid_creditor.claim_progress import KEEPALIVE_MESSAGE, ClaimProgress, ClaimProgressTracker
+from nmdc_orcid_creditor.single_flight import SingleFlight
+
+
+def test_claim_progress_forgets_subscribers_that_disconnect():
+    async def subscribe_then_disconnect():
+        progress = ClaimProgress("0000-0000-0000-0001")
+        messages = []
+        received_keepalive, received_event = asyncio.Event(), asyncio.Event()
+
+        async def subscribe():
+            async for message in progress.subscribe(keepalive_seconds=0.01):
+                messages.append(message)
+                if message == KEEPALIVE_MESSAGE:
+                    received_keepalive.set()
+                else:
+                    received_event.set()
+
+        task = asyncio.create_task(subscribe())
+        await asyncio.wait_for(received_keepalive.wait(), timeout=1)
+        progress.report("credit_validated", {"credit_type": "Ambassador 2023"})
+        await asyncio.wait_for(received_event.wait(), timeout=1)
+        num_subscribers_while_connected = progress.num_subscribers
+
+        # Simulate the client disconnecting, in which case the server cancels the task streaming the events.
+        task.cancel()
+        await asyncio.wait_for(asyncio.gather(task, return_exceptions=True), timeout=1)
+        return messages, num_subscribers_while_connected, progress.num_subscribers
+
+    messages, num_subscribers_while_connected, num_subscribers = asyncio.run(subscribe_then_disconnect())
+
+    # Test: The subscriber received a keepalive message while there were no events, then the event.
+    assert messages[0] == KEEPALIVE_MESSAGE
+    assert any(message.startswith(b"id: 1\nevent: credit_validated\n") for message in messages)
+
+    # Test: Once the subscriber disconnected, it was forgotten.
+    assert num_subscribers_while_connected == 1
+    assert num_subscribers == 0
+
+
+def test_coalesced_claims_each_report_the_stages_of_the_claim():
+    async def claim_twice_concurrently():
+        tracker = ClaimProgressTracker(ttl_seconds=60, max_entries=10)
+        single_flight = SingleFlight()
+        num_claims = 0
+        credit_validated, duplicate_started = asyncio.Event(), asyncio.Event()
+
+        async def claim_credit(progress):
+            nonlocal num_claims
+            num_claims += 1
+            progress.report("credit_validated", {"credit_type": "Ambassador 2023"})
+            credit_validated.set()
+            await duplicate_started.wait()
+            progress.report("affiliation_created", {"affiliation_put_code": "123"})
+            return {"credits": []}
+
+        async def claim(progress):
+            key = ("claim", "0000-0000-0000-0001")
+            with tracker.share(key, "0000-0000-0000-0001", progress) as shared_progress:
+                result = await single_flight.do(key, lambda: claim_credit(shared_progress))
+            progress.report("done", result)
+
+        # Start a claim, then a duplicate of it once the first one has already reported a stage.
+        progress_id = tracker.start("0000-0000-0000-0001", claim)
+        await asyncio.wait_for(credit_validated.wait(), timeout=1)
+        duplicate_progress_id = tracker.start("0000-0000-0000-0001", claim)
+        await asyncio.sleep(0)  # lets the duplicate start waiting for the claim
+        duplicate_started.set()
+        await asyncio.wait_for(tracker.aclose(), timeout=1)
+        progress = tracker.get("0000-0000-0000-0001", progress_id)
+        duplicate_progress = tracker.get("0000-0000-0000-0001", duplicate_progress_id)
+        return progress, duplicate_progress, num_claims, tracker.num_shared
+
+    progress, duplicate_progress, num_claims, num_shared = asyncio.run(claim_twice_concurrently())
+
+    # Test: The credit was claimed once, and both progress reports contain each stage of that claim.
+    assert num_claims == 1
+    expected_events = ["credit_validated", "affiliation_created", "done"]
+    assert [event for event, _ in progress.events] == expected_events
+    assert [event for event, _ in duplicate_progress.events] == expected_events
+
+    # Test: Once the claim finished, its shared progress report was forgotten.
+    assert num_shared == 0
@@ -0,0 +1,56 @@
+import asyncio
+
+from nmdc_orcid_creditor.credit_stats import CreditStats
+from nmdc_orcid_creditor.credit_store import SQLiteCreditStore
+from nmdc_orcid_creditor.test_credit_store import make_credit, orcid_id
+
+
+def test_credit_stats_count_claims_made_while_seeding():
+    store = SQLiteCreditStore(":memory:")
+    store.add_credits(
+        [
+            make_credit(**{"column.START_DATE": "2023-01-01"}),
+            make_credit(**{"column.CREDIT_TYPE": "Champion 2023", "column.CLAIMED_AT": "2024-05-02T12:00:00.000Z"}),
+            make_credit(**{"column.START_DATE": "2023-03-01"}),
+            make_credit(**{"column.CREDIT_TYPE": "Champion 2023"}),
+        ]
+    )
+    stats = CreditStats(store, reseed_interval_seconds=60, page_size=1)
+
+    async def seed_while_claiming():
+        async def claim(start_date: str, put_code: str):
+            await store.mark_claimed(orcid_id, "Ambassador 2023", start_date, "2023-12-31T08:00:00.000Z", put_code)
+            stats.record_claim("Ambassador 2023", "2024-06-01T12:00:00.000Z", put_code)
+
+        # Claim one credit the scan has already read, and one it has yet to read, once it has read the first page.
+        iter_credit_pages = store.iter_credit_pages
+
+        async def iter_credit_pages_while_claiming(page_size: int, columns=None):
+            async for credits in iter_credit_pages(page_size, columns):
+                yield credits
+                if credits[0]["column.START_DATE"] == "2023-01-01":
+                    await claim("2023-01-01", "1")
+                    await claim("2023-03-01", "2")
+
+        store.iter_credit_pages = iter_credit_pages_while_claiming
+        await stats.seed()
+
+    asyncio.run(seed_while_claiming())
+    report = stats.report(granularity="month")
+
+    # Test: Each claim was counted exactly once; whether or not the scan saw it.
+    assert report["num_credits"] == 4
+    assert report["num_claimed"] == 3
+    ambassador, champion = report["credit_types"]
+    assert ambassador["num_claimed"] == 2
+    assert sum(bucket["num_claims"] for bucket in ambassador["buckets"]) == 2
+    assert ambassador["buckets"][-1]["claim_rate_by_end"] == 1.0
+    assert champion["buckets"][0]["bucket"] == "2024-05"
+
+    # Test: Claims made afterward are counted incrementally; and the report can be limited to one credit type.
+    stats.record_claim("Champion 2023", "2024-07-04T00:00:00.000Z", "3")
+    report = stats.report(granularity="year", credit_type="Champion 2023")
+    assert [r["credit_type"] for r in report["credit_types"]] == ["Champion 2023"]
+    assert report["credit_types"][0]["buckets"] == [
+        {"bucket": "2024", "num_claims": 2, "num_claimed_by_end": 2, "claim_rate_by_end": 1.0}
+    ]
@@ -0,0 +1,265 @@
+import asyncio
+
+import httpx
+import pytest
+
+from nmdc_orcid_creditor.credit_store import (
+    CachingCreditStore,
+    ProxyCreditStore,
+    SQLiteCreditStore,
+    SnapshotCreditStore,
+    CreditStoreError,
+    CreditStoreOverloadedError,
+)
+from nmdc_orcid_creditor import mock_services
+from nmdc_orcid_creditor.credits_cache import CreditsCache
+from nmdc_orcid_creditor.resilience import AdmissionController, CircuitBreaker, RetryPolicy
+
+orcid_id = "0000-0000-0000-0001"
+
+
+def make_credit(**kwargs) -> dict:
+    return {
+        "column.ORCID_ID": orcid_id,
+        "column.CREDIT_TYPE": "Ambassador 2023",
+        "column.AFFILIATION_TYPE": "service",
+        "column.START_DATE": "2023-01-01T08:00:00.000Z",
+        "column.END_DATE": "2023-12-31T08:00:00.000Z",
+        "column.DETAILS_URL": "",
+        "column.CLAIMED_AT": "",
+        "column.AFFILIATION_PUT_CODE": "",
+        **kwargs,
+    }
+
+
+def test_sqlite_credit_store_lists_credits_by_orcid_id():
+    store = SQLiteCreditStore(":memory:")
+    store.add_credits([make_credit(), make_credit(**{"column.ORCID_ID": "0000-0000-0000-0002"})])
+
+    # Test: Returns only the specified ORCID ID's credits, in the same format the proxy uses.
+    assert asyncio.run(store.list_credits(orcid_id)) == [make_credit()]
+    assert asyncio.run(store.list_credits("0000-0000-0000-0003")) == []
+
+
+def test_sqlite_credit_store_lookups_use_indexes():
+    store = SQLiteCreditStore(":memory:")
+    plan = store._connection.execute("EXPLAIN QUERY PLAN SELECT * FROM credits WHERE orcid_id = ?", (orcid_id,))
+    assert "USING INDEX" in " ".join(row["detail"] for row in plan)
+
+
+def test_sqlite_credit_store_marks_only_one_unclaimed_credit_as_claimed():
+    store = SQLiteCreditStore(":memory:")
+    store.add_credits([make_credit(), make_credit()])  # two identical credits
+
+    async def claim_concurrently():
+        claim_key = (orcid_id, "Ambassador 2023", "2023-01-01T08:00:00.000Z", "2023-12-31T08:00:00.000Z")
+        return await asyncio.gather(
+            *[store.mark_claimed(*claim_key, put_code) for put_code in ("1", "2", "3")], return_exceptions=True
+        )
+
+    results = asyncio.run(claim_concurrently())
+    credits = asyncio.run(store.list_credits(orcid_id))
+
+    # Test: Each credit was claimed exactly once (the third claim found no unclaimed credit, and failed).
+    assert sum(isinstance(result, CreditStoreError) for result in results) == 1
+    assert all(credit["column.CLAIMED_AT"] != "" for credit in credits)
+    assert sorted(credit["column.AFFILIATION_PUT_CODE"] for credit in credits) in (["1", "2"], ["1", "3"], ["2", "3"])
+
+
+def test_sqlite_credit_store_refuses_to_claim_a_claimed_credit():
+    store = SQLiteCreditStore(":memory:")
+    store.add_credits([make_credit()])
+    claim_key = (orcid_id, "Ambassador 2023", "2023-01-01T08:00:00.000Z", "2023-12-31T08:00:00.000Z")
+    asyncio.run(store.mark_claimed(*claim_key, "1"))
+
+    # Test: Claiming the same credit again fails, and leaves the credit the way the first claim left it.
+    with pytest.raises(CreditStoreError):
+        asyncio.run(store.mark_claimed(*claim_key, "2"))
+    (credit,) = asyncio.run(store.list_credits(orcid_id))
+    assert credit["column.AFFILIATION_PUT_CODE"] == "1"
+
+
+def test_proxy_credit_store_raises_credit_store_error_on_failure():
+    def handle_request(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, text="<html>Quota exceeded</html>")
+
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handle_request))
+    store = ProxyCreditStore(http_client, proxy_url="https://proxy.example.com/exec", shared_secret="secret")
+
+    # Test: A response that isn't the JSON the app expects is reported as a `CreditStoreError`.
+    with pytest.raises(CreditStoreError):
+        asyncio.run(store.list_credits(orcid_id))
+
+
+class FlakyProxy:
+    r"""A stand-in for the proxy, which responds to the first `num_failures` requests with an error page."""
+
+    def __init__(self, num_failures: int):
+        self.num_failures = num_failures
+        self.requests: list[httpx.Request] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if len(self.requests) <= self.num_failures:
+            return httpx.Response(503, text="<html>Service unavailable</html>")
+        return httpx.Response(200, json=dict(orcid_id=orcid_id, credits=[make_credit()]))
+
+    def make_store(self, circuit_breaker: CircuitBreaker = None) -> ProxyCreditStore:
+        return ProxyCreditStore(
+            httpx.AsyncClient(transport=httpx.MockTransport(self)),
+            proxy_url="https://proxy.example.com/exec",
+            shared_secret="secret",
+            circuit_breaker=circuit_breaker,
+            read_retry_policy=RetryPolicy(max_attempts=3, base_delay_seconds=0.001, max_delay_seconds=0.01),
+        )
+
+
+def test_proxy_credit_store_retries_failed_reads_but_not_writes():
+    flaky_proxy = FlakyProxy(num_failures=2)
+    store = flaky_proxy.make_store()
+
+    # Test: A read succeeds on its third attempt.
+    assert asyncio.run(store.list_credits(orcid_id)) == [make_credit()]
+    assert len(flaky_proxy.requests) == 3
+
+    # Test: A failed write is not retried.
+    flaky_proxy = FlakyProxy(num_failures=1)
+    store = flaky_proxy.make_store()
+    with pytest.raises(CreditStoreError):
+        asyncio.run(store.mark_claimed(orcid_id, "Ambassador 2023", "", "", "12345"))
+    assert len(flaky_proxy.requests) == 1
+
+
+def test_proxy_credit_store_fails_fast_while_circuit_breaker_is_open():
+    flaky_proxy = FlakyProxy(num_failures=100)
+    circuit_breaker = CircuitBreaker("test_proxy", failure_threshold=3, reset_timeout_seconds=60)
+    store = flaky_proxy.make_store(circuit_breaker)
+    now = 0.0
+    cache = CreditsCache(ttl_seconds=60, max_entries=10, clock=lambda: now)
+    caching_store = CachingCreditStore(store, cache)
+    cache.set(orcid_id, [make_credit()])
+    now = 60.0  # the cached credits have expired
+
+    # Test: Once the breaker opens, reads fail without the proxy receiving any requests.
+    with pytest.raises(CreditStoreError):
+        asyncio.run(store.list_credits(orcid_id))
+    assert circuit_breaker.state == "open"
+    num_requests = len(flaky_proxy.requests)
+    with pytest.raises(CreditStoreError):
+        asyncio.run(store.list_credits(orcid_id))
+    assert len(flaky_proxy.requests) == num_requests
+
+    # Test: Meanwhile, the caching store serves the credits it cached before, although they have expired.
+    assert cache.get(orcid_id) is None
+    assert asyncio.run(caching_store.list_credits(orcid_id)) == [make_credit()]
+
+
+def test_proxy_credit_store_turns_away_reads_when_queue_is_full():
+    async def handle_request(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json=dict(orcid_id=orcid_id, credits=[make_credit()]))
+
+    admission_controller = AdmissionController("test_proxy", max_concurrency=1, max_queue_length=1)
+    store = ProxyCreditStore(
+        httpx.AsyncClient(transport=httpx.MockTransport(handle_request)),
+        proxy_url="https://proxy.example.com/exec",
+        shared_secret="secret",
+        admission_controller=admission_controller,
+    )
+
+    async def send_concurrently():
+        reads = [store.list_credits(orcid_id) for _ in range(3)]
+        write = store.mark_claimed(orcid_id, "Ambassador 2023", "", "", "12345")
+        return await asyncio.gather(*reads, write, return_exceptions=True)
+
+    *read_results, write_result = asyncio.run(send_concurrently())
+
+    # Test: One read was sent right away and one waited for its turn; the third was turned away, with an estimate of
+    #       when to try again. The write waited, although the queue was full.
+    assert [type(result) for result in read_results] == [list, list, CreditStoreOverloadedError]
+    assert read_results[2].retry_after_seconds >= 1
+    assert write_result == [make_credit()]
+    assert admission_controller.stats()["num_rejections"] == 1
+    assert admission_controller.stats()["num_waiting"] == 0
+
+
+def test_proxy_credit_store_accepts_either_wire_format():
+    proxy = mock_services.MockProxy(num_rows=6, num_users=2)
+    user_orcid_id = mock_services.make_orcid_id(1)
+
+    async def read(wire_format: str, columns=None) -> tuple[list[dict], list[dict]]:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=proxy.app)) as http_client:
+            store = ProxyCreditStore(http_client, "https://proxy.test/exec", shared_secret="", wire_format=wire_format)
+            credits = await store.list_credits(user_orcid_id)
+            exported_credits = [credit async for page in store.iter_credit_pages(4, columns) for credit in page]
+            return credits, exported_credits
+
+    # Test: Credits received in the columnar format are decoded into the same credits as in the objects format.
+    credits, exported_credits = asyncio.run(read("objects"))
+    assert len(credits) == 3 and len(exported_credits) == 6
+    assert asyncio.run(read("columnar")) == (credits, exported_credits)
+
+    # Test: In the columnar format, exports can be limited to the requested columns.
+    _, exported_credits = asyncio.run(read("columnar", columns=["column.ORCID_ID", "column.CLAIMED_AT"]))
+    assert exported_credits[-1] == {"column.ORCID_ID": user_orcid_id, "column.CLAIMED_AT": ""}
+
+
+class MockProxy:
+    r"""A stand-in for the proxy, which supports the "export" action and keeps track of the requests it receives."""
+
+    def __init__(self, credits: list[dict]):
+        self.credits = credits
+        self.version = "v1"
+        self.requests: list[httpx.Request] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        params = request.url.params
+        if request.method == "GET" and params.get("action") == "export":
+            if params["since_version"] == self.version:
+                return httpx.Response(200, json=dict(version=self.version, unchanged=True, credits=[]))
+            return httpx.Response(200, json=dict(version=self.version, unchanged=False, credits=self.credits))
+        elif request.method == "POST":
+            self.credits = [make_credit(**{"column.CLAIMED_AT": "2024-06-01T12:00:00.000Z"})]
+            self.version = "v2"
+        credits = [c for c in self.credits if c["column.ORCID_ID"] == params["orcid_id"]]
+        return httpx.Response(200, json=dict(orcid_id=params["orcid_id"], credits=credits))
+
+    def make_store(self) -> SnapshotCreditStore:
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(self))
+        proxy_store = ProxyCreditStore(http_client, proxy_url="https://proxy.example.com/exec", shared_secret="secret")
+        return SnapshotCreditStore(proxy_store, refresh_interval_seconds=60)
+
+
+def test_snapshot_credit_store_serves_reads_from_index():
+    mock_proxy = MockProxy(credits=[make_credit(), make_credit(**{"column.ORCID_ID": "0000-0000-0000-0002"})])
+    store = mock_proxy.make_store()
+
+    # Test: Before the first download, reads are passed through to the proxy.
+    assert asyncio.run(store.list_credits(orcid_id)) == [make_credit()]
+    assert len(mock_proxy.requests) == 1
+
+    # Test: After the download, reads (including finding a credit to claim) don't involve the proxy.
+    assert asyncio.run(store.refresh()) is True
+    num_requests = len(mock_proxy.requests)
+    assert asyncio.run(store.list_credits(orcid_id)) == [make_credit()]
+    assert asyncio.run(store.list_credits("0000-0000-0000-0003")) == []
+    claim_key = (orcid_id, "Ambassador 2023", "2023-01-01T08:00:00.000Z", "2023-12-31T08:00:00.000Z")
+    assert asyncio.run(store.find_unclaimed_credit(*claim_key)) == make_credit()
+    assert len(mock_proxy.requests) == num_requests
+
+    # Test: When the sheet hasn't changed, a refresh keeps the existing index.
+    assert asyncio.run(store.refresh()) is False
+
+
+def test_snapshot_credit_store_writes_claims_through_to_proxy():
+    mock_proxy = MockProxy(credits=[make_credit()])
+    store = mock_proxy.make_store()
+    asyncio.run(store.refresh())
+
+    # Test: The claim is sent to the proxy, and the credits it returns are applied to the index.
+    claim_key = (orcid_id, "Ambassador 2023", "2023-01-01T08:00:00.000Z", "2023-12-31T08:00:00.000Z")
+    asyncio.run(store.mark_claimed(*claim_key, "12345"))
+    assert mock_proxy.requests[-1].method == "POST"
+    assert asyncio.run(store.find_unclaimed_credit(*claim_key)) is None
+    assert asyncio.run(store.list_credits(orcid_id))[0]["column.CLAIMED_AT"] != ""
@@ -1,25 +1,188 @@
-from datetime import datetime, timedelta
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
 
+import httpx
+import pytest
 from fastapi.testclient import TestClient
 
-from nmdc_orcid_creditor.main import app, validate_orcid_access_token
+from nmdc_orcid_creditor.config import cfg
+from nmdc_orcid_creditor.credit_stats import CreditStats
+from nmdc_orcid_creditor.credit_store import ProxyCreditStore, CachingCreditStore, CreditStoreOverloadedError
+from nmdc_orcid_creditor.credits_cache import TTLCache
+from nmdc_orcid_creditor.main import (
+    app,
+    validate_orcid_access_token,
+    get_orcid_access_token,
+    get_http_client,
+    get_credit_store,
+    get_credit_stats,
+    oauth,
+    static_files,
+)
+from nmdc_orcid_creditor.resilience import KeyedRateLimiter
+from nmdc_orcid_creditor.single_flight import SingleFlight
 
 client = TestClient(app)
 
+# An ORCID access token resembling one the app would have stored in the session of a signed-in user.
+signed_in_orcid_access_token = dict(
+    orcid="0000-0000-0000-0000",
+    name="Jane Doe",
+    access_token="fake-access-token",
+    expires_at=int((datetime.now() + timedelta(hours=1)).timestamp()),
+)
+
+
+def make_credit(orcid_id: str = signed_in_orcid_access_token["orcid"], **kwargs) -> dict:
+    r"""Returns a credit resembling one the proxy would return, having the specified column values."""
+
+    return {
+        "column.ORCID_ID": orcid_id,
+        "column.CREDIT_TYPE": "Ambassador 2023",
+        "column.AFFILIATION_TYPE": "service",
+        "column.START_DATE": "2023-01-01T08:00:00.000Z",
+        "column.END_DATE": "2023-12-31T08:00:00.000Z",
+        "column.DETAILS_URL": "",
+        "column.CLAIMED_AT": "",
+        "column.AFFILIATION_PUT_CODE": "",
+        **kwargs,
+    }
+
+
+class MockUpstream:
+    r"""
+    A stand-in for the proxy and the ORCID API, which keeps track of the requests it receives.
+
+    Its credits are claimed the way the real proxy would claim them.
+    """
+
+    def __init__(self, credits: list, latency_seconds: float = 0):
+        self.credits = credits
+        self.latency_seconds = latency_seconds
+        self.requests: list[httpx.Request] = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        put_code = 12345 + self.count("POST", request.url.host) - 1  # for requests to the ORCID API
+        await asyncio.sleep(self.latency_seconds)
+        params = request.url.params
+        if request.url.host == "proxy.example.com" and request.method == "GET":
+            return httpx.Response(200, json=dict(orcid_id=params["orcid_id"], credits=self.credits))
+        elif request.url.host == "proxy.example.com" and request.method == "POST":
+            claims = json.loads(request.content)["claims"] if params.get("action") == "claim_batch" else [params]
+            for claim in claims:
+                self.claim(claim["credit_type"], claim["start_date"], claim["end_date"], claim["affiliation_put_code"])
+            return httpx.Response(200, json=dict(orcid_id=params["orcid_id"], credits=self.credits))
+        else:  # ORCID API
+            return httpx.Response(201, headers={"location": f"{request.url}/{put_code}"})
+
+    def claim(self, credit_type: str, start_date: str, end_date: str, affiliation_put_code: str) -> None:
+        for credit in self.credits:
+            if (
+                credit["column.CREDIT_TYPE"] == credit_type
+                and credit["column.START_DATE"] == start_date
+                and credit["column.END_DATE"] == end_date
+                and credit["column.CLAIMED_AT"] == ""
+            ):
+                credit["column.CLAIMED_AT"] = "2024-06-01T12:00:00.000Z"
+                credit["column.AFFILIATION_PUT_CODE"] = affiliation_put_code
+                break
+
+    def count(self, method: str, host: str) -> int:
+        return len([r for r in self.requests if r.method == method and r.url.host == host])
+
+
+def send_concurrently(requests: list[dict]) -> list[httpx.Response]:
+    r"""Sends the specified requests (each being the keyword arguments for `httpx.AsyncClient.request`) concurrently."""
+
+    async def send_requests():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            return await asyncio.gather(*[async_client.request(**request) for request in requests])
+
+    return asyncio.run(send_requests())
+
+
+@pytest.fixture(autouse=True, scope="module")
+def app_lifespan(tmp_path_factory):
+    r"""Runs the app's startup and shutdown logic around the tests in this module."""
+
+    original_claim_outbox_path = cfg.CLAIM_OUTBOX_PATH
+    cfg.CLAIM_OUTBOX_PATH = str(tmp_path_factory.mktemp("claim_outbox") / "claim_outbox.sqlite3")
+    with client:
+        # Note: The tests send requests much faster than users would, so we disable the rate limits (except where a
+        #       test enables them).
+        app.state.session_rate_limiter = KeyedRateLimiter(rate_per_second=0, burst=0)
+        app.state.orcid_id_rate_limiter = KeyedRateLimiter(rate_per_second=0, burst=0)
+        yield
+    cfg.CLAIM_OUTBOX_PATH = original_claim_outbox_path
+
+
+@pytest.fixture
+def signed_in():
+    r"""Makes the app behave as though the client is signed in, for the duration of a test."""
+
+    app.dependency_overrides[get_orcid_access_token] = lambda: signed_in_orcid_access_token
+    yield signed_in_orcid_access_token
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def use_mock_upstream(monkeypatch):
+    r"""
+    Returns a function that makes the app send its upstream HTTP requests to the specified handler
+    instead of to the network, for the duration of a test.
+    """
+
+    monkeypatch.setattr(cfg, "NMDC_ORCID_CREDITOR_PROXY_URL", "https://proxy.example.com/exec")
+    monkeypatch.setattr(cfg, "ORCID_API_BASE_URL", "https://api.sandbox.orcid.org/v3.0")
+
+    def _use_mock_upstream(handler) -> None:
+        mock_http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        mock_proxy_store = ProxyCreditStore(
+            mock_http_client,
+            proxy_url=cfg.NMDC_ORCID_CREDITOR_PROXY_URL,
+            shared_secret=cfg.NMDC_ORCID_CREDITOR_PROXY_SHARED_SECRET,
+        )
+        mock_credit_store = CachingCreditStore(mock_proxy_store, app.state.credits_cache)
+        app.dependency_overrides[get_http_client] = lambda: mock_http_client
+        app.dependency_overrides[get_credit_store] = lambda: mock_credit_store
+
+    app.state.credits_cache.clear()
+    yield _use_mock_upstream
+    app.dependency_overrides.clear()
+
 
 def test_get_root():
     response = client.get("/")
     assert response.status_code == 200
 
 
+def test_pages_link_to_fingerprinted_static_files():
+    response = client.get("/")
+    fingerprinted_path = static_files.get_fingerprinted_path("/favicon.png")
+
+    # Test: The page links to the fingerprinted URL of the favicon, which can be cached indefinitely.
+    assert fingerprinted_path != "/favicon.png"
+    assert f"/static{fingerprinted_path}" in response.text
+    response = client.get(f"/static{fingerprinted_path}")
+    assert response.status_code == 200
+    assert "immutable" in response.headers["cache-control"]
+
+
 def test_get_redirect_to_orcid_login_page():
     # Test: Initial response is an HTTP redirect.
     response = client.get("/redirect-to-orcid-login-page", follow_redirects=False)
     assert response.is_redirect
 
-    # Test: Ultimate destination is an ORCID URL.
-    response = client.get("/redirect-to-orcid-login-page")
-    assert response.url.host.endswith("orcid.org")
+    # Test: Destination is an ORCID URL.
+    #
+    # Note: We don't follow the redirect, so that the test doesn't depend upon (or send requests to) ORCID.
+    #
+    assert httpx.URL(response.headers["location"]).host.endswith("orcid.org")
 
 
 def test_get_exchange_code_for_token():
@@ -45,6 +208,60 @@ def test_validate_orcid_access_token():
     assert isinstance(orcid_access_token, dict)
 
 
+def test_get_orcid_access_token_refreshes_token():
+    refresh_requests = []
+
+    async def handle_token_request(request: httpx.Request) -> httpx.Response:
+        refresh_requests.append(request)
+        await asyncio.sleep(0.05)
+        if b"refresh_token=revoked" in request.content:
+            return httpx.Response(400, json={"error": "invalid_grant"})
+        if b"refresh_token=malformed" in request.content:
+            return httpx.Response(200, json=dict(access_token="new-access-token"))  # lacks `expires_in`
+        return httpx.Response(
+            200,
+            json=dict(access_token="new-access-token", refresh_token="new-refresh-token", expires_in=3600),
+        )
+
+    def make_token(expires_in_seconds: int, refresh_token: str = "refresh-token") -> dict:
+        expires_at = int(datetime.now().timestamp()) + expires_in_seconds
+        return {**signed_in_orcid_access_token, "refresh_token": refresh_token, "expires_at": expires_at}
+
+    async def get_tokens(sessions: list[dict]) -> list:
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handle_token_request))
+        args = (http_client, SingleFlight(), TTLCache(ttl_seconds=60, max_entries=10))
+        tokens = await asyncio.gather(
+            *[get_orcid_access_token(SimpleNamespace(session=session), *args) for session in sessions]
+        )
+        await asyncio.sleep(0.1)  # lets any background refresh finish
+        tokens.append(await get_orcid_access_token(SimpleNamespace(session=sessions[0]), *args))
+        return tokens
+
+    # Test: An expired token is refreshed before it is returned, via a single request shared by concurrent requests.
+    sessions = [{"orcid_access_token": make_token(expires_in_seconds=-60)} for _ in range(5)]
+    tokens = asyncio.run(get_tokens(sessions))
+    assert len(refresh_requests) == 1
+    assert all(token["access_token"] == "new-access-token" for token in tokens)
+    assert tokens[0]["orcid"] == signed_in_orcid_access_token["orcid"]  # kept from the original token
+    assert sessions[1]["orcid_access_token"]["refresh_token"] == "new-refresh-token"
+
+    # Test: A token that is about to expire is returned as is, while it is refreshed in the background; and the
+    #       session's next request gets the new token (without refreshing it again).
+    refresh_requests.clear()
+    sessions = [{"orcid_access_token": make_token(expires_in_seconds=60)}]
+    tokens = asyncio.run(get_tokens(sessions))
+    assert [token["access_token"] for token in tokens] == ["fake-access-token", "new-access-token"]
+    assert len(refresh_requests) == 1
+
+    # Test: If ORCID rejects the refresh token, an expired token is treated as invalid (so the user has to log in).
+    sessions = [{"orcid_access_token": make_token(expires_in_seconds=-60, refresh_token="revoked")}]
+    assert asyncio.run(get_tokens(sessions)) == [None, None]
+
+    # Test: If ORCID responds with something other than a token, the refresh fails (rather than raising an error).
+    sessions = [{"orcid_access_token": make_token(expires_in_seconds=-60, refresh_token="malformed")}]
+    assert asyncio.run(get_tokens(sessions)) == [None, None]
+
+
 def test_logout():
     # Test: Initial response is an HTTP redirect.
     response = client.get("/logout", follow_redirects=False)
@@ -67,6 +284,56 @@ def test_get_credits():
     # TODO: Add test involving a sufficient request (one having a valid ORCID access token).
 
 
+def test_get_credits_embeds_credits(signed_in, use_mock_upstream, monkeypatch):
+    mock_upstream = MockUpstream(credits=[make_credit()])
+    use_mock_upstream(mock_upstream)
+
+    # Test: The page contains the credits (and their ETag), so the client doesn't have to fetch them.
+    response = client.get("/credits")
+    assert response.status_code == 200
+    assert "private" in response.headers["cache-control"]
+    assert 'class="initial-credits"' in response.text
+    assert "Ambassador 2023" in response.text
+    assert mock_upstream.count("GET", "proxy.example.com") == 1
+
+    # Test: The embedded ETag is the one the API would respond with.
+    etag = client.get("/api/credits").headers["etag"]
+    assert json.dumps(etag)[1:-1] in response.text
+
+    # Test: If the credits take too long to load, the page is rendered without them.
+    app.state.credits_cache.clear()
+    mock_upstream.latency_seconds = 0.2
+    monkeypatch.setattr(cfg, "CREDITS_PAGE_INLINE_WAIT_SECONDS", 0.01)
+    response = client.get("/credits")
+    assert response.status_code == 200
+    assert 'class="initial-credits"' not in response.text
+
+    # Test: The page's own request for the credits joins the fetch that is still in progress.
+    assert client.get("/api/credits").json()["credits"] == [make_credit()]
+    assert mock_upstream.count("GET", "proxy.example.com") == 2
+
+
+def test_get_exchange_code_for_token_prefetches_credits(use_mock_upstream, monkeypatch):
+    mock_upstream = MockUpstream(credits=[make_credit()], latency_seconds=0.1)
+    use_mock_upstream(mock_upstream)
+
+    async def authorize_access_token(request):
+        return signed_in_orcid_access_token
+
+    monkeypatch.setattr(oauth.orcid, "authorize_access_token", authorize_access_token)
+
+    # Test: Logging in starts fetching the user's credits, without waiting for them.
+    response = client.get("/exchange-code-for-token", follow_redirects=False)
+    assert response.is_redirect
+    assert app.state.single_flight.num_in_flight == 1
+
+    # Test: The "Credits" page uses the credits that fetch got, rather than fetching them again.
+    response = client.get("/credits")
+    client.get("/logout")
+    assert "Ambassador 2023" in response.text
+    assert mock_upstream.count("GET", "proxy.example.com") == 1
+
+
 def test_get_api_credits():
     # Test: If request lacks valid ORCID access token, returns an HTTP 401 response.
     response = client.get("/api/credits")
@@ -85,3 +352,403 @@ def test_post_api_credits_claim():
     assert response.status_code == 401
 
     # TODO: Add test involving a sufficient request (one having a valid ORCID access token).
+
+
+def test_get_api_credits_handles_concurrent_requests_concurrently(signed_in, use_mock_upstream):
+    proxy_latency_seconds = 0.2
+    num_requests = 5
+
+    async def handle_proxy_request(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(proxy_latency_seconds)
+        return httpx.Response(200, json=dict(orcid_id=request.url.params["orcid_id"], credits=[]))
+
+    use_mock_upstream(handle_proxy_request)
+
+    started_at = time.perf_counter()
+    responses = send_concurrently([dict(method="GET", url="/api/credits")] * num_requests)
+    elapsed_seconds = time.perf_counter() - started_at
+
+    # Test: All requests succeeded.
+    assert all(response.status_code == 200 for response in responses)
+    assert all(response.json()["orcid_id"] == signed_in["orcid"] for response in responses)
+
+    # Test: The requests' waits for the proxy overlapped, rather than happening one after another.
+    assert elapsed_seconds < proxy_latency_seconds * num_requests / 2
+
+
+def test_get_api_credits_uses_cache(signed_in, use_mock_upstream):
+    mock_upstream = MockUpstream(credits=[make_credit()])
+    use_mock_upstream(mock_upstream)
+
+    # Test: Only the first of multiple requests reaches the proxy.
+    for _ in range(3):
+        response = client.get("/api/credits")
+        assert response.status_code == 200
+        assert response.json()["credits"] == [make_credit()]
+    assert mock_upstream.count("GET", "proxy.example.com") == 1
+
+    # Test: The cache's counters reflect those requests.
+    stats = client.get("/api/credits-cache/stats").json()
+    assert stats["hits"] >= 2
+    assert stats["entries"] == 1
+
+
+def test_get_api_credits_supports_conditional_requests(signed_in, use_mock_upstream):
+    use_mock_upstream(MockUpstream(credits=[make_credit()]))
+
+    # Test: The response has an ETag, and tells shared caches not to store it.
+    response = client.get("/api/credits")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert "private" in response.headers["cache-control"]
+
+    # Test: If the client already has the current credits, the response has a 304 status and no body.
+    response = client.get("/api/credits", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+    # Test: If the client has some other version of the credits, the response contains the current credits.
+    response = client.get("/api/credits", headers={"If-None-Match": '"something-else"'})
+    assert response.status_code == 200
+    assert response.json()["credits"] == [make_credit()]
+
+
+def test_get_api_credits_compresses_large_responses(signed_in, use_mock_upstream):
+    credits = [make_credit(**{"column.CREDIT_TYPE": f"Ambassador {i}"}) for i in range(100)]
+    use_mock_upstream(MockUpstream(credits=credits))
+
+    # Test: Large responses are compressed, for clients that accept that.
+    response = client.get("/api/credits", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert response.json()["credits"] == credits
+
+    # Test: ...and not for clients that don't.
+    response = client.get("/api/credits", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+
+
+def test_post_api_credits_claim_updates_cache(signed_in, use_mock_upstream):
+    mock_upstream = MockUpstream(credits=[make_credit()])
+    use_mock_upstream(mock_upstream)
+
+    # Test: Claiming a credit creates an affiliation and records the claim.
+    response = client.post(
+        "/api/credits/claim",
+        json=dict(
+            credit_type="Ambassador 2023",
+            start_date="2023-01-01T08:00:00.000Z",
+            end_date="2023-12-31T08:00:00.000Z",
+        ),
+    )
+    assert response.status_code == 200
+    assert response.json()["credits"][0]["column.AFFILIATION_PUT_CODE"] == "12345"
+    assert mock_upstream.count("POST", "api.sandbox.orcid.org") == 1
+    assert mock_upstream.count("POST", "proxy.example.com") == 1
+
+    # Test: Reading the credits afterward is served from the cache, which reflects the claim.
+    num_requests_before = len(mock_upstream.requests)
+    response = client.get("/api/credits")
+    assert response.json()["credits"][0]["column.AFFILIATION_PUT_CODE"] == "12345"
+    assert len(mock_upstream.requests) == num_requests_before
+
+
+def test_get_api_stats(signed_in, use_mock_upstream, monkeypatch):
+    credits = [make_credit(), make_credit(**{"column.CREDIT_TYPE": "Champion 2023"})]
+    use_mock_upstream(MockUpstream(credits=credits))
+    credit_stats = CreditStats(credit_store=None, reseed_interval_seconds=60)
+    app.dependency_overrides[get_credit_stats] = lambda: credit_stats
+
+    # Test: The endpoint is disabled unless an admin API key is configured; and then requires that key.
+    assert client.get("/api/stats").status_code == 403
+    monkeypatch.setattr(cfg, "ADMIN_API_KEY", "admin-key")
+    assert client.get("/api/stats", headers={"Authorization": "Bearer wrong-key"}).status_code == 401
+    headers = {"Authorization": "Bearer admin-key"}
+
+    # Test: The endpoint is unavailable until the statistics have been seeded.
+    assert client.get("/api/stats", headers=headers).status_code == 503
+    credit_stats.seed_from_credits(credits)
+
+    # Test: Claims are counted as they are made.
+    payload = dict(
+        credit_type="Ambassador 2023", start_date="2023-01-01T08:00:00.000Z", end_date="2023-12-31T08:00:00.000Z"
+    )
+    assert client.post("/api/credits/claim", json=payload).status_code == 200
+    response = client.get("/api/stats", headers=headers, params={"granularity": "day"})
+    assert response.status_code == 200
+    report = response.json()
+    assert (report["num_credits"], report["num_claimed"], report["claim_rate"]) == (2, 1, 0.5)
+    ambassador, champion = report["credit_types"]
+    assert (ambassador["credit_type"], ambassador["num_claimed"], champion["num_claimed"]) == ("Ambassador 2023", 1, 0)
+    assert ambassador["buckets"] == [
+        {
+            "bucket": datetime.now(timezone.utc).date().isoformat(),
+            "num_claims": 1,
+            "num_claimed_by_end": 1,
+            "claim_rate_by_end": 1.0,
+        }
+    ]
+
+    # Test: The report can be limited to one credit type.
+    response = client.get("/api/stats", headers=headers, params={"credit_type": "Champion 2023"})
+    assert [r["credit_type"] for r in response.json()["credit_types"]] == ["Champion 2023"]
+
+
+def test_api_endpoints_limit_request_rate(signed_in, use_mock_upstream, monkeypatch):
+    use_mock_upstream(MockUpstream(credits=[make_credit()]))
+    monkeypatch.setattr(app.state, "orcid_id_rate_limiter", KeyedRateLimiter(rate_per_second=0.1, burst=2))
+
+    # Test: Requests beyond the ORCID ID's burst are rejected, with a hint as to when to try again.
+    assert [client.get("/api/credits").status_code for _ in range(2)] == [200, 200]
+    response = client.get("/api/credits")
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["Retry-After"]) <= 10
+
+
+def test_api_endpoints_report_overloaded_credit_store(signed_in):
+    class OverloadedCreditStore:
+        async def list_credits(self, *args) -> list[dict]:
+            raise CreditStoreOverloadedError("Too many requests to proxy are waiting already", retry_after_seconds=2.5)
+
+        find_unclaimed_credit = list_credits
+
+    app.dependency_overrides[get_credit_store] = lambda: OverloadedCreditStore()
+
+    # Test: When the credit store turns a request away, the client is told to try again later.
+    payload = dict(credit_type="Ambassador 2023", start_date="", end_date="")
+    for response in (client.get("/api/credits"), client.post("/api/credits/claim", json=payload)):
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "3"
+
+
+def test_get_api_traces(signed_in, use_mock_upstream, monkeypatch):
+    mock_upstream = MockUpstream(credits=[make_credit()])
+    use_mock_upstream(mock_upstream)
+    monkeypatch.setattr(cfg, "ADMIN_API_KEY", "admin-key")
+    payload = dict(
+        credit_type="Ambassador 2023", start_date="2023-01-01T08:00:00.000Z", end_date="2023-12-31T08:00:00.000Z"
+    )
+    traceparent = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+    assert client.post("/api/credits/claim", json=payload, headers={"traceparent": traceparent}).status_code == 200
+
+    # Test: The claim's trace continues the client's trace, and has a span for each upstream request.
+    response = client.get("/api/traces", headers={"Authorization": "Bearer admin-key"}, params={"limit": 1})
+    assert response.status_code == 200
+    [trace] = response.json()
+    assert trace["trace_id"] == "0af7651916cd43dd8448eb211c80319c"
+    root, *upstream_spans = trace["spans"]
+    assert (root["name"], root["parent_span_id"]) == ("POST /api/credits/claim", "b7ad6b7169203331")
+    assert root["attributes"] == {"credit_type": "Ambassador 2023", "http.status_code": 200}
+    assert [span["name"] for span in upstream_spans] == ["proxy_get", "orcid_affiliation_post", "proxy_post"]
+    assert all(span["parent_span_id"] == root["span_id"] for span in upstream_spans)
+    assert upstream_spans[1]["attributes"] == {"credit_type": "Ambassador 2023", "http.status_code": 201}
+
+    # Test: The trace was propagated to the proxy.
+    expected_traceparent = f"00-{trace['trace_id']}-{upstream_spans[2]['span_id']}-01"
+    assert mock_upstream.requests[-1].url.params["traceparent"] == expected_traceparent
+
+
+def test_post_api_credits_claim_batch(signed_in, use_mock_upstream):
+    credit_a = make_credit(**{"column.CREDIT_TYPE": "Ambassador 2023"})
+    credit_b = make_credit(**{"column.CREDIT_TYPE": "Champion 2023", "column.AFFILIATION_TYPE": "membership"})
+    mock_upstream = MockUpstream(credits=[credit_a, credit_b])
+    use_mock_upstream(mock_upstream)
+
+    requested_credits = [
+        dict(credit_type=c["column.CREDIT_TYPE"], start_date=c["column.START_DATE"], end_date=c["column.END_DATE"])
+        for c in (credit_a, credit_b)
+    ] + [dict(credit_type="Nonexistent", start_date="", end_date="")]
+    response = client.post("/api/credits/claim-batch", json=dict(credits=requested_credits))
+    assert response.status_code == 200
+
+    # Test: Each existing credit was claimed; and the nonexistent one was reported as having failed.
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == ["claimed", "claimed", "failed"]
+    assert sorted(result["affiliation_put_code"] for result in results[:2]) == ["12345", "12346"]
+    assert all(credit["column.CLAIMED_AT"] != "" for credit in response.json()["credits"])
+
+    # Test: The credits were fetched once, and the claims were recorded in a single request.
+    assert mock_upstream.count("GET", "proxy.example.com") == 1
+    assert mock_upstream.count("POST", "api.sandbox.orcid.org") == 2
+    assert mock_upstream.count("POST", "proxy.example.com") == 1
+
+
+def test_post_api_credits_claim_coalesces_concurrent_duplicates(signed_in, use_mock_upstream):
+    mock_upstream = MockUpstream(credits=[make_credit()], latency_seconds=0.05)
+    use_mock_upstream(mock_upstream)
+
+    # Simulate a user double-clicking the "Claim" button.
+    credit = make_credit()
+    payload = dict(
+        credit_type=credit["column.CREDIT_TYPE"],
+        start_date=credit["column.START_DATE"],
+        end_date=credit["column.END_DATE"],
+    )
+    responses = send_concurrently([dict(method="POST", url="/api/credits/claim", json=payload)] * 2)
+
+    # Test: Both requests received the outcome of a single claim.
+    assert [response.status_code for response in responses] == [200, 200]
+    assert responses[0].json() == responses[1].json()
+    assert mock_upstream.count("POST", "api.sandbox.orcid.org") == 1
+
+
+def test_post_api_credits_claim_replays_response_to_idempotency_key(signed_in, use_mock_upstream):
+    mock_upstream = MockUpstream(credits=[make_credit()])
+    use_mock_upstream(mock_upstream)
+
+    credit = make_credit()
+    payload = dict(
+        credit_type=credit["column.CREDIT_TYPE"],
+        start_date=credit["column.START_DATE"],
+        end_date=credit["column.END_DATE"],
+    )
+    headers = {"Idempotency-Key": "d9b4c3a4-0b6c-4f4e-9a57-3f0e8a1b2c3d"}
+    first_response = client.post("/api/credits/claim", json=payload, headers=headers)
+    num_requests_before = len(mock_upstream.requests)
+    second_response = client.post("/api/credits/claim", json=payload, headers=headers)
+
+    # Test: The retried request received the original response, without the app contacting any upstream services.
+    assert second_response.status_code == 200
+    assert second_response.json() == first_response.json()
+    assert second_response.headers["Idempotent-Replayed"] == "true"
+    assert len(mock_upstream.requests) == num_requests_before
+
+
+def test_get_api_credits_coalesces_concurrent_fetches(signed_in, use_mock_upstream):
+    mock_upstream = MockUpstream(credits=[make_credit()], latency_seconds=0.05)
+    use_mock_upstream(mock_upstream)
+
+    responses = send_concurrently([dict(method="GET", url="/api/credits")] * 5)
+
+    # Test: All requests were served by a single fetch from the proxy.
+    assert all(response.json()["credits"] == [make_credit()] for response in responses)
+    assert mock_upstream.count("GET", "proxy.example.com") == 1
+
+
+def get_metric_value(metrics_text: str, sample: str) -> float:
+    r"""Returns the value of the specified sample (e.g. 'http_requests_in_flight') in the `/metrics` response text."""
+
+    for line in metrics_text.splitlines():
+        name, _, value = line.rpartition(" ")
+        if name == sample:
+            return float(value)
+    return 0.0
+
+
+def test_get_metrics(signed_in, use_mock_upstream):
+    mock_upstream = MockUpstream(credits=[make_credit()])
+    use_mock_upstream(mock_upstream)
+    credit = make_credit()
+    payload = dict(
+        credit_type=credit["column.CREDIT_TYPE"],
+        start_date=credit["column.START_DATE"],
+        end_date=credit["column.END_DATE"],
+    )
+
+    metrics_before = client.get("/metrics").text
+    assert client.post("/api/credits/claim", json=payload).status_code == 200
+    assert client.post("/api/credits/claim", json=payload).status_code == 400  # already claimed
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    def increase(sample: str) -> float:
+        return get_metric_value(response.text, sample) - get_metric_value(metrics_before, sample)
+
+    # Test: The claims' outcomes, upstream requests, and requests to the app itself were all recorded.
+    assert increase('claim_outcomes_total{outcome="claimed"}') == 1
+    assert increase('claim_outcomes_total{outcome="no_match"}') == 1
+    assert increase('upstream_request_duration_seconds_count{upstream="orcid_affiliation_post"}') == 1
+    assert increase('upstream_request_duration_seconds_count{upstream="proxy_post"}') == 1
+    assert increase('http_requests_total{method="POST",route="/api/credits/claim",status="200"}') == 1
+    assert increase('http_requests_total{method="POST",route="/api/credits/claim",status="400"}') == 1
+    assert get_metric_value(response.text, "http_requests_in_flight") == 1  # i.e. the request for the metrics
+
+
+def parse_server_sent_events(text: str) -> list[tuple[str, str, dict]]:
+    r"""Returns the (ID, name, data) of each event in the specified stream of Server-Sent Events."""
+
+    events = []
+    for message in text.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in message.splitlines() if not line.startswith(":"))
+        if "event" in fields:
+            events.append((fields["id"], fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_post_api_credits_claim_reports_progress_as_server_sent_events(signed_in, use_mock_upstream):
+    mock_upstream = MockUpstream(credits=[make_credit()])
+    use_mock_upstream(mock_upstream)
+
+    credit = make_credit()
+    payload = dict(
+        credit_type=credit["column.CREDIT_TYPE"],
+        start_date=credit["column.START_DATE"],
+        end_date=credit["column.END_DATE"],
+    )
+    response = client.post("/api/credits/claim", json=payload, headers={"Prefer": "respond-async"})
+
+    # Test: The app responded right away, with the URL of the claim's progress report.
+    assert response.status_code == 202
+    assert response.headers["Preference-Applied"] == "respond-async"
+    progress_url = response.json()["progress_url"]
+    assert response.headers["Location"] == progress_url
+
+    # Test: The progress report contains each stage of the claim, in order; followed by the refreshed credits, and
+    #       what the endpoint would otherwise have responded with.
+    response = client.get(progress_url)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/event-stream")
+    events = parse_server_sent_events(response.text)
+    assert [name for _, name, _ in events] == [
+        "credit_validated",
+        "affiliation_created",
+        "claim_recorded",
+        "credits",
+        "done",
+    ]
+    assert events[1][2] == {**payload, "affiliation_put_code": "12345"}
+    assert events[3][2]["credits"][0]["column.CLAIMED_AT"] != ""
+    assert events[4][2]["credits"] == events[3][2]["credits"]
+
+    # Test: A client that reconnects receives only the events it missed.
+    response = client.get(progress_url, headers={"Last-Event-ID": "3"})
+    assert [(event_id, name) for event_id, name, _ in parse_server_sent_events(response.text)] == [
+        ("4", "credits"),
+        ("5", "done"),
+    ]
+
+    # Test: Progress reports that don't exist (or belong to other users) are not found.
+    assert client.get("/api/credits/claim-progress/nonexistent/events").status_code == 404
+
+
+def test_post_api_credits_claim_batch_reports_progress_as_server_sent_events(signed_in, use_mock_upstream):
+    credit = make_credit()
+    mock_upstream = MockUpstream(credits=[credit])
+    use_mock_upstream(mock_upstream)
+
+    requested_credits = [
+        dict(credit_type=credit["column.CREDIT_TYPE"], start_date=credit["column.START_DATE"], end_date=""),
+        dict(
+            credit_type=credit["column.CREDIT_TYPE"],
+            start_date=credit["column.START_DATE"],
+            end_date=credit["column.END_DATE"],
+        ),
+    ]
+    response = client.post(
+        "/api/credits/claim-batch", json=dict(credits=requested_credits), headers={"Prefer": "respond-async"}
+    )
+    assert response.status_code == 202
+    events = parse_server_sent_events(client.get(response.json()["progress_url"]).text)
+
+    # Test: The credit that didn't match any was reported as having failed; and the other one, as having been claimed.
+    assert [(name, data.get("end_date")) for _, name, data in events] == [
+        ("claim_failed", ""),
+        ("credit_validated", credit["column.END_DATE"]),
+        ("affiliation_created", credit["column.END_DATE"]),
+        ("claim_recorded", credit["column.END_DATE"]),
+        ("credits", None),
+        ("done", None),
+    ]
+    assert [result["status"] for result in events[-1][2]["results"]] == ["failed", "claimed"]
@@ -0,0 +1,87 @@
+import asyncio
+
+import httpx
+
+from nmdc_orcid_creditor.config import Config
+from nmdc_orcid_creditor.credit_store import ProxyCreditStore
+from nmdc_orcid_creditor.mock_services import HostRoutingTransport, MockOrcid, MockProxy, make_orcid_id
+from nmdc_orcid_creditor.reconcile import Reconciler, get_read_public_access_token
+from nmdc_orcid_creditor.resilience import RetryPolicy, TokenBucket
+
+
+def run_reconciler(proxy: MockProxy, orcid: MockOrcid, concurrency: int = 4) -> tuple[list[dict], dict]:
+    r"""Reconciles the mock proxy's sheet with the mock ORCID's records, and returns the report's entries and stats."""
+
+    config = Config(ORCID_ACCESS_TOKEN_URL="https://orcid.org/oauth/token", ORCID_CLIENT_ID=orcid.client_id)
+    transport = HostRoutingTransport({"proxy.test": proxy.app, "orcid.org": orcid.app})
+
+    async def reconcile():
+        async with httpx.AsyncClient(transport=transport) as http_client:
+            reconciler = Reconciler(
+                ProxyCreditStore(http_client, proxy_url="https://proxy.test/exec", shared_secret=""),
+                http_client,
+                public_api_base_url="https://pub.orcid.org/v3.0",
+                access_token=await get_read_public_access_token(http_client, config),
+                client_id=orcid.client_id,
+                concurrency=concurrency,
+                rate_limiter=TokenBucket(rate_per_second=1000, burst=100),
+                retry_policy=RetryPolicy(max_attempts=5, base_delay_seconds=0, max_delay_seconds=0),
+                page_size=7,
+            )
+            entries = []
+            stats = await reconciler.run(entries.append)
+            return entries, stats
+
+    return asyncio.run(reconcile())
+
+
+def test_reconciler_reports_discrepancies():
+    proxy = MockProxy(num_rows=40, num_users=10)
+    orcid = MockOrcid(num_users=10, error_rate=0.3)  # some requests fail, and get retried
+
+    def claim(user_index: int, credit_index: int, put_code: int) -> None:
+        credit = proxy.credits_by_orcid_id[make_orcid_id(user_index)][credit_index]
+        credit["column.CLAIMED_AT"] = "2024-06-01T12:00:00.000Z"
+        credit["column.AFFILIATION_PUT_CODE"] = put_code
+
+    # A claim that matches its affiliation.
+    claim(1, 0, orcid.add_affiliation(make_orcid_id(1), "service", "Ambassador 1", "2023-01-01", "2023-12-31"))
+
+    # A claim whose affiliation has different dates.
+    claim(2, 0, orcid.add_affiliation(make_orcid_id(2), "service", "Ambassador 2", "2022-01-01", "2023-12-31"))
+
+    # A claim whose affiliation doesn't exist.
+    claim(3, 0, 99999)
+
+    # An affiliation the app created, whose claim wasn't recorded; and one the app didn't create.
+    orphaned_put_code = orcid.add_affiliation(make_orcid_id(4), "service", "Ambassador 4", "2023-01-01", None)
+    orcid.add_affiliation(make_orcid_id(4), "membership", "Member", "2020-01-01", None, source_client_id="APP-OTHER")
+
+    entries, stats = run_reconciler(proxy, orcid)
+
+    # Test: The whole sheet was read, and each ORCID record was read (although some requests failed at first).
+    assert stats["num_rows"] == 40
+    assert stats["num_orcid_ids"] == 10
+    assert stats["num_orcid_requests"] > 10
+
+    # Test: Exactly the discrepancies were reported.
+    assert sorted((entry["kind"], entry["orcid_id"]) for entry in entries) == [
+        ("mismatched_dates", make_orcid_id(2)),
+        ("missing", make_orcid_id(3)),
+        ("orphaned", make_orcid_id(4)),
+    ]
+    mismatched = next(entry for entry in entries if entry["kind"] == "mismatched_dates")
+    assert mismatched["sheet_dates"] == {"start": "2023-01-01", "end": "2023-12-31"}
+    assert mismatched["orcid_dates"] == {"start": "2022-01-01", "end": "2023-12-31"}
+    assert next(entry for entry in entries if entry["kind"] == "orphaned")["put_code"] == str(orphaned_put_code)
+
+
+def test_reconciler_reports_records_it_cannot_read():
+    proxy = MockProxy(num_rows=4, num_users=2)
+    orcid = MockOrcid(num_users=2, error_rate=1.0)
+
+    entries, stats = run_reconciler(proxy, orcid, concurrency=1)
+
+    # Test: Each ORCID record was attempted the maximum number of times, then reported as an error.
+    assert [entry["kind"] for entry in entries] == ["error", "error"]
+    assert stats["num_orcid_requests"] == 2 * 5
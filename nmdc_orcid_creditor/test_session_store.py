@@ -0,0 +1,117 @@
+import asyncio
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from nmdc_orcid_creditor.session_store import InMemorySessionStore, SQLiteSessionStore, ServerSideSessionMiddleware
+
+orcid_access_token = dict(orcid="0000-0000-0000-0001", name="Jane Doe", access_token="fake-access-token")
+
+
+def make_client() -> TestClient:
+    r"""Returns a client of a minimal app that uses the server-side session middleware and an in-memory store."""
+
+    app = FastAPI()
+    app.state.session_store = InMemorySessionStore(max_age_seconds=60, sweep_interval_seconds=60)
+    app.add_middleware(ServerSideSessionMiddleware, secret_key="secret")
+
+    @app.get("/login")
+    def login(request: Request):
+        request.session["orcid_access_token"] = orcid_access_token
+
+    @app.get("/refresh")
+    def refresh(request: Request):
+        request.session["orcid_access_token"] = {**orcid_access_token, "access_token": "refreshed-access-token"}
+
+    @app.get("/login-as-someone-else")
+    def login_as_someone_else(request: Request):
+        request.session["orcid_access_token"] = {**orcid_access_token, "orcid": "0000-0000-0000-0002"}
+
+    @app.get("/whoami")
+    def whoami(request: Request):
+        return request.session.get("orcid_access_token")
+
+    @app.get("/logout")
+    def logout(request: Request):
+        request.session.clear()
+
+    @app.get("/static/favicon.ico")
+    def favicon(request: Request):
+        return request.session
+
+    return TestClient(app)
+
+
+def test_server_side_session_middleware():
+    client = make_client()
+    session_store = client.app.state.session_store
+
+    client.get("/login")
+    cookie_value = client.cookies["session"]
+
+    # Test: The cookie contains only the (signed) session ID; the session's contents are stored on the server.
+    assert "fake-access-token" not in cookie_value
+    session_id = cookie_value.partition(".")[0]
+    assert asyncio.run(session_store.load(session_id))["orcid_access_token"] == orcid_access_token
+    assert client.get("/whoami").json() == orcid_access_token
+
+    # Test: Requests for static files don't load the session.
+    assert client.get("/static/favicon.ico").json() == {}
+
+    # Test: A tampered-with session ID is ignored.
+    client.cookies["session"] = f"{session_id}x.{cookie_value.partition('.')[2]}"
+    assert client.get("/whoami").json() is None
+    client.cookies["session"] = cookie_value
+
+    # Test: Logging out deletes the session from the store (so the old cookie no longer works).
+    client.get("/logout")
+    assert asyncio.run(session_store.load(session_id)) is None
+    client.cookies["session"] = cookie_value
+    assert client.get("/whoami").json() is None
+
+
+def test_server_side_session_middleware_rotates_session_id_only_when_user_changes():
+    client = make_client()
+    client.get("/login")
+    cookie_value = client.cookies["session"]
+
+    # Test: Changing the session without changing its user (e.g. refreshing the access token) keeps its ID; so
+    #       another request using the same cookie (e.g. made concurrently from another tab) still sees the session,
+    #       including the change.
+    client.get("/refresh")
+    assert client.cookies["session"] == cookie_value
+    other_client = make_client()
+    other_client.app.state.session_store = client.app.state.session_store
+    other_client.cookies["session"] = cookie_value
+    assert other_client.get("/whoami").json()["access_token"] == "refreshed-access-token"
+
+    # Test: Changing the session's user (i.e. logging in) gives it a new ID, and the old one no longer works.
+    client.get("/login-as-someone-else")
+    assert client.cookies["session"] != cookie_value
+    assert client.get("/whoami").json()["orcid"] == "0000-0000-0000-0002"
+    assert other_client.get("/whoami").json() is None
+
+
+def test_sqlite_session_store_sweeps_expired_sessions(tmp_path):
+    now = 0.0
+    store = SQLiteSessionStore(
+        str(tmp_path / "sessions.sqlite3"), max_age_seconds=60, sweep_interval_seconds=60, clock=lambda: now
+    )
+
+    async def save_and_sweep():
+        await store.save("a", {"orcid_access_token": orcid_access_token})
+        nonlocal now
+        now = 30.0
+        await store.save("b", {"orcid_access_token": orcid_access_token})
+        now = 60.0
+        num_deleted = await store.sweep()
+        sessions = await store.load("a"), await store.load("b")
+        await store.aclose()
+        return num_deleted, sessions
+
+    num_deleted, (session_a, session_b) = asyncio.run(save_and_sweep())
+
+    # Test: Only the session that had expired was deleted.
+    assert num_deleted == 1
+    assert session_a is None
+    assert session_b == {"orcid_access_token": orcid_access_token}
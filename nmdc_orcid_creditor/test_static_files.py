@@ -0,0 +1,61 @@
+import gzip
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from nmdc_orcid_creditor.static_files import IMMUTABLE_CACHE_CONTROL, FingerprintedStaticFiles
+
+svg_content = b'<svg xmlns="http://www.w3.org/2000/svg">' + b'<rect width="1" height="1" />' * 100 + b"</svg>"
+png_content = bytes(range(256)) * 4
+
+
+def make_client(tmp_path) -> TestClient:
+    r"""Returns a client of a minimal app that serves a directory containing an SVG file and a PNG file."""
+
+    (tmp_path / "images").mkdir()
+    (tmp_path / "images" / "picture.svg").write_bytes(svg_content)
+    (tmp_path / "favicon.png").write_bytes(png_content)
+
+    app = FastAPI()
+    app.mount("/static", FingerprintedStaticFiles(directory=str(tmp_path)), name="static")
+    return TestClient(app)
+
+
+def test_fingerprinted_static_files(tmp_path):
+    client = make_client(tmp_path)
+    static_files: FingerprintedStaticFiles = client.app.routes[-1].app
+    svg_path = static_files.get_fingerprinted_path("/images/picture.svg")
+    png_path = static_files.get_fingerprinted_path("/favicon.png")
+
+    # Test: Fingerprinted paths include a digest of the file's contents; other paths are left as is.
+    assert svg_path.startswith("/images/picture.") and svg_path.endswith(".svg") and svg_path != "/images/picture.svg"
+    assert static_files.get_fingerprinted_path("/missing.svg") == "/missing.svg"
+
+    # Test: Responses to requests for fingerprinted paths can be cached indefinitely.
+    response = client.get(f"/static{png_path}")
+    assert response.status_code == 200
+    assert response.content == png_content
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert "content-encoding" not in response.headers  # PNG images are not worth compressing
+
+    # Test: Compressible files are served precompressed, to clients that accept that.
+    response = client.get(f"/static{svg_path}", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.content == svg_content  # decompressed by the client
+    assert int(response.headers["content-length"]) == len(gzip.compress(svg_content, compresslevel=9, mtime=0))
+
+    # Test: ...and uncompressed, to clients that don't.
+    response = client.get(f"/static{svg_path}", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.content == svg_content
+
+    # Test: Conditional requests are supported.
+    response = client.get(f"/static{svg_path}", headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+
+    # Test: Requests for the original paths are still served, but without the long-lived caching.
+    response = client.get("/static/images/picture.svg")
+    assert response.status_code == 200
+    assert response.content == svg_content
+    assert "immutable" not in response.headers.get("cache-control", "")
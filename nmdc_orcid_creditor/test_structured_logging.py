@@ -0,0 +1,51 @@
+import io
+import json
+import logging
+import threading
+
+from nmdc_orcid_creditor.structured_logging import BackgroundLogging, JsonFormatter
+from nmdc_orcid_creditor.tracing import RingBufferExporter, Tracer
+
+
+class RecordingValue:
+    r"""A value that records the names of the threads it was formatted on."""
+
+    def __init__(self):
+        self.formatted_on = []
+
+    def __str__(self):
+        self.formatted_on.append(threading.current_thread().name)
+        return "value"
+
+
+def test_background_logging_formats_records_off_the_logging_thread():
+    logger = logging.getLogger("test_structured_logging")
+    logger.handlers, logger.propagate, logger.level = [], True, logging.NOTSET
+    stream = io.StringIO()
+    background_logging = BackgroundLogging(
+        logger_levels={logger.name: logging.INFO}, formatter=JsonFormatter(), debug_sample_rate=0.0, stream=stream
+    )
+    background_logging.start()
+
+    value = RecordingValue()
+    tracer = Tracer(RingBufferExporter(capacity=10), sample_rate=1.0)
+    with tracer.start_trace("GET /api/credits") as span:
+        logger.info("Sent %s to https://example.com/exec?shared_secret=s3cr3t", value, extra={"credit_type": "A"})
+    logger.debug("Not written: %s", value)  # below the level
+    logger.setLevel(logging.DEBUG)
+    logger.debug("Not written either: %s", value)  # not sampled
+    background_logging.stop()
+
+    # Test: The record was formatted (only once, and not on this thread), with its secret redacted and its extra
+    #       values and trace ID included.
+    assert value.formatted_on != [threading.current_thread().name]
+    assert len(value.formatted_on) == 1
+    (line,) = stream.getvalue().splitlines()
+    entry = json.loads(line)
+    assert entry["level"] == "INFO"
+    assert entry["message"] == "Sent value to https://example.com/exec?shared_secret=REDACTED"
+    assert entry["credit_type"] == "A"
+    assert entry["trace_id"] == span.trace_id
+
+    # Test: The logger was restored to the way it was.
+    assert logger.handlers == [] and logger.propagate and logger.level == logging.NOTSET
@@ -0,0 +1,321 @@
+r"""
+Span-based tracing of the requests the app handles, without an external collector.
+
+Each traced request gets a "trace", made up of a root span (covering the whole request) and one child span per
+upstream request the app sends while handling it (see `track_upstream_request`); so that, when a request is slow,
+the trace shows which upstream request(s) the time went to. Finished spans are handed to an exporter, which either
+keeps the most recent ones in memory (for the `/api/traces` endpoint) or appends them to a JSON Lines file.
+
+The current span is stored in a context variable, so code anywhere in the request's call stack (including tasks it
+starts) can add attributes to it, or start child spans of it, without it being passed around.
+
+Reference: https://www.w3.org/TR/trace-context/ (the `traceparent` format, which we use to propagate traces)
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Callable, Iterator, Optional, Union
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from nmdc_orcid_creditor.config import Config
+
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+def hash_orcid_id(orcid_id: str) -> str:
+    r"""
+    Returns a pseudonymous identifier of the specified ORCID ID, for use in spans (which shouldn't contain the ORCID
+    IDs themselves); so the spans of one user's requests can be told apart from those of another's.
+
+    >>> hash_orcid_id("0000-0000-0000-0001")
+    '9a38527ca836df1c'
+    """
+
+    return hashlib.sha256(orcid_id.encode("utf-8")).hexdigest()[:16]
+
+
+def parse_traceparent(traceparent: Optional[str]) -> Optional[tuple[str, str]]:
+    r"""
+    Returns the trace ID and parent span ID in the specified `traceparent` header value; or `None` if it is invalid.
+
+    >>> parse_traceparent("00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01")
+    ('0af7651916cd43dd8448eb211c80319c', 'b7ad6b7169203331')
+    >>> parse_traceparent("not a traceparent") is None
+    True
+    """
+
+    match = TRACEPARENT_PATTERN.match((traceparent or "").strip().lower())
+    return None if match is None else (match.group(1), match.group(2))
+
+
+class Span:
+    r"""A timed operation (e.g. an upstream request), which is part of a trace"""
+
+    __slots__ = (
+        "exporter",
+        "trace_id",
+        "span_id",
+        "parent_span_id",
+        "name",
+        "attributes",
+        "status",
+        "started_at",
+        "_started_at_counter",
+        "duration",
+    )
+
+    def __init__(self, exporter: "SpanExporter", trace_id: str, parent_span_id: Optional[str], name: str):
+        self.exporter = exporter
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.attributes: dict[str, Union[str, int, float, bool]] = {}
+        self.status = "ok"
+        self.started_at = time.time()
+        self._started_at_counter = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    @property
+    def is_recording(self) -> bool:
+        return True
+
+    def set_attribute(self, name: str, value: Union[str, int, float, bool]) -> None:
+        self.attributes[name] = value
+
+    def set_error(self, error: BaseException) -> None:
+        self.status = "error"
+        self.attributes["error"] = type(error).__name__
+
+    def end(self) -> None:
+        self.duration = time.perf_counter() - self._started_at_counter
+        self.exporter.export(self)
+
+    @property
+    def traceparent(self) -> str:
+        r"""The `traceparent` value that identifies this span (e.g. as the parent of a span of an upstream service)"""
+
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(timespec="milliseconds"),
+            "duration_ms": None if self.duration is None else round(self.duration * 1000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class NonRecordingSpan:
+    r"""
+    A stand-in for a span, for code running outside of any sampled trace; so that code can add attributes to the
+    current span without checking whether there is one.
+    """
+
+    __slots__ = ()
+
+    is_recording = False
+    traceparent = None
+
+    def set_attribute(self, name: str, value: Union[str, int, float, bool]) -> None:
+        pass
+
+    def set_error(self, error: BaseException) -> None:
+        pass
+
+
+NON_RECORDING_SPAN = NonRecordingSpan()
+
+# The span the current code is running in, if any.
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def get_current_span() -> Union[Span, NonRecordingSpan]:
+    r"""Returns the span the current code is running in; or a non-recording span, if it isn't in a sampled trace"""
+
+    return _current_span.get() or NON_RECORDING_SPAN
+
+
+@contextmanager
+def start_span(name: str) -> Iterator[Union[Span, NonRecordingSpan]]:
+    r"""
+    Runs the code in the `with` block in a new child span of the current span, which ends (and is exported) when the
+    block exits. If the block raises an exception, the span is marked as failed.
+
+    Note: Outside of any sampled trace, this does nothing (beyond yielding a non-recording span); so instrumenting
+          code costs almost nothing for requests that aren't sampled.
+
+    >>> exporter = RingBufferExporter(capacity=10)
+    >>> with Tracer(exporter, sample_rate=1.0).start_trace("GET /api/credits"):
+    ...     with start_span("proxy_get") as span:
+    ...         span.set_attribute("http.status_code", 200)
+    >>> [(span["name"], span["attributes"]) for span in exporter.list_traces()[0]["spans"]]
+    [('GET /api/credits', {}), ('proxy_get', {'http.status_code': 200})]
+    """
+
+    parent = _current_span.get()
+    if parent is None:
+        yield NON_RECORDING_SPAN
+        return
+    span = Span(parent.exporter, parent.trace_id, parent.span_id, name)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as error:
+        span.set_error(error)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+
+class SpanExporter:
+    r"""Somewhere finished spans are sent"""
+
+    def export(self, span: Span) -> None:
+        raise NotImplementedError
+
+
+class RingBufferExporter(SpanExporter):
+    r"""
+    Keeps the most recent `capacity` finished spans in memory, discarding the oldest ones as new ones arrive.
+    """
+
+    def __init__(self, capacity: int):
+        self._spans: deque[Span] = deque(maxlen=capacity)
+
+    def export(self, span: Span) -> None:
+        self._spans.append(span)
+
+    def list_traces(self, limit: Optional[int] = None) -> list[dict]:
+        r"""
+        Returns the (most recent `limit`) traces any of whose spans are in the buffer, most recently finished first;
+        each with its spans in the order in which they started.
+        """
+
+        spans_by_trace_id: dict[str, list[Span]] = {}
+        for span in reversed(self._spans):
+            spans_by_trace_id.setdefault(span.trace_id, []).append(span)
+        trace_ids = list(spans_by_trace_id)[:limit]
+        return [
+            {
+                "trace_id": trace_id,
+                "spans": [span.to_dict() for span in sorted(spans_by_trace_id[trace_id], key=lambda s: s.started_at)],
+            }
+            for trace_id in trace_ids
+        ]
+
+
+class JsonLinesFileExporter(SpanExporter):
+    r"""
+    Appends each finished span, as a line of JSON, to a file.
+
+    Note: The file is line-buffered, so each span reaches the operating system as soon as it is exported; but, since
+          a span is a few hundred bytes, writing one doesn't noticeably block the event loop.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1, encoding="utf-8")
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+
+
+class Tracer:
+    r"""
+    Starts traces (i.e. root spans), a `sample_rate` fraction of which are recorded and sent to the exporter.
+
+    Note: The sampling decision is made once per trace, so each trace is recorded either in full or not at all.
+    """
+
+    def __init__(
+        self,
+        exporter: Optional[SpanExporter],
+        sample_rate: float,
+        should_sample: Callable[[float], bool] = lambda sample_rate: random.random() < sample_rate,
+    ):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self._should_sample = should_sample
+
+    @contextmanager
+    def start_trace(self, name: str, traceparent: Optional[str] = None) -> Iterator[Union[Span, NonRecordingSpan]]:
+        r"""
+        Runs the code in the `with` block in a new root span; or, if the specified `traceparent` value (e.g. from a
+        request header) is valid, in a new span of the trace it identifies.
+        """
+
+        if self.exporter is None or not self._should_sample(self.sample_rate):
+            yield NON_RECORDING_SPAN
+            return
+        trace_id, parent_span_id = parse_traceparent(traceparent) or (f"{random.getrandbits(128):032x}", None)
+        span = Span(self.exporter, trace_id, parent_span_id, name)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.set_error(error)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+
+class TracingMiddleware:
+    r"""
+    Traces the requests whose paths are among the specified ones, recording each one's status code; and continues
+    the trace identified by the request's `traceparent` header, if any.
+    """
+
+    def __init__(self, app: ASGIApp, tracer: Tracer, paths: tuple[str, ...]):
+        self.app = app
+        self.tracer = tracer
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+
+        with self.tracer.start_trace(f"{scope['method']} {scope['path']}", traceparent) as span:
+
+            async def send_wrapper(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.status = "error"
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper if span.is_recording else send)
+
+
+def create_tracer(config: Config) -> Tracer:
+    r"""Returns a tracer that exports spans the way the specified configuration specifies"""
+
+    exporter = None
+    if config.TRACING_EXPORTER == "memory":
+        exporter = RingBufferExporter(capacity=config.TRACING_BUFFER_CAPACITY)
+    elif config.TRACING_EXPORTER == "jsonl":
+        exporter = JsonLinesFileExporter(config.TRACING_JSONL_PATH)
+    return Tracer(exporter, sample_rate=config.TRACING_SAMPLE_RATE)
@@ -0,0 +1,71 @@
+r"""
+The formats in which the NMDC ORCID Creditor Proxy can represent credits in its responses:
+
+- "objects" (the original format): each credit is an object mapping every column name to the credit's value in that
+  column; e.g. `{"credits": [{"column.ORCID_ID": "...", "column.CREDIT_TYPE": "..."}, ...]}`.
+- "columnar": the column names are listed once, and each credit is an array of its values in those columns; e.g.
+  `{"columns": ["column.ORCID_ID", "column.CREDIT_TYPE"], "rows": [["...", "..."], ...]}`. The proxy can also
+  limit the columns to the requested ones.
+
+Since the columnar format doesn't repeat the (long) column names for each credit, its payloads are smaller and
+faster to parse; which matters most for multi-row responses, such as exports of the whole sheet.
+
+Note: Versions of the proxy that predate the columnar format ignore requests for it, and respond in the objects
+      format; so the app accepts either format in every response (see `decode_credits`).
+"""
+
+from typing import Literal, Optional, Sequence
+
+from nmdc_orcid_creditor.credit_model import Credit
+
+WireFormat = Literal["objects", "columnar"]
+
+
+def encode_credits(credits: list[dict], wire_format: WireFormat, columns: Optional[Sequence[str]] = None) -> dict:
+    r"""
+    Returns the properties of a proxy response payload representing the specified credits in the specified format,
+    the way the proxy encodes them (e.g. for stand-ins of the proxy).
+
+    Note: If `columns` is specified, the columnar format includes only those of them that exist. The objects format
+          always includes every column.
+
+    >>> credits = [{"column.ORCID_ID": "0000-0000-0000-0001", "column.CREDIT_TYPE": "Ambassador 2023"}]
+    >>> encode_credits(credits, "objects") == {"credits": credits}
+    True
+    >>> encode_credits(credits, "columnar", columns=["column.CREDIT_TYPE", "column.MISSING"])
+    {'columns': ['column.CREDIT_TYPE'], 'rows': [['Ambassador 2023']]}
+    """
+
+    if wire_format != "columnar":
+        return {"credits": credits}
+    column_names = list(credits[0].keys()) if len(credits) > 0 else []
+    if columns is not None:
+        column_names = [name for name in columns if len(credits) == 0 or name in credits[0]]
+    return {"columns": column_names, "rows": [[credit[name] for name in column_names] for credit in credits]}
+
+
+def decode_credits(payload: dict) -> list[Credit]:
+    r"""
+    Returns the credits (each of which is a `Credit`; i.e. a dictionary mapping column names to values) in the
+    specified proxy response payload, which may be in either format.
+
+    Raises a `KeyError` if the payload contains no credits (e.g. if the proxy responded with an error message).
+
+    >>> decode_credits({"columns": ["column.ORCID_ID", "column.CLAIMED_AT"], "rows": [["0000-0000-0000-0001", ""]]})
+    [{'column.ORCID_ID': '0000-0000-0000-0001', 'column.CLAIMED_AT': ''}]
+    >>> decode_credits({"credits": [{"column.ORCID_ID": "0000-0000-0000-0001"}]})
+    [{'column.ORCID_ID': '0000-0000-0000-0001'}]
+    >>> decode_credits({"error": "Unauthorized. Invalid shared_secret."})
+    Traceback (most recent call last):
+    ...
+    KeyError: 'credits'
+    """
+
+    rows = payload.get("rows")
+    if rows is None:
+        return [Credit(credit) for credit in payload["credits"]]
+
+    # Note: Zipping each row with the (shared) list of column names is much faster than parsing the same column names
+    #       out of the JSON for every credit, as the objects format requires.
+    columns = payload["columns"]
+    return [Credit(zip(columns, row)) for row in rows]